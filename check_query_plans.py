@@ -0,0 +1,127 @@
+"""
+Query plan check for the market price endpoints
+
+Runs EXPLAIN QUERY PLAN for the SQL behind every /prices/* endpoint and for
+alert evaluation and trend computation, and fails if daily_prices, price_rollups or price_alerts
+would be read with a full table scan instead of one of the migration
+indexes.
+"""
+
+import sys
+import sqlite3
+from typing import List
+
+import market_alerts
+import market_analytics
+import market_anomaly
+import market_db
+import market_forecast
+import market_matrix
+import market_queries
+import market_search
+import market_stream
+import market_trends
+
+# Tables big enough that a scan without an index is a regression
+INDEXED_TABLES = {"dp", "daily_prices", "r", "price_rollups", "price_alerts", "f", "price_forecasts"}
+
+
+def _checks(conn):
+    """(name, sql, params, filtered) for every query the endpoints run"""
+    checks = []
+    for name, kwargs in [
+        ("/prices/today", {}),
+        ("/prices/today?state=", {"state": "Jharkhand"}),
+        ("/prices/today/{commodity}", {"commodity": "Tomato", "order_by": "dp.date DESC"}),
+        ("/prices/today/{commodity}?state=", {"commodity": "Tomato", "state": "Jharkhand", "order_by": "dp.date DESC"}),
+        ("/prices/today/{commodity} (alias)", {"commodity_id": 1, "order_by": "dp.date DESC"}),
+        ("/prices/state/{state_name}", {"state": "Jharkhand"}),
+        ("/prices/search (short terms)", {"commodity": "On", "state": "Goa", "market": "Mar"}),
+    ]:
+        query, params = market_queries.price_list_query(**kwargs)
+        checks.append((name, query, params, bool(kwargs.keys() - {"order_by"})))
+    query, params = market_search.search_query(
+        conn, commodity="Tomato", state="Jharkhand", market="Ranchi"
+    )
+    checks.append(("/prices/search", query, params, True))
+    for name, state in [
+        ("/prices/history/{commodity}/{days}", None),
+        ("/prices/history/{commodity}/{days}?state=", "Jharkhand"),
+    ]:
+        query, params = market_queries.history_query("Tomato", 30, state)
+        checks.append((name, query, params, True))
+        query, params = market_queries.history_query("Tomato", 30, state, commodity_id=1)
+        checks.append((name + " (alias)", query, params, True))
+    checks.append((
+        "/prices/analytics/{commodity}",
+        market_analytics.ANALYTICS_WINDOW.format(group="m.state", ids="?"),
+        (1, "2025-01-01", "-90 days"),
+        True
+    ))
+    checks.append((
+        "/prices/forecast/{commodity}",
+        market_forecast.FORECASTS_FOR_COMMODITY,
+        ("Tomato",),
+        True
+    ))
+    for name, commodity_id in [("/prices/nearby", None), ("/prices/nearby?commodity=", 1)]:
+        query, params = market_queries.nearby_prices_query([1, 2, 3], commodity_id)
+        checks.append((name, query, params, True))
+    query, params = market_forecast.history_query("2025-01-01", "2025-03-01", [1, 2], [3, 4])
+    checks.append(("ingest forecasts", query, params, True))
+    query, params = market_matrix.latest_prices_query([1, 2], [3, 4])
+    checks.append(("ingest price matrix", query, params, True))
+    query, params = market_anomaly.history_query([1, 2], [3, 4], "2025-01-01", "2025-01-31")
+    checks.append(("ingest anomaly screen", query, params, True))
+    checks.append((
+        "ingest price stream (previous prices)",
+        market_stream.PREVIOUS_PRICES.format(commodities="?,?", markets="?,?"),
+        (1, 2, 3, 4),
+        True
+    ))
+    query, params = market_trends.trend_query("2025-01-01", "2025-01-15", [1, 2], [3, 4])
+    checks.append(("ingest trends", query, params, True))
+    checks.append((
+        "evaluate_price_alerts (mark triggered)",
+        market_alerts.MARK_ALERT_TRIGGERED,
+        (1,),
+        True
+    ))
+    return checks
+
+
+def _violations(plan: List[str], filtered: bool) -> List[str]:
+    """Plan steps that read a large table without (or with too broad) an index"""
+    bad = []
+    for step in plan:
+        words = step.split()
+        if len(words) < 2 or words[1] not in INDEXED_TABLES:
+            continue
+        if words[0] == "SCAN" and (filtered or "USING" not in step):
+            bad.append(step)
+    return bad
+
+
+def check_query_plans(conn: sqlite3.Connection) -> bool:
+    """Print each endpoint's plan and return False if any one scans"""
+    ok = True
+    for name, query, params, filtered in _checks(conn):
+        plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + query, params)]
+        bad = _violations(plan, filtered)
+        if bad:
+            ok = False
+            print(f"❌ {name}: {'; '.join(bad)}")
+        else:
+            print(f"✓ {name}")
+        for step in plan:
+            print(f"    {step}")
+    return ok
+
+
+if __name__ == "__main__":
+    market_db.init_schema()
+    if check_query_plans(market_db.get_connection()):
+        print("\n✅ Every price endpoint reads daily_prices through an index.")
+    else:
+        print("\n❌ Some price endpoints fall back to full table scans!")
+        sys.exit(1)
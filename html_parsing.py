@@ -0,0 +1,84 @@
+"""
+Region-limited HTML parsing for the price and scheme scrapers
+
+Scraped pages are mostly navigation, scripts and ads around the one table
+or set of cards we read. parse() builds the BeautifulSoup tree for just the
+elements a SoupStrainer matches (tables, scheme cards, scheme links), using
+lxml when it is installed and the stdlib html.parser otherwise, and times
+every page so /health shows what parsing costs per source.
+"""
+
+import os
+import time
+import logging
+import threading
+from importlib.util import find_spec
+from typing import Callable, Dict, Optional
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+logger = logging.getLogger(__name__)
+
+# lxml is an optional speed-up; HTML_PARSER forces a specific parser
+PARSER = os.getenv("HTML_PARSER") or ("lxml" if find_spec("lxml") else "html.parser")
+
+# Price pages: only <table> subtrees are built
+PRICE_TABLES = SoupStrainer("table")
+
+
+def contains_any(*words: str) -> Callable[[Optional[str]], bool]:
+    """Attribute matcher: the value contains any of words, ignoring case"""
+    def matches(value: Optional[str]) -> bool:
+        if not value:
+            return False
+        value = value.lower()
+        return any(word in value for word in words)
+    return matches
+
+
+# Scheme listings: cards and their headings/descriptions, and scheme links
+SCHEME_CARDS = SoupStrainer(["div", "article"], class_=contains_any("scheme", "card"))
+SCHEME_LINKS = SoupStrainer("a", href=contains_any("scheme", "yojana"))
+
+
+class ParseStats:
+    """Pages parsed and parse time per source"""
+
+    def __init__(self):
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, source: str, elapsed_ms: float, size: int):
+        with self._lock:
+            stats = self._stats.setdefault(source, {"pages": 0, "bytes": 0, "total_ms": 0.0, "max_ms": 0.0})
+            stats["pages"] += 1
+            stats["bytes"] += size
+            stats["total_ms"] += elapsed_ms
+            stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+            stats["last_ms"] = elapsed_ms
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "parser": PARSER,
+                "sources": {
+                    source: {
+                        **{name: round(value, 1) for name, value in stats.items()},
+                        "avg_ms": round(stats["total_ms"] / stats["pages"], 2),
+                    }
+                    for source, stats in self._stats.items()
+                },
+            }
+
+
+stats = ParseStats()
+
+
+def parse(html: bytes, only: SoupStrainer, source: str) -> BeautifulSoup:
+    """Parse just the regions of html matched by only, timing it under source"""
+    started = time.perf_counter()
+    soup = BeautifulSoup(html, PARSER, parse_only=only)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    stats.record(source, elapsed_ms, len(html))
+    logger.debug(f"Parsed {len(html)} bytes of {source} in {elapsed_ms:.1f} ms")
+    return soup
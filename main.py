@@ -3,40 +3,158 @@ Agriculture Portal - Python FastAPI Backend
 Main application entry point
 """
 
-from fastapi import FastAPI, Request, Depends, HTTPException, status, Body
+from fastapi import FastAPI, Request, Response, Depends, HTTPException, status, Body, Query, UploadFile, File, Header
 from dotenv import load_dotenv
 
 load_dotenv()
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, StreamingResponse
+from fastapi.routing import APIRoute
+from starlette.routing import Match
+from starlette.concurrency import run_in_threadpool
+from market_cache import price_cache
 from sqlalchemy.orm import Session
 import uvicorn
 import requests
 import json
 import os
+import secrets
+import shutil
+import tempfile
+from contextlib import asynccontextmanager
 
 # Market price scraping imports
-import sqlite3
 import logging
-import re
 from datetime import datetime
-from bs4 import BeautifulSoup
 from typing import List, Optional
 
 from database import engine, get_db
+import html_parsing
+import market_alerts
+import market_aliases
+import market_analytics
+import market_anomaly
+import market_backfill
+import market_db
+import market_forecast
+import market_geo
+import market_ingest
+import market_matrix
+import market_notify
+import market_queries
+import market_retention
+import market_scraper
+import market_search
+import market_stream
+from market_scraper import SUPPORTED_STATES
+from warmup import warmup, WARMUP_ENABLED
 from models import Base
 from routers import auth, farmers, customers, admin, ml_predictions, speech, multi_language, chatbot, weather, translate_api, soil_analysis, marketplace, disease
 
 # Create database tables
 Base.metadata.create_all(bind=engine)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start warm-up and alert delivery once serving begins; close DB handles on exit"""
+    if WARMUP_ENABLED:
+        warmup.start([
+            # Scrape government schemes on startup
+            ("government_schemes", scrape_government_schemes),
+            # Scrape data on startup (Jharkhand as seed)
+            ("seed_scrape_jharkhand", lambda: _seed_scrape("Jharkhand")),
+            ("market_id_cache", lambda: market_ingest.ids.warm(market_db.get_connection())),
+            ("alert_index", lambda: market_alerts.index.load(market_db.get_connection())),
+            ("commodity_aliases", lambda: market_aliases.aliases.load(market_db.get_connection())),
+            ("market_grid", lambda: market_geo.grid.load(market_db.get_connection())),
+            ("price_matrix", lambda: market_matrix.pivot.load(market_db.get_connection())),
+            ("retention", market_retention.run_retention),
+        ])
+    if market_notify.DELIVERY_ENABLED:
+        market_notify.worker.start()
+    market_stream.broker.start()
+    yield
+    market_stream.broker.stop()
+    price_cache.close()
+    await market_notify.worker.stop()
+    market_db.close_connections()
+
+
+def _seed_scrape(state_name: str):
+    report = market_scraper.scrape_state(state_name)
+    if report["status"] == "error":
+        raise RuntimeError(report["error"])
+
+
 app = FastAPI(
     title="Agriculture Portal",
     description="A comprehensive agriculture portal with ML predictions and e-commerce",
-    version="2.0.0"
+    version="2.0.0",
+    lifespan=lifespan
 )
 
+# Response headers replayed with a cached /prices/* body
+CACHED_HEADERS = ("content-type", "x-next-cursor")
+
+
+_price_routes: List[tuple] = []
+
+
+def _declared_query_params(request: Request) -> frozenset:
+    """Names of the query params the /prices/* route serving request accepts"""
+    if not _price_routes:
+        _price_routes.extend(
+            (route, frozenset(param.alias for param in route.dependant.query_params))
+            for route in app.routes
+            if isinstance(route, APIRoute) and route.path.startswith("/prices/")
+        )
+    for route, params in _price_routes:
+        if route.matches(request.scope)[0] == Match.FULL:
+            return params
+    return frozenset()
+
+
+@app.middleware("http")
+async def price_response_cache(request: Request, call_next):
+    """Serve read-only /prices/* responses from the generation-stamped cache.
+
+    The ETag is the data generation, so a matching If-None-Match gets a 304
+    and a cached body is reused until the next ingest commits.
+    """
+    if request.method != "GET" or not request.url.path.startswith("/prices/") \
+            or request.url.path == "/prices/stream" \
+            or request.query_params.get("format") == "ndjson":
+        return await call_next(request)
+
+    price_cache.sync()
+    key = price_cache.key(request.url.path, request.query_params.multi_items(), _declared_query_params(request))
+    generation = price_cache.generation
+    etag = price_cache.etag(generation)
+    cache_headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+    not_modified = request.headers.get("if-none-match") == etag
+    cached = None if not_modified else price_cache.get(key)
+    if not_modified or cached is not None:
+        # Handlers are skipped, so kick off stale-state refreshes from here
+        state = request.query_params.get("state")
+        if state and request.url.path.startswith("/prices/today"):
+            market_scraper.revalidate_in_background(state)
+        if not_modified:
+            return Response(status_code=304, headers=cache_headers)
+        body, headers = cached
+        return Response(content=body, headers={**headers, **cache_headers})
+
+    response = await call_next(request)
+    if response.status_code != 200:
+        return response
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    headers = {name: response.headers[name] for name in CACHED_HEADERS if name in response.headers}
+    price_cache.put(key, generation, body, headers)
+    return Response(content=body, headers={**headers, **cache_headers})
+
+
 # Mount static files
 app.mount("/template", StaticFiles(directory="templates"), name="templates")
 # Serve uploaded files (for disease image previews)
@@ -171,190 +289,34 @@ async def schemes_page(request: Request):
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Database setup
-DB_PATH = "market_prices.db"
-
-# Supported states (display names) for convenience in frontend
-SUPPORTED_STATES = [
-    "Andhra Pradesh", "Arunachal Pradesh", "Assam", "Bihar", "Chhattisgarh",
-    "Goa", "Gujarat", "Haryana", "Himachal Pradesh", "Jharkhand",
-    "Karnataka", "Kerala", "Madhya Pradesh", "Maharashtra", "Manipur",
-    "Meghalaya", "Mizoram", "Nagaland", "Odisha", "Punjab",
-    "Rajasthan", "Sikkim", "Tamil Nadu", "Telangana", "Tripura",
-    "Uttar Pradesh", "Uttarakhand", "West Bengal", "Delhi", "Puducherry",
-    "Jammu and Kashmir", "Ladakh"
-]
-
 def init_db():
     """Initialize the database with required tables"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-
-    # Create tables
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS commodities (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT UNIQUE NOT NULL,
-            category TEXT,
-            unit TEXT,
-            local_names TEXT
-        )
-    """)
-
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS markets (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            city TEXT,
-            state TEXT NOT NULL,
-            market_type TEXT,
-            is_active BOOLEAN DEFAULT 1
-        )
-    """)
-
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS daily_prices (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            commodity_id INTEGER,
-            market_id INTEGER,
-            price REAL,
-            min_price REAL,
-            max_price REAL,
-            modal_price REAL,
-            date TEXT,
-            trend_percent REAL,
-            FOREIGN KEY (commodity_id) REFERENCES commodities (id),
-            FOREIGN KEY (market_id) REFERENCES markets (id)
-        )
-    """)
-
-    # Alerts table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS price_alerts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            farmer_id TEXT,
-            commodity TEXT NOT NULL,
-            target_price REAL NOT NULL,
-            alert_type TEXT CHECK(alert_type IN ('below','above')) NOT NULL,
-            status TEXT DEFAULT 'active',
-            created_at TEXT DEFAULT (datetime('now')),
-            triggered_at TEXT
-        )
-    """)
-
-    # Government schemes table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS government_schemes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            description TEXT,
-            eligibility TEXT,
-            income_category TEXT,
-            application_process TEXT,
-            required_documents TEXT,
-            benefits TEXT,
-            target_beneficiaries TEXT,
-            state_applicability TEXT,
-            application_link TEXT,
-            last_updated TEXT,
-            scraped_at TEXT DEFAULT (datetime('now'))
-        )
-    """)
-
-    conn.commit()
-    conn.close()
+    market_db.init_schema()
 
 
 def get_or_create_commodity(commodity_name):
     """Get commodity ID or create new commodity"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-
-    # Check if commodity exists
-    cursor.execute("SELECT id FROM commodities WHERE name = ?", (commodity_name,))
-    result = cursor.fetchone()
-
-    if result:
-        commodity_id = result[0]
-    else:
-        # Create new commodity
-        cursor.execute(
-            "INSERT INTO commodities (name, category, unit) VALUES (?, ?, ?)",
-            (commodity_name, "vegetable", "kg")
-        )
-        commodity_id = cursor.lastrowid
-
-    conn.commit()
-    conn.close()
-    return commodity_id
+    return market_ingest.get_commodity_id(commodity_name)
 
 
 def get_or_create_market(market_name, city, state):
     """Get market ID or create new market"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-
-    # Check if market exists
-    cursor.execute(
-        "SELECT id FROM markets WHERE name = ? AND city = ? AND state = ?",
-        (market_name, city, state)
-    )
-    result = cursor.fetchone()
-
-    if result:
-        market_id = result[0]
-    else:
-        # Create new market
-        cursor.execute(
-            "INSERT INTO markets (name, city, state, market_type) VALUES (?, ?, ?, ?)",
-            (market_name, city, state, "wholesale")
-        )
-        market_id = cursor.lastrowid
-
-    conn.commit()
-    conn.close()
-    return market_id
+    return market_ingest.get_market_id(market_name, city, state)
 
 
 def save_price_data(commodity_name, market_name, city, state, price, min_price, max_price, modal_price):
     """Save price data to database"""
     try:
-        # Get or create commodity
-        commodity_id = get_or_create_commodity(commodity_name)
-
-        # Get or create market
-        market_id = get_or_create_market(market_name, city, state)
-
-        # Save price data
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-
-        # Check if price data for today already exists
-        today = datetime.now().strftime('%Y-%m-%d')
-        cursor.execute("""
-            SELECT id FROM daily_prices
-            WHERE commodity_id = ? AND market_id = ? AND date = ?
-        """, (commodity_id, market_id, today))
-
-        result = cursor.fetchone()
-
-        if result:
-            # Update existing record
-            cursor.execute("""
-                UPDATE daily_prices
-                SET price = ?, min_price = ?, max_price = ?, modal_price = ?
-                WHERE id = ?
-            """, (price, min_price, max_price, modal_price, result[0]))
-        else:
-            # Insert new record
-            cursor.execute("""
-                INSERT INTO daily_prices
-                (commodity_id, market_id, price, min_price, max_price, modal_price, date)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (commodity_id, market_id, price, min_price, max_price, modal_price, today))
-
-        conn.commit()
-        conn.close()
+        market_ingest.ingest_prices([{
+            "commodity": commodity_name,
+            "market_name": market_name,
+            "city": city,
+            "state": state,
+            "price": price,
+            "min_price": min_price,
+            "max_price": max_price,
+            "modal_price": modal_price
+        }])
 
         logger.info(f"Saved price data for {commodity_name} in {market_name}, {city}, {state}")
         return True
@@ -363,61 +325,58 @@ def save_price_data(commodity_name, market_name, city, state, price, min_price,
         return False
 
 
-def _slugify_state(state_name: str) -> str:
-    """Convert state display name to vegetablemarketprice.com slug"""
-    name = state_name.strip().lower()
-    name = re.sub(r"&", " and ", name)
-    name = re.sub(r"\s+", "-", name)
-    name = re.sub(r"[^a-z\-]", "", name)
-    return name
+def save_state_prices(prices: List[dict]) -> int:
+    """Save a whole state's scraped rows in one batched upsert"""
+    try:
+        return market_ingest.ingest_prices(prices)
+    except Exception as e:
+        logger.error(f"Error saving price batch: {e}")
+        return 0
 
 
 def scrape_state_data(state_name: str) -> List[dict]:
     """Scrape vegetable market prices for given state from vegetablemarketprice.com"""
-    state_slug = _slugify_state(state_name)
-    url = f"https://vegetablemarketprice.com/market/{state_slug}/today"
+    return market_scraper.scrape_state(state_name)["prices"]
 
 
 def save_scheme_to_db(scheme):
     """Save a scheme to the database"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        with market_db.transaction() as conn:
+            cursor = conn.cursor()
         
-        # Check if scheme already exists
-        cursor.execute("SELECT id FROM government_schemes WHERE name = ?", (scheme['name'],))
-        existing = cursor.fetchone()
+            # Check if scheme already exists
+            cursor.execute("SELECT id FROM government_schemes WHERE name = ?", (scheme['name'],))
+            existing = cursor.fetchone()
         
-        if existing:
-            # Update existing scheme
-            cursor.execute("""
-                UPDATE government_schemes 
-                SET description=?, eligibility=?, income_category=?, application_process=?,
-                    required_documents=?, benefits=?, target_beneficiaries=?, state_applicability=?,
-                    application_link=?, last_updated=?, scraped_at=datetime('now')
-                WHERE name=?
-            """, (
-                scheme['description'], scheme['eligibility'], ','.join(scheme['income_category']),
-                scheme['application_process'], ','.join(scheme['required_documents']), scheme['benefits'],
-                scheme['target_beneficiaries'], scheme['state_applicability'], scheme['application_link'],
-                scheme['last_updated'], scheme['name']
-            ))
-        else:
-            # Insert new scheme
-            cursor.execute("""
-                INSERT INTO government_schemes 
-                (name, description, eligibility, income_category, application_process, required_documents,
-                 benefits, target_beneficiaries, state_applicability, application_link, last_updated)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                scheme['name'], scheme['description'], scheme['eligibility'], ','.join(scheme['income_category']),
-                scheme['application_process'], ','.join(scheme['required_documents']), scheme['benefits'],
-                scheme['target_beneficiaries'], scheme['state_applicability'], scheme['application_link'],
-                scheme['last_updated']
-            ))
+            if existing:
+                # Update existing scheme
+                cursor.execute("""
+                    UPDATE government_schemes 
+                    SET description=?, eligibility=?, income_category=?, application_process=?,
+                        required_documents=?, benefits=?, target_beneficiaries=?, state_applicability=?,
+                        application_link=?, last_updated=?, scraped_at=datetime('now')
+                    WHERE name=?
+                """, (
+                    scheme['description'], scheme['eligibility'], ','.join(scheme['income_category']),
+                    scheme['application_process'], ','.join(scheme['required_documents']), scheme['benefits'],
+                    scheme['target_beneficiaries'], scheme['state_applicability'], scheme['application_link'],
+                    scheme['last_updated'], scheme['name']
+                ))
+            else:
+                # Insert new scheme
+                cursor.execute("""
+                    INSERT INTO government_schemes 
+                    (name, description, eligibility, income_category, application_process, required_documents,
+                     benefits, target_beneficiaries, state_applicability, application_link, last_updated)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, (
+                    scheme['name'], scheme['description'], scheme['eligibility'], ','.join(scheme['income_category']),
+                    scheme['application_process'], ','.join(scheme['required_documents']), scheme['benefits'],
+                    scheme['target_beneficiaries'], scheme['state_applicability'], scheme['application_link'],
+                    scheme['last_updated']
+                ))
         
-        conn.commit()
-        conn.close()
         return True
     except Exception as e:
         logger.error(f"Error saving scheme to database: {e}")
@@ -427,19 +386,18 @@ def save_scheme_to_db(scheme):
 def get_schemes_from_db() -> List[dict]:
     """Get schemes from database"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        with market_db.connection() as conn:
+            cursor = conn.cursor()
         
-        cursor.execute("""
-            SELECT id, name, description, eligibility, income_category, application_process,
-                   required_documents, benefits, target_beneficiaries, state_applicability,
-                   application_link, last_updated
-            FROM government_schemes
-            ORDER BY scraped_at DESC
-        """)
+            cursor.execute("""
+                SELECT id, name, description, eligibility, income_category, application_process,
+                       required_documents, benefits, target_beneficiaries, state_applicability,
+                       application_link, last_updated
+                FROM government_schemes
+                ORDER BY scraped_at DESC
+            """)
         
-        rows = cursor.fetchall()
-        conn.close()
+            rows = cursor.fetchall()
         
         schemes = []
         for row in rows:
@@ -484,18 +442,18 @@ def scrape_government_schemes() -> List[dict]:
             
             response = requests.get(url, headers=headers, params=params, timeout=10)
             if response.status_code == 200:
-                soup = BeautifulSoup(response.content, 'html.parser')
+                soup = html_parsing.parse(response.content, html_parsing.SCHEME_CARDS, "myscheme")
                 
                 # Look for scheme cards or listings
-                scheme_cards = soup.find_all(['div', 'article'], class_=lambda x: x and ('scheme' in x.lower() or 'card' in x.lower()))
+                scheme_cards = soup.find_all(['div', 'article'], class_=html_parsing.contains_any('scheme', 'card'))
                 
                 for i, card in enumerate(scheme_cards[:5]):  # Limit to first 5 schemes
                     try:
-                        title_elem = card.find(['h1', 'h2', 'h3', 'h4', 'h5'], class_=lambda x: x and ('title' in x.lower() or 'name' in x.lower()))
+                        title_elem = card.find(['h1', 'h2', 'h3', 'h4', 'h5'], class_=html_parsing.contains_any('title', 'name'))
                         if not title_elem:
                             title_elem = card.find(['h1', 'h2', 'h3', 'h4', 'h5'])
                         
-                        desc_elem = card.find(['p', 'div'], class_=lambda x: x and ('desc' in x.lower() or 'summary' in x.lower()))
+                        desc_elem = card.find(['p', 'div'], class_=html_parsing.contains_any('desc', 'summary'))
                         if not desc_elem:
                             desc_elem = card.find('p')
                         
@@ -527,10 +485,10 @@ def scrape_government_schemes() -> List[dict]:
             agri_url = "https://agriwelfare.gov.in/"
             agri_response = requests.get(agri_url, headers=headers, timeout=10)
             if agri_response.status_code == 200:
-                soup = BeautifulSoup(agri_response.content, 'html.parser')
+                soup = html_parsing.parse(agri_response.content, html_parsing.SCHEME_LINKS, "agriwelfare")
                 
                 # Look for scheme links or mentions
-                scheme_links = soup.find_all('a', href=lambda x: x and ('scheme' in x.lower() or 'yojana' in x.lower()))
+                scheme_links = soup.find_all('a')
                 
                 for link in scheme_links[:3]:  # Limit to first 3
                     try:
@@ -749,54 +707,204 @@ def scrape_government_schemes() -> List[dict]:
         return get_schemes_from_db()
 
 
-# Initialize database
+# Initialize database (local and fast; network warm-up runs in lifespan)
 init_db()
 
-# Scrape government schemes on startup
-print("🔄 Scraping government schemes data on startup...")
-scrape_government_schemes()
-print("✅ Government schemes scraping completed!")
 
-# Scrape data on startup (Jharkhand as seed)
-print("🔄 Scraping Jharkhand market data on startup...")
-scrape_state_data("Jharkhand")
-print("✅ Data scraping completed!")
+# Routes
+@app.get("/health")
+def health_check():
+    """Liveness probe: answers as soon as the server accepts connections"""
+    return {
+        "status": "ok",
+        "warmup": warmup.status(),
+        "price_cache": price_cache.stats(),
+        "alert_delivery": market_notify.worker.status(),
+        "html_parsing": html_parsing.stats.snapshot(),
+        "market_db": market_db.metrics.snapshot(),
+        "anomaly_filter": market_anomaly.stats.snapshot(),
+        "price_stream": market_stream.broker.status(),
+    }
+
+
+@app.get("/ready")
+def readiness_check():
+    """Readiness probe: 503 until every warm-up stage has finished"""
+    status_info = warmup.status()
+    if not status_info["ready"]:
+        raise HTTPException(status_code=503, detail=status_info)
+    return status_info
 
 
-# Routes
 @app.get("/states", response_model=List[str])
 def get_supported_states():
     """Get list of supported states for market price data"""
     return SUPPORTED_STATES
 
 
+@app.get("/states/freshness", response_model=List[dict])
+def get_states_freshness():
+    """Age of each state's price data and whether a refresh is running"""
+    return market_scraper.freshness()
+
+
+@app.get("/commodities/autocomplete", response_model=List[dict])
+def autocomplete_commodities(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(10, ge=1, le=market_aliases.MAX_COMPLETIONS)
+):
+    """Commodities whose name or local name (any word of it) starts with q"""
+    try:
+        with market_db.connection() as conn:
+            market_aliases.aliases.load(conn)
+        return market_aliases.aliases.autocomplete(q, limit)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+
 @app.get("/scrape/state/{state_name}")
 def trigger_state_scrape(state_name: str):
     """Manually trigger data scraping for a specific state"""
     try:
-        prices = scrape_state_data(state_name)
-        return {"message": f"Scraped {len(prices)} prices for {state_name} successfully"}
+        report = market_scraper.scrape_state(state_name)
+        if report["status"] == "error":
+            raise RuntimeError(report["error"])
+        report.pop("prices")
+        if report["status"] == "not_modified":
+            return {"message": f"Prices for {state_name} are unchanged since the last scrape", **report}
+        return {"message": f"Scraped {report['rows']} prices for {state_name} successfully", **report}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Scraping error: {str(e)}")
+
+
+@app.get("/scrape/all")
+def trigger_national_scrape():
+    """Refresh every supported state concurrently and report per-state timings"""
+    try:
+        return market_scraper.refresh_states()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Scraping error: {str(e)}")
 
 
+# Shared secret for the /maintenance endpoints; unset keeps them disabled
+MAINTENANCE_TOKEN = os.getenv("MAINTENANCE_TOKEN")
+
+
+def require_maintenance_token(x_maintenance_token: Optional[str] = Header(None)):
+    """Admin gate: the X-Maintenance-Token header must match MAINTENANCE_TOKEN"""
+    if not MAINTENANCE_TOKEN:
+        raise HTTPException(status_code=403, detail="Maintenance endpoints are disabled; set MAINTENANCE_TOKEN")
+    if not x_maintenance_token or not secrets.compare_digest(x_maintenance_token, MAINTENANCE_TOKEN):
+        raise HTTPException(status_code=401, detail="Missing or invalid X-Maintenance-Token")
+
+
+@app.post("/maintenance/retention", dependencies=[Depends(require_maintenance_token)])
+def trigger_retention():
+    """Downsample prices past the retention horizon and reclaim free pages"""
+    try:
+        return market_retention.run_retention(convert_vacuum=True)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+
+@app.post("/maintenance/backfill", status_code=202, dependencies=[Depends(require_maintenance_token)])
+def start_backfill(
+    file: UploadFile = File(...),
+    unit: str = Query("auto", pattern="^(auto|kg|quintal)$")
+):
+    """Load a historical CSV/Excel price dump in the background.
+
+    Returns the job ID; poll /maintenance/backfill/{job_id} for progress.
+    Prices are taken per quintal when the headers say so (Agmarknet
+    exports), else per kg, unless unit says otherwise.
+    """
+    suffix = os.path.splitext(file.filename or "")[1].lower() or ".csv"
+    if suffix != ".csv" and suffix not in market_backfill.EXCEL_SUFFIXES:
+        raise HTTPException(status_code=400, detail=f"Unsupported file type {suffix}; upload a CSV or .xlsx dump")
+    if suffix in market_backfill.EXCEL_SUFFIXES and not market_backfill.excel_supported():
+        raise HTTPException(status_code=400, detail="Excel dumps need openpyxl on the server; upload a CSV export")
+    with tempfile.NamedTemporaryFile(prefix="backfill-", suffix=suffix, delete=False) as f:
+        shutil.copyfileobj(file.file, f, 1024 * 1024)
+    job_id = market_backfill.jobs.start([f.name], unit, cleanup=True)
+    return {"job_id": job_id, "status_url": f"/maintenance/backfill/{job_id}"}
+
+
+@app.get("/maintenance/backfill/{job_id}", dependencies=[Depends(require_maintenance_token)])
+def get_backfill_status(job_id: str):
+    """Progress (rows loaded, rows/s) of a backfill job, and its report once done"""
+    job = market_backfill.jobs.status(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown backfill job {job_id}")
+    return job
+
+
+QUARANTINE_COLUMNS = (
+    "id", "commodity", "market_name", "city", "state", "price", "min_price", "max_price",
+    "modal_price", "date", "median_price", "robust_z", "reason", "status", "created_at", "reviewed_at"
+)
+
+
+@app.get("/maintenance/quarantine", response_model=List[dict], dependencies=[Depends(require_maintenance_token)])
+async def get_quarantined_prices(
+    status: str = Query("pending", pattern="^(pending|released|rejected)$"),
+    limit: int = Query(100, ge=1, le=1000)
+):
+    """Price rows held back by the anomaly filter, newest first"""
+    try:
+        rows = await market_db.run(
+            market_db.fetchall,
+            f"SELECT {', '.join(QUARANTINE_COLUMNS)} FROM price_quarantine "
+            "WHERE status = ? ORDER BY id DESC LIMIT ?",
+            (status, limit)
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    return [dict(zip(QUARANTINE_COLUMNS, row)) for row in rows]
+
+
+def _review_quarantined(quarantine_id: int, release: bool) -> bool:
+    """Mark a pending row reviewed, ingesting it if released; False if not pending"""
+    with market_db.transaction() as conn:
+        row = conn.execute(
+            f"SELECT {', '.join(QUARANTINE_COLUMNS)} FROM price_quarantine WHERE id = ? AND status = 'pending'",
+            (quarantine_id,)
+        ).fetchone()
+        if row is None:
+            return False
+        if release:
+            market_ingest.ingest_prices([dict(zip(QUARANTINE_COLUMNS, row))], screen=False)
+        conn.execute(
+            "UPDATE price_quarantine SET status = ?, reviewed_at = datetime('now') WHERE id = ?",
+            ("released" if release else "rejected", quarantine_id)
+        )
+    return True
+
+
+@app.post("/maintenance/quarantine/{quarantine_id}/{action}", dependencies=[Depends(require_maintenance_token)])
+async def review_quarantined_price(quarantine_id: int, action: str):
+    """Release a quarantined price into daily_prices, or reject it"""
+    if action not in ("release", "reject"):
+        raise HTTPException(status_code=404, detail=f"Unknown action {action}")
+    try:
+        reviewed = await market_db.run(_review_quarantined, quarantine_id, action == "release")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    if not reviewed:
+        raise HTTPException(status_code=404, detail=f"No pending quarantined price {quarantine_id}")
+    return {"id": quarantine_id, "status": "released" if action == "release" else "rejected"}
+
+
 @app.get("/alerts", response_model=List[dict])
-def get_price_alerts():
+async def get_price_alerts():
     """Get all active price alerts"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-
-        cursor.execute("""
+        rows = await market_db.run(market_db.fetchall, """
             SELECT id, farmer_id, commodity, target_price, alert_type, status, created_at
             FROM price_alerts
             WHERE status = 'active'
             ORDER BY created_at DESC
         """)
 
-        rows = cursor.fetchall()
-        conn.close()
-
         alerts = []
         for row in rows:
             alerts.append({
@@ -814,8 +922,24 @@ def get_price_alerts():
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
 
+def _insert_price_alert(farmer_id: str, commodity: str, target_price: float, alert_type: str) -> int:
+    with market_db.transaction() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            INSERT INTO price_alerts (farmer_id, commodity, target_price, alert_type)
+            VALUES (?, ?, ?, ?)
+        """, (farmer_id, commodity, target_price, alert_type))
+
+        alert_id = cursor.lastrowid
+        market_db.after_commit(
+            lambda: market_alerts.index.add(alert_id, farmer_id, commodity, target_price, alert_type)
+        )
+    return alert_id
+
+
 @app.post("/alerts")
-def create_price_alert(
+async def create_price_alert(
     farmer_id: Optional[str] = Body(None),
     commodity: str = Body(...),
     target_price: float = Body(...),
@@ -827,28 +951,15 @@ def create_price_alert(
         if not farmer_id:
             farmer_id = f"F{datetime.now().strftime('%Y%m%d%H%M%S')}"
 
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-
-        cursor.execute("""
-            INSERT INTO price_alerts (farmer_id, commodity, target_price, alert_type)
-            VALUES (?, ?, ?, ?)
-        """, (farmer_id, commodity, target_price, alert_type))
-
-        alert_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        alert_id = await market_db.run(_insert_price_alert, farmer_id, commodity, target_price, alert_type)
 
         return {"message": "Alert created successfully", "alert_id": alert_id}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
 
-@app.delete("/alerts/{alert_id}")
-def delete_price_alert(alert_id: int):
-    """Delete a price alert by ID"""
-    try:
-        conn = sqlite3.connect(DB_PATH)
+def _delete_price_alert(alert_id: int) -> bool:
+    with market_db.transaction() as conn:
         cursor = conn.cursor()
 
         cursor.execute("""
@@ -858,57 +969,34 @@ def delete_price_alert(alert_id: int):
         """, (alert_id,))
 
         if cursor.rowcount == 0:
-            conn.close()
-            raise HTTPException(status_code=404, detail="Alert not found")
+            return False
+        market_db.after_commit(lambda: market_alerts.index.remove([alert_id]))
+    return True
 
-        conn.commit()
-        conn.close()
 
-        return {"message": "Alert deleted successfully"}
+@app.delete("/alerts/{alert_id}")
+async def delete_price_alert(alert_id: int):
+    """Delete a price alert by ID"""
+    try:
+        deleted = await market_db.run(_delete_price_alert, alert_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Alert not found")
 
+    return {"message": "Alert deleted successfully"}
 
-def evaluate_price_alerts(commodity: str, current_price: float):
-    """Evaluate active price alerts for a commodity and mark triggered ones"""
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-
-        # Get active alerts for this commodity
-        cursor.execute("""
-            SELECT id, farmer_id, target_price, alert_type
-            FROM price_alerts
-            WHERE commodity = ? AND status = 'active'
-        """, (commodity,))
-
-        alerts = cursor.fetchall()
 
-        triggered_alerts = []
-        for alert in alerts:
-            alert_id, farmer_id, target_price, alert_type = alert
+def evaluate_price_alerts(commodity: str, current_price: float):
+    """Evaluate active price alerts for a commodity and mark triggered ones.
 
-            # Check if alert condition is met
-            if (alert_type == 'below' and current_price <= target_price) or \
-               (alert_type == 'above' and current_price >= target_price):
-                # Mark alert as triggered
-                cursor.execute("""
-                    UPDATE price_alerts
-                    SET status = 'triggered', triggered_at = datetime('now')
-                    WHERE id = ?
-                """, (alert_id,))
-
-                triggered_alerts.append({
-                    "id": alert_id,
-                    "farmer_id": farmer_id,
-                    "commodity": commodity,
-                    "current_price": current_price,
-                    "target_price": target_price,
-                    "alert_type": alert_type
-                })
-
-        conn.commit()
-        conn.close()
+    Ingestion evaluates every batch automatically; this checks a single price.
+    """
+    try:
+        with market_db.transaction() as conn:
+            triggered_alerts = market_alerts.index.evaluate(
+                conn, {commodity: (current_price, current_price)}
+            )
 
         # Log triggered alerts
         for alert in triggered_alerts:
@@ -922,223 +1010,347 @@ def evaluate_price_alerts(commodity: str, current_price: float):
         return []
 
 
-@app.get("/prices/today", response_model=List[dict])
-def get_today_prices(state: Optional[str] = None):
-    """Get today's market prices for all commodities"""
+# Rows per fetchmany() batch when streaming NDJSON
+STREAM_BATCH_SIZE = 500
+
+
+def _stream_ndjson(query: str, params: list):
+    """Yield price rows as NDJSON straight from the cursor (constant memory)"""
+    with market_db.dedicated_connection() as conn:
+        cursor = conn.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(STREAM_BATCH_SIZE)
+            if not rows:
+                break
+            yield "".join(
+                json.dumps(market_queries.price_row_to_dict(row), ensure_ascii=False) + "\n"
+                for row in rows
+            )
+
+
+def _parse_cursor(cursor: Optional[str]):
+    if not cursor:
+        return None
     try:
-        # If a specific state is requested, scrape it to refresh then filter by state
-        if state:
-            scrape_state_data(state)
+        return market_queries.decode_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
 
-        cursor.execute("""
-            SELECT dp.id, c.name, m.name, m.city, m.state, dp.price,
-                   dp.min_price, dp.max_price, dp.modal_price, dp.date, dp.trend_percent
-            FROM daily_prices dp
-            JOIN commodities c ON dp.commodity_id = c.id
-            JOIN markets m ON dp.market_id = m.id
-            WHERE (? IS NULL OR m.state LIKE ?)
-            ORDER BY dp.date DESC, c.name
-        """, [state, f"%{state}%"] if state else [None, None])
-
-        rows = cursor.fetchall()
-        conn.close()
-
-        prices = []
-        for row in rows:
-            prices.append({
-                "id": row[0],
-                "commodity": row[1],
-                "market_name": row[2],
-                "city": row[3],
-                "state": row[4],
-                "price": row[5],
-                "min_price": row[6],
-                "max_price": row[7],
-                "modal_price": row[8],
-                "date": row[9],
-                "trend_percent": row[10]
-            })
+async def _price_listing(query: str, params: list, response: Response, limit: Optional[int], output: str):
+    """Run a price listing as JSON (optionally one keyset page) or NDJSON stream"""
+    if output == "ndjson":
+        return StreamingResponse(_stream_ndjson(query, params), media_type="application/x-ndjson")
+
+    rows = await market_db.run(market_db.fetchall, query, params)
+
+    # A full page means there may be more; hand back where to resume
+    if limit is not None and len(rows) == limit:
+        response.headers["X-Next-Cursor"] = market_queries.encode_cursor(rows[-1])
+
+    return [market_queries.price_row_to_dict(row) for row in rows]
+
+
+@app.get("/prices/today", response_model=List[dict])
+async def get_today_prices(
+    response: Response,
+    state: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=market_queries.MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    output: str = Query("json", alias="format", pattern="^(json|ndjson)$")
+):
+    """Get today's market prices for all commodities.
 
-        return prices
+    Pass limit (and the X-Next-Cursor of the previous page as cursor) to page
+    through results, or format=ndjson to stream every row.
+    """
+    after = _parse_cursor(cursor)
+    try:
+        # Serve from the DB right away; stale states refresh in the background
+        if state:
+            market_scraper.revalidate_in_background(state)
+
+        query, params = market_queries.price_list_query(state=state, after=after, limit=limit)
+        return await _price_listing(query, params, response, limit, output)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
 
+def _commodity_prices(commodity: str, state: Optional[str]) -> list:
+    with market_db.connection() as conn:
+        # Any alias ("tamatar", "टमाटर") resolves to an exact commodity_id
+        query, params = market_queries.price_list_query(
+            commodity=commodity,
+            commodity_id=market_aliases.resolve_commodity(conn, commodity),
+            state=state,
+            order_by="dp.date DESC"
+        )
+        return conn.execute(query, params).fetchall()
+
+
 @app.get("/prices/today/{commodity}", response_model=List[dict])
-def get_today_prices_by_commodity(commodity: str, state: Optional[str] = None):
+async def get_today_prices_by_commodity(commodity: str, state: Optional[str] = None):
     """Get today's prices for a specific commodity"""
     try:
-        # If a specific state is requested, scrape it to refresh then filter by state
+        # Serve from the DB right away; stale states refresh in the background
         if state:
-            scrape_state_data(state)
-
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+            market_scraper.revalidate_in_background(state)
 
-        cursor.execute("""
-            SELECT dp.id, c.name, m.name, m.city, m.state, dp.price,
-                   dp.min_price, dp.max_price, dp.modal_price, dp.date, dp.trend_percent
-            FROM daily_prices dp
-            JOIN commodities c ON dp.commodity_id = c.id
-            JOIN markets m ON dp.market_id = m.id
-            WHERE c.name LIKE ? AND (? IS NULL OR m.state LIKE ?)
-            ORDER BY dp.date DESC
-        """, (f"%{commodity}%", state, f"%{state}%"))
-
-        rows = cursor.fetchall()
-        conn.close()
-
-        prices = []
-        for row in rows:
-            prices.append({
-                "id": row[0],
-                "commodity": row[1],
-                "market_name": row[2],
-                "city": row[3],
-                "state": row[4],
-                "price": row[5],
-                "min_price": row[6],
-                "max_price": row[7],
-                "modal_price": row[8],
-                "date": row[9],
-                "trend_percent": row[10]
-            })
+        rows = await market_db.run(_commodity_prices, commodity, state)
 
-        return prices
+        return [market_queries.price_row_to_dict(row) for row in rows]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
 
 @app.get("/prices/state/{state_name}", response_model=List[dict])
-def get_state_prices(state_name: str):
-    """Get prices for a specific state"""
+async def get_state_prices(
+    state_name: str,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=market_queries.MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    output: str = Query("json", alias="format", pattern="^(json|ndjson)$")
+):
+    """Get prices for a specific state (pageable with limit/cursor, or streamed)"""
+    after = _parse_cursor(cursor)
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-
-        cursor.execute("""
-            SELECT dp.id, c.name, m.name, m.city, m.state, dp.price,
-                   dp.min_price, dp.max_price, dp.modal_price, dp.date, dp.trend_percent
-            FROM daily_prices dp
-            JOIN commodities c ON dp.commodity_id = c.id
-            JOIN markets m ON dp.market_id = m.id
-            WHERE m.state LIKE ?
-            ORDER BY dp.date DESC, c.name
-        """, (f"%{state_name}%",))
-
-        rows = cursor.fetchall()
-        conn.close()
-
-        prices = []
-        for row in rows:
-            prices.append({
-                "id": row[0],
-                "commodity": row[1],
-                "market_name": row[2],
-                "city": row[3],
-                "state": row[4],
-                "price": row[5],
-                "min_price": row[6],
-                "max_price": row[7],
-                "modal_price": row[8],
-                "date": row[9],
-                "trend_percent": row[10]
-            })
-
-        return prices
+        query, params = market_queries.price_list_query(state=state_name, after=after, limit=limit)
+        return await _price_listing(query, params, response, limit, output)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
 
+def _search_query(commodity, state, market, after, limit):
+    with market_db.connection() as conn:
+        return market_search.search_query(
+            conn, commodity=commodity, state=state, market=market, after=after, limit=limit
+        )
+
+
 @app.get("/prices/search", response_model=List[dict])
-def search_prices(
+async def search_prices(
+    response: Response,
     commodity: Optional[str] = None,
     state: Optional[str] = None,
-    market: Optional[str] = None
+    market: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=market_queries.MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    output: str = Query("json", alias="format", pattern="^(json|ndjson)$")
 ):
-    """Search prices by commodity, state, and market"""
+    """Search prices by commodity, state, and market.
+
+    Unpaged results are ranked by match quality; with limit/cursor they come
+    newest first so they can be paged.
+    """
+    after = _parse_cursor(cursor)
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        # Ranked full-text match (LIKE for very short terms)
+        query, params = await market_db.run(_search_query, commodity, state, market, after, limit)
+        return await _price_listing(query, params, response, limit, output)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
-        # Build query dynamically
-        query = """
-            SELECT dp.id, c.name, m.name, m.city, m.state, dp.price,
-                   dp.min_price, dp.max_price, dp.modal_price, dp.date, dp.trend_percent
-            FROM daily_prices dp
-            JOIN commodities c ON dp.commodity_id = c.id
-            JOIN markets m ON dp.market_id = m.id
-            WHERE 1=1
-        """
-        params = []
 
-        if commodity:
-            query += " AND c.name LIKE ?"
-            params.append(f"%{commodity}%")
+@app.get("/prices/analytics/{commodity}")
+async def get_price_analytics(commodity: str, group_by: str = Query("state", pattern="^(state|market)$")):
+    """Rolling 7/30/90-day mean, volatility, percentiles and min/max, overall
+    and per state or market, plus where the latest price sits in 90 days"""
+    try:
+        analytics = await market_db.run(market_analytics.get_analytics, commodity, group_by)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    if analytics is None:
+        raise HTTPException(status_code=404, detail=f"No prices found for {commodity}")
+    return analytics
+
 
+def _forecast_rows(commodity: str, state: Optional[str], market: Optional[str]) -> list:
+    with market_db.connection() as conn:
+        commodity_id = market_aliases.resolve_commodity(conn, commodity)
+        if commodity_id is not None:
+            query, params = market_forecast.FORECASTS_FOR_COMMODITY_ID, [commodity_id]
+        else:
+            query, params = market_forecast.FORECASTS_FOR_COMMODITY, [commodity.strip()]
         if state:
-            query += " AND m.state LIKE ?"
+            query += " AND f.market_id IN (SELECT id FROM markets WHERE state LIKE ?)"
             params.append(f"%{state}%")
-
         if market:
-            query += " AND m.name LIKE ?"
+            query += " AND f.market_id IN (SELECT id FROM markets WHERE name LIKE ?)"
             params.append(f"%{market}%")
+        query += " ORDER BY m.state, m.name, f.date"
+        return conn.execute(query, params).fetchall()
 
-        query += " ORDER BY dp.date DESC, c.name"
 
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
-        conn.close()
+@app.get("/prices/forecast/{commodity}", response_model=List[dict])
+async def get_price_forecast(commodity: str, state: Optional[str] = None, market: Optional[str] = None):
+    """Next week's forecast prices per market, refreshed after every ingest"""
+    try:
+        rows = await market_db.run(_forecast_rows, commodity, state, market)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    if not rows:
+        raise HTTPException(status_code=404, detail=f"No forecasts available for {commodity}")
+
+    return [
+        {
+            "commodity": row[0],
+            "market_name": row[1],
+            "city": row[2],
+            "state": row[3],
+            "date": row[4],
+            "horizon_days": row[5],
+            "forecast_price": row[6],
+            "lower": row[7],
+            "upper": row[8],
+            "model": row[9],
+            "generated_at": row[10]
+        }
+        for row in rows
+    ]
+
+
+def _nearby_rows(lat: float, lon: float, radius: float, commodity: Optional[str], limit: int):
+    """(nearest markets, their latest price rows); rows is None for an unknown commodity"""
+    with market_db.connection() as conn:
+        market_geo.grid.load(conn)
+        nearest = market_geo.grid.nearby(lat, lon, radius, limit)
+        commodity_id = None
+        if commodity:
+            commodity_id = market_aliases.resolve_commodity(conn, commodity)
+            if commodity_id is None:
+                return nearest, None
+        if not nearest:
+            return nearest, []
+        query, params = market_queries.nearby_prices_query(
+            [market_id for market_id, _ in nearest], commodity_id
+        )
+        return nearest, conn.execute(query, params).fetchall()
 
-        prices = []
-        for row in rows:
-            prices.append({
-                "id": row[0],
-                "commodity": row[1],
-                "market_name": row[2],
-                "city": row[3],
-                "state": row[4],
-                "price": row[5],
-                "min_price": row[6],
-                "max_price": row[7],
-                "modal_price": row[8],
-                "date": row[9],
-                "trend_percent": row[10]
-            })
 
-        return prices
+@app.get("/prices/nearby", response_model=List[dict])
+async def get_nearby_prices(
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    radius: float = Query(50, gt=0, le=market_geo.MAX_RADIUS_KM),
+    commodity: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=50)
+):
+    """Latest prices at the markets within radius km of (lat, lon), nearest first"""
+    try:
+        nearest, rows = await market_db.run(_nearby_rows, lat, lon, radius, commodity, limit)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    if rows is None:
+        raise HTTPException(status_code=404, detail=f"Unknown commodity {commodity}")
+
+    prices_by_market = {}
+    for row in rows:
+        prices_by_market.setdefault(row[12], []).append(market_queries.price_row_to_dict(row))
+    results = []
+    for market_id, distance in nearest:
+        prices = prices_by_market.get(market_id)
+        if prices:
+            results.append({
+                "market_name": prices[0]["market_name"],
+                "city": prices[0]["city"],
+                "state": prices[0]["state"],
+                "distance_km": distance,
+                "date": prices[0]["date"],
+                "prices": prices
+            })
+    return results
+
+
+def _resolve_commodities(commodities: str):
+    """(IDs, unresolved names) for a comma-separated list of names or aliases"""
+    names = [name.strip() for name in commodities.split(",") if name.strip()]
+    with market_db.connection() as conn:
+        resolved = [(name, market_aliases.resolve_commodity(conn, name)) for name in names]
+    unknown = [name for name, commodity_id in resolved if commodity_id is None]
+    # One entry per commodity even if it was named twice
+    ids = list(dict.fromkeys(commodity_id for _, commodity_id in resolved if commodity_id is not None))
+    return ids, unknown
+
+
+def _matrix(state: Optional[str], commodities: Optional[str]):
+    """Pivot view, or the list of unresolved commodity names"""
+    commodity_ids = None
+    if commodities:
+        commodity_ids, unknown = _resolve_commodities(commodities)
+        if unknown:
+            return unknown
+    return market_matrix.get_matrix(market_scraper.canonical_state(state) or state, commodity_ids)
+
+
+@app.get("/prices/matrix")
+async def get_price_matrix(state: Optional[str] = None, commodities: Optional[str] = None):
+    """Latest modal price of each commodity at each market of a state (every
+    market by default), with the min/max spread and the cheapest and
+    dearest market per commodity. commodities is a comma-separated list of
+    names or aliases; by default every commodity quoted there is included."""
+    try:
+        matrix = await market_db.run(_matrix, state, commodities)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    if isinstance(matrix, list):
+        raise HTTPException(status_code=404, detail=f"Unknown commodities: {', '.join(matrix)}")
+    if not matrix["markets"]:
+        raise HTTPException(status_code=404, detail=f"No prices found for {state or 'any state'}")
+    return matrix
+
+
+@app.get("/prices/stream")
+async def stream_prices(request: Request, state: Optional[str] = None, commodity: Optional[str] = None):
+    """Server-Sent Events feed of price changes as ingestion commits them.
+
+    Each "prices" event carries the (commodity, market) prices that changed
+    in one ingest, with the previous price and percent change; state and
+    commodity (comma-separated names or aliases) narrow the feed. A
+    "resync" event means the client fell behind and should reload.
+    """
+    commodity_ids = None
+    if commodity:
+        try:
+            commodity_ids, unknown = await market_db.run(_resolve_commodities, commodity)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+        if unknown:
+            raise HTTPException(status_code=404, detail=f"Unknown commodities: {', '.join(unknown)}")
+
+    subscription = market_stream.broker.subscribe(market_scraper.canonical_state(state) or state, commodity_ids)
+    return StreamingResponse(
+        market_stream.broker.events(subscription, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
-@app.get("/prices/history/{commodity}/{days}", response_model=List[dict])
-def get_price_history(commodity: str, days: int):
-    """Get historical price data for a commodity"""
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+def _history_rows(commodity: str, days: int, state: Optional[str]) -> list:
+    with market_db.connection() as conn:
+        query, params = market_queries.history_query(
+            commodity, days, market_scraper.canonical_state(state) or state,
+            commodity_id=market_aliases.resolve_commodity(conn, commodity)
+        )
+        return conn.execute(query, params).fetchall()
 
-        cursor.execute("""
-            SELECT dp.date, AVG(dp.price) as avg_price, COUNT(*) as count
-            FROM daily_prices dp
-            JOIN commodities c ON dp.commodity_id = c.id
-            WHERE c.name LIKE ? AND dp.date >= date('now', '-{} days')
-            GROUP BY dp.date
-            ORDER BY dp.date DESC
-        """.format(days), (f"%{commodity}%",))
 
-        rows = cursor.fetchall()
-        conn.close()
+@app.get("/prices/history/{commodity}/{days}", response_model=List[dict])
+async def get_price_history(commodity: str, days: int, state: Optional[str] = None):
+    """Get historical price data for a commodity, optionally for one state.
+
+    Recent days are daily points; older ranges come back as weekly or
+    monthly points (see granularity) once retention has downsampled them.
+    """
+    try:
+        rows = await market_db.run(_history_rows, commodity, days, state)
 
         history = []
         for row in rows:
             history.append({
                 "date": row[0],
                 "avg_price": row[1],
-                "count": row[2]
+                "count": row[2],
+                "granularity": row[3]
             })
 
         return history
@@ -1147,11 +1359,22 @@ def get_price_history(commodity: str, days: int):
 
 
 # Government Schemes API Endpoints
+async def _load_schemes() -> List[dict]:
+    """Stored schemes; scraped once (off the DB pool) if there are none yet.
+
+    Startup warm-up and /api/schemes/refresh keep the table current.
+    """
+    schemes = await market_db.run(get_schemes_from_db)
+    if not schemes:
+        schemes = await run_in_threadpool(scrape_government_schemes)
+    return schemes
+
+
 @app.get("/api/schemes/")
-def get_all_schemes(category: Optional[str] = None, state: Optional[str] = None):
+async def get_all_schemes(category: Optional[str] = None, state: Optional[str] = None):
     """Get all government schemes with optional filtering by category and state"""
     try:
-        schemes = scrape_government_schemes()
+        schemes = await _load_schemes()
         
         # Apply filters if provided
         if category:
@@ -1166,10 +1389,10 @@ def get_all_schemes(category: Optional[str] = None, state: Optional[str] = None)
 
 
 @app.get("/api/schemes/eligible/{income}")
-def get_eligible_schemes(income: float):
+async def get_eligible_schemes(income: float):
     """Get government schemes eligible for a farmer based on their income"""
     try:
-        schemes = scrape_government_schemes()
+        schemes = await _load_schemes()
         
         # Filter schemes based on income
         if income < 200000:  # Small/Marginal Farmers
@@ -1185,10 +1408,10 @@ def get_eligible_schemes(income: float):
 
 
 @app.get("/api/schemes/{scheme_id}")
-def get_scheme_details(scheme_id: int):
+async def get_scheme_details(scheme_id: int):
     """Get details of a specific government scheme by ID"""
     try:
-        schemes = scrape_government_schemes()
+        schemes = await _load_schemes()
         
         # Find scheme by ID
         scheme = next((s for s in schemes if s["id"] == scheme_id), None)
@@ -1202,10 +1425,10 @@ def get_scheme_details(scheme_id: int):
 
 
 @app.get("/api/schemes/search")
-def search_schemes(query: str, category: Optional[str] = None, state: Optional[str] = None):
+async def search_schemes(query: str, category: Optional[str] = None, state: Optional[str] = None):
     """Search government schemes by query term with optional category and state filters"""
     try:
-        schemes = scrape_government_schemes()
+        schemes = await _load_schemes()
         
         # Filter by query term in scheme name or description
         filtered_schemes = [
@@ -1244,15 +1467,11 @@ def refresh_schemes_data():
 
 
 @app.get("/api/schemes/last-updated")
-def get_schemes_last_updated():
+async def get_schemes_last_updated():
     """Get the last updated timestamp for schemes"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT MAX(scraped_at) FROM government_schemes")
-        result = cursor.fetchone()
-        conn.close()
+        rows = await market_db.run(market_db.fetchall, "SELECT MAX(scraped_at) FROM government_schemes")
+        result = rows[0] if rows else None
         
         if result and result[0]:
             return {"last_updated": result[0]}
@@ -0,0 +1,211 @@
+"""
+In-memory threshold index for price alerts
+
+Active alerts are loaded once from price_alerts into per-commodity sorted
+threshold arrays, one for 'below' and one for 'above' alerts. Each ingested
+batch only needs the lowest and highest price per commodity: a 'below'
+alert fires when some market is at or under its target, an 'above' alert
+when some market is at or over it, so the triggered alerts are a suffix or
+prefix of the sorted array found with one binary search (O(log n + k)).
+They leave the index straight away, so no concurrent batch can fire them
+twice, and are marked triggered with a single executemany inside the
+ingest transaction, which also queues their notifications in the outbox;
+a rollback reloads the index from the table.
+"""
+
+import logging
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+
+import market_db
+import market_notify
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_ALERTS = """
+    SELECT id, farmer_id, commodity, target_price, alert_type
+    FROM price_alerts
+    WHERE status = 'active'
+"""
+
+# status = 'active' guards against alerts deleted since the index was loaded
+MARK_ALERT_TRIGGERED = """
+    UPDATE price_alerts
+    SET status = 'triggered', triggered_at = datetime('now')
+    WHERE id = ? AND status = 'active'
+"""
+
+# (lowest, highest) price seen for a commodity in one batch
+PriceRange = Tuple[float, float]
+
+
+def commodity_key(name: str) -> str:
+    """Alerts are typed in by farmers; match commodity names case-insensitively"""
+    return name.strip().casefold()
+
+
+class Thresholds:
+    """Alert IDs kept in ascending order of target price"""
+
+    __slots__ = ("targets", "ids")
+
+    def __init__(self):
+        self.targets = array("d")
+        self.ids = array("q")
+
+    def add(self, target: float, alert_id: int):
+        position = bisect_right(self.targets, target)
+        self.targets.insert(position, target)
+        self.ids.insert(position, alert_id)
+
+    def remove(self, target: float, alert_id: int):
+        position = bisect_left(self.targets, target)
+        while position < len(self.targets) and self.targets[position] == target:
+            if self.ids[position] == alert_id:
+                del self.targets[position]
+                del self.ids[position]
+                return
+            position += 1
+
+    def take_at_or_above(self, price: float) -> List[int]:
+        """Remove and return IDs of thresholds >= price ('below' alerts the price has dropped to)"""
+        position = bisect_left(self.targets, price)
+        taken = self.ids[position:].tolist()
+        del self.targets[position:]
+        del self.ids[position:]
+        return taken
+
+    def take_at_or_below(self, price: float) -> List[int]:
+        """Remove and return IDs of thresholds <= price ('above' alerts the price has risen to)"""
+        position = bisect_right(self.targets, price)
+        taken = self.ids[:position].tolist()
+        del self.targets[:position]
+        del self.ids[:position]
+        return taken
+
+
+class AlertIndex:
+    """Per-commodity 'below'/'above' thresholds for every active alert"""
+
+    def __init__(self):
+        self.below: Dict[str, Thresholds] = {}
+        self.above: Dict[str, Thresholds] = {}
+        # alert id -> (farmer_id, commodity, target_price, alert_type)
+        self.alerts: Dict[int, Tuple[Optional[str], str, float, str]] = {}
+        self._loaded = False
+        self._lock = threading.RLock()
+
+    def load(self, conn):
+        """Build the index from price_alerts (once per process)"""
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            grouped: Dict[Tuple[str, str], List[Tuple[float, int]]] = {}
+            alerts = {}
+            for alert_id, farmer_id, commodity, target, alert_type in conn.execute(ACTIVE_ALERTS):
+                alerts[alert_id] = (farmer_id, commodity, target, alert_type)
+                grouped.setdefault((alert_type, commodity_key(commodity)), []).append((target, alert_id))
+
+            self.below, self.above = {}, {}
+            for (alert_type, key), entries in grouped.items():
+                entries.sort()
+                thresholds = Thresholds()
+                thresholds.targets.extend(target for target, _ in entries)
+                thresholds.ids.extend(alert_id for _, alert_id in entries)
+                (self.below if alert_type == "below" else self.above)[key] = thresholds
+            self.alerts = alerts
+            self._loaded = True
+            logger.info(f"Loaded {len(alerts)} active price alerts into the threshold index")
+
+    def invalidate(self):
+        """Drop the index; the next evaluation reloads it from the table"""
+        with self._lock:
+            self.below, self.above, self.alerts = {}, {}, {}
+            self._loaded = False
+
+    def _side(self, alert_type: str) -> Dict[str, Thresholds]:
+        return self.below if alert_type == "below" else self.above
+
+    def add(self, alert_id: int, farmer_id: Optional[str], commodity: str, target: float, alert_type: str):
+        with self._lock:
+            if not self._loaded or alert_id in self.alerts:
+                return
+            self.alerts[alert_id] = (farmer_id, commodity, target, alert_type)
+            self._side(alert_type).setdefault(commodity_key(commodity), Thresholds()).add(target, alert_id)
+
+    def remove(self, alert_ids: Iterable[int]):
+        with self._lock:
+            for alert_id in alert_ids:
+                alert = self.alerts.pop(alert_id, None)
+                if alert is None:
+                    continue
+                _, commodity, target, alert_type = alert
+                thresholds = self._side(alert_type).get(commodity_key(commodity))
+                if thresholds is not None:
+                    thresholds.remove(target, alert_id)
+
+    def claim(self, prices: Mapping[str, PriceRange]) -> List[dict]:
+        """Remove and return every alert the batch's prices cross"""
+        claimed = []
+        with self._lock:
+            for commodity, (lowest, highest) in prices.items():
+                key = commodity_key(commodity)
+                below = self.below.get(key)
+                if below is not None:
+                    claimed.extend((alert_id, lowest) for alert_id in below.take_at_or_above(lowest))
+                above = self.above.get(key)
+                if above is not None:
+                    claimed.extend((alert_id, highest) for alert_id in above.take_at_or_below(highest))
+
+            triggered = []
+            for alert_id, current_price in claimed:
+                farmer_id, commodity, target, alert_type = self.alerts.pop(alert_id)
+                triggered.append({
+                    "id": alert_id,
+                    "farmer_id": farmer_id,
+                    "commodity": commodity,
+                    "current_price": current_price,
+                    "target_price": target,
+                    "alert_type": alert_type
+                })
+        return triggered
+
+    def evaluate(self, conn, prices: Mapping[str, PriceRange]) -> List[dict]:
+        """Mark every alert crossed by prices as triggered in conn's transaction.
+
+        Must run inside market_db.transaction(); if it rolls back the index
+        is reloaded so the claimed alerts become active again.
+        """
+        self.load(conn)
+        triggered = self.claim(prices)
+        if not triggered:
+            return []
+
+        market_db.after_rollback(self.invalidate)
+        conn.executemany(MARK_ALERT_TRIGGERED, [(alert["id"],) for alert in triggered])
+        market_notify.enqueue(conn, triggered)
+        logger.info(f"Triggered {len(triggered)} price alerts across {len(prices)} commodities")
+        return triggered
+
+
+index = AlertIndex()
+
+
+def batch_price_ranges(rows: Iterable[Tuple[str, float]]) -> Dict[str, PriceRange]:
+    """Lowest and highest price per commodity from (commodity, price) pairs"""
+    ranges: Dict[str, PriceRange] = {}
+    for commodity, price in rows:
+        if price is None:
+            continue
+        current = ranges.get(commodity)
+        if current is None:
+            ranges[commodity] = (price, price)
+        elif price < current[0]:
+            ranges[commodity] = (price, current[1])
+        elif price > current[1]:
+            ranges[commodity] = (current[0], price)
+    return ranges
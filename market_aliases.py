@@ -0,0 +1,201 @@
+"""
+Commodity alias index: canonical names, local names and autocomplete
+
+commodities.local_names is filled from the bundled COMMODITY_ALIASES
+(Hindi and regional names, in Latin and Devanagari script). Every name and
+alias is normalised (NFKC, case-folded, punctuation dropped) into one
+dictionary mapping alias -> commodity_id, so "tamatar", "टमाटर" and
+"Tomato (Local)" all resolve to Tomato in O(len(name)) and price queries can
+filter on commodity_id equality instead of LIKE '%name%'.
+
+A prefix trie over the same aliases (and each of their words) backs
+/commodities/autocomplete; every node keeps its best few completions, so a
+lookup is a walk of len(prefix) nodes.
+"""
+
+import re
+import logging
+import threading
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Completions kept per trie node
+MAX_COMPLETIONS = 10
+
+# Canonical commodity name (as scraped) -> local and alternative names
+COMMODITY_ALIASES: Dict[str, List[str]] = {
+    "Amaranth Leaves": ["chaulai", "चौलाई", "lal saag", "thotakura", "cheera"],
+    "Amla": ["aonla", "आंवला", "indian gooseberry", "nellikai"],
+    "Ash gourd": ["petha", "पेठा", "white pumpkin", "kumbalanga"],
+    "Baby Corn": ["बेबी कॉर्न"],
+    "Banana Flower": ["kele ka phool", "केले का फूल", "banana blossom", "vazhaipoo"],
+    "Beetroot": ["chukandar", "चुकंदर", "beet"],
+    "Bitter Gourd": ["karela", "करेला", "pavakkai", "kakarakaya"],
+    "Bottle Gourd": ["lauki", "लौकी", "ghiya", "dudhi", "sorakaya", "churakka"],
+    "Brinjal": ["baingan", "बैंगन", "eggplant", "aubergine", "vankaya", "kathirikai"],
+    "Brinjal (Big)": ["bharta baingan", "big brinjal", "bada baingan"],
+    "Broad Beans": ["sem", "सेम", "avarakkai"],
+    "Butter Beans": ["double beans", "lima beans"],
+    "Cabbage": ["patta gobhi", "पत्ता गोभी", "band gobhi", "muttaikose"],
+    "Capsicum": ["shimla mirch", "शिमला मिर्च", "bell pepper"],
+    "Carrot": ["gajar", "गाजर"],
+    "Cauliflower": ["phool gobhi", "फूलगोभी", "gobi"],
+    "Cluster beans": ["gawar", "ग्वार", "guar", "kothavarangai"],
+    "Coconut": ["nariyal", "नारियल", "thengai", "kobbari"],
+    "Colocasia": ["arbi", "अरबी", "taro", "seppankizhangu"],
+    "Colocasia Leaves": ["arbi ke patte", "अरबी के पत्ते", "patra"],
+    "Coriander Leaves": ["dhaniya", "धनिया", "kothimbir", "kothamalli", "cilantro"],
+    "Corn": ["makka", "मक्का", "bhutta", "भुट्टा", "maize", "sweet corn"],
+    "Cucumber": ["kheera", "खीरा", "kakdi"],
+    "Curry Leaves": ["kadi patta", "कड़ी पत्ता", "karivepaku", "kariveppilai"],
+    "Dill Leaves": ["suva", "सोआ", "shepu", "soya"],
+    "Drumsticks": ["sahjan", "सहजन", "moringa", "murungakkai"],
+    "Elephant Yam": ["suran", "सूरन", "jimikand", "senai kizhangu"],
+    "Fenugreek Leaves": ["methi", "मेथी"],
+    "French Beans": ["beans", "फ्रेंच बीन्स", "farasbi"],
+    "Garlic": ["lahsun", "लहसुन", "lehsun", "poondu"],
+    "Ginger": ["adrak", "अदरक", "inji", "allam"],
+    "Green Chilli": ["hari mirch", "हरी मिर्च", "mirchi", "chilli"],
+    "Green Peas": ["matar", "मटर", "hara matar", "peas"],
+    "Ivy Gourd": ["kundru", "कुंदरू", "tindora", "tondli", "kovakkai"],
+    "Ladies Finger": ["bhindi", "भिंडी", "okra", "vendakkai"],
+    "Lemon (Lime)": ["nimbu", "नींबू", "lemon", "lime"],
+    "Mango Raw": ["kaccha aam", "कच्चा आम", "kairi", "raw mango"],
+    "Mint Leaves": ["pudina", "पुदीना", "mint"],
+    "Mushroom": ["khumbi", "मशरूम"],
+    "Mustard Leaves": ["sarson ka saag", "सरसों का साग", "sarson"],
+    "Onion Big": ["pyaz", "प्याज", "pyaaz", "kanda", "onion"],
+    "Onion Green": ["hara pyaz", "हरा प्याज", "spring onion", "scallion"],
+    "Onion Small": ["chhota pyaz", "छोटा प्याज", "small onion"],
+    "Potato": ["aloo", "आलू", "batata", "urulaikizhangu"],
+    "Pumpkin": ["kaddu", "कद्दू", "sitaphal", "parangikai"],
+    "Radish": ["mooli", "मूली", "mullangi"],
+    "Raw Banana (Plantain)": ["kaccha kela", "कच्चा केला", "plantain", "vazhakkai"],
+    "Ridge Gourd": ["turai", "तोरई", "tori", "peerkangai", "beerakaya"],
+    "Shallot (Pearl Onion)": ["shallot", "pearl onion", "madras onion"],
+    "Snake Gourd": ["chichinda", "चिचिंडा", "padwal", "pudalangai"],
+    "Sorrel Leaves": ["gongura", "गोंगुरा", "ambadi"],
+    "Spinach": ["palak", "पालक", "keerai"],
+    "Sweet Potato": ["shakarkandi", "शकरकंदी", "sakkaravalli kizhangu"],
+    "Tomato": ["tamatar", "टमाटर", "thakkali", "tameta"],
+}
+
+_PARENTHESISED = re.compile(r"\([^)]*\)")
+
+
+def normalise(name: str) -> str:
+    """NFKC, case-fold, keep letters/marks/digits (so Devanagari survives)"""
+    text = unicodedata.normalize("NFKC", name).casefold()
+    kept = "".join(ch if unicodedata.category(ch)[0] in "LMN" else " " for ch in text)
+    return " ".join(kept.split())
+
+
+def local_names_for(name: str) -> Optional[str]:
+    """Comma-separated bundled aliases for a commodity, as stored in local_names"""
+    aliases = COMMODITY_ALIASES.get(name)
+    return ", ".join(aliases) if aliases else None
+
+
+def populate_local_names(conn):
+    """Migration step: fill commodities.local_names from COMMODITY_ALIASES"""
+    conn.executemany(
+        "UPDATE commodities SET local_names = ? WHERE name = ?",
+        [(", ".join(aliases), name) for name, aliases in COMMODITY_ALIASES.items()]
+    )
+
+
+class _Node:
+    __slots__ = ("children", "completions")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        # (commodity_id, alias) in insertion order, one entry per commodity
+        self.completions: List[Tuple[int, str]] = []
+
+
+class AliasIndex:
+    """Normalised alias -> commodity_id dictionary plus a prefix trie"""
+
+    def __init__(self):
+        self.aliases: Dict[str, int] = {}
+        self.names: Dict[int, str] = {}
+        self.root = _Node()
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def load(self, conn):
+        """Build the index from the commodities table (once per process)"""
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            rows = conn.execute("SELECT id, name, local_names FROM commodities ORDER BY name").fetchall()
+            # Canonical names first so they win alias clashes and lead completions
+            for commodity_id, name, _ in rows:
+                self._add_alias(commodity_id, name, name)
+            for commodity_id, name, local_names in rows:
+                for alias in (local_names or "").split(","):
+                    self._add_alias(commodity_id, name, alias)
+            self._loaded = True
+            logger.info(f"Loaded {len(self.aliases)} aliases for {len(self.names)} commodities")
+
+    def add(self, commodity_id: int, name: str, local_names: Optional[str] = None):
+        """Index a commodity created after the initial load"""
+        with self._lock:
+            if not self._loaded:
+                return
+            self._add_alias(commodity_id, name, name)
+            for alias in (local_names or "").split(","):
+                self._add_alias(commodity_id, name, alias)
+
+    def _add_alias(self, commodity_id: int, name: str, alias: str):
+        key = normalise(alias)
+        if not key:
+            return
+        self.names.setdefault(commodity_id, name)
+        self.aliases.setdefault(key, commodity_id)
+        # Every word start is a way in: "big" completes "Onion Big"
+        words = key.split(" ")
+        for start in range(len(words)):
+            self._insert(" ".join(words[start:]), commodity_id, alias.strip())
+
+    def _insert(self, key: str, commodity_id: int, alias: str):
+        node = self.root
+        for ch in key:
+            node = node.children.setdefault(ch, _Node())
+            if len(node.completions) < MAX_COMPLETIONS and all(
+                existing != commodity_id for existing, _ in node.completions
+            ):
+                node.completions.append((commodity_id, alias))
+
+    def resolve(self, name: str) -> Optional[int]:
+        """commodity_id for any known name or alias, else None"""
+        key = normalise(name)
+        commodity_id = self.aliases.get(key)
+        if commodity_id is None and "(" in name:
+            # "Tomato (Local)" -> "Tomato" when the qualified name is unknown
+            commodity_id = self.aliases.get(normalise(_PARENTHESISED.sub(" ", name)))
+        return commodity_id
+
+    def autocomplete(self, prefix: str, limit: int = MAX_COMPLETIONS) -> List[dict]:
+        node = self.root
+        for ch in normalise(prefix):
+            node = node.children.get(ch)
+            if node is None:
+                return []
+        return [
+            {"commodity_id": commodity_id, "name": self.names[commodity_id], "matched": alias}
+            for commodity_id, alias in node.completions[:limit]
+        ]
+
+
+aliases = AliasIndex()
+
+
+def resolve_commodity(conn, name: str) -> Optional[int]:
+    """Resolve a user-supplied commodity name, loading the index on first use"""
+    aliases.load(conn)
+    return aliases.resolve(name)
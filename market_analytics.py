@@ -0,0 +1,162 @@
+"""
+Rolling price statistics behind /prices/analytics/{commodity}
+
+The last 90 days of a commodity's prices are read once as columnar NumPy
+arrays (price, age in days, group code). Per-group mean, volatility,
+percentiles and min/max for the 7, 30 and 90 day windows then come from
+bincount and sorted-array indexing over every group at once. Responses
+are reused until the next ingest by the generation-stamped /prices/* cache.
+"""
+
+import time
+import logging
+from typing import Dict, List, Optional
+
+import numpy as np
+
+import market_aliases
+import market_db
+import market_queries
+
+logger = logging.getLogger(__name__)
+
+WINDOWS = (7, 30, 90)
+PERCENTILES = (10, 25, 50, 75, 90)
+GROUP_COLUMNS = {"state": "m.state", "market": "m.name"}
+
+# Exact, case-insensitive commodity match (LIKE without wildcards)
+COMMODITY_IDS = "SELECT id FROM commodities WHERE name LIKE ?"
+
+ANALYTICS_WINDOW = """
+    SELECT dp.date, dp.price, {group}
+    FROM daily_prices dp
+    JOIN markets m ON dp.market_id = m.id
+    WHERE dp.commodity_id IN ({ids})
+      AND dp.date > date(?, ?)
+      AND dp.price IS NOT NULL
+"""
+
+
+def _round(values: np.ndarray) -> list:
+    """Two-decimal floats, with NaN (empty group) as None"""
+    return np.where(np.isnan(values), None, np.round(values, 2)).tolist()
+
+
+def grouped_stats(codes: np.ndarray, prices: np.ndarray, n_groups: int) -> Dict[str, list]:
+    """Count, mean, volatility, min/max and percentiles of prices per group code"""
+    if len(prices) == 0:
+        empty = [None] * n_groups
+        return {"count": [0] * n_groups, "mean": empty, "volatility_percent": empty,
+                "min": empty, "max": empty, **{f"p{q}": empty for q in PERCENTILES}}
+    order = np.lexsort((prices, codes))
+    codes, prices = codes[order], prices[order]
+    counts = np.bincount(codes, minlength=n_groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    present = counts > 0
+    safe_counts = np.maximum(counts, 1)
+
+    mean = np.bincount(codes, weights=prices, minlength=n_groups) / safe_counts
+    mean_sq = np.bincount(codes, weights=prices ** 2, minlength=n_groups) / safe_counts
+    std = np.sqrt(np.maximum(mean_sq - mean ** 2, 0))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        volatility = std / mean * 100
+
+    first = np.minimum(starts, len(prices) - 1)
+    last = np.maximum(starts + counts - 1, 0)
+    stats = {
+        "count": counts.tolist(),
+        "mean": np.where(present, mean, np.nan),
+        "volatility_percent": np.where(present & (mean > 0), volatility, np.nan),
+        "min": np.where(present, prices[first], np.nan),
+        "max": np.where(present, prices[last], np.nan),
+    }
+    # Linear interpolation between order statistics, like np.percentile
+    for q in PERCENTILES:
+        position = starts + (safe_counts - 1) * q / 100
+        low = np.minimum(np.floor(position).astype(np.int64), len(prices) - 1)
+        high = np.minimum(np.ceil(position).astype(np.int64), len(prices) - 1)
+        value = prices[low] + (prices[high] - prices[low]) * (position - low)
+        stats[f"p{q}"] = np.where(present, value, np.nan)
+
+    return {name: (values if name == "count" else _round(values)) for name, values in stats.items()}
+
+
+def _summaries(codes: np.ndarray, ages: np.ndarray, prices: np.ndarray, n_groups: int) -> List[dict]:
+    """Latest price, its 90-day percentile rank and every window's stats per group"""
+    # Each group's latest price is the mean over its most recent day
+    newest = np.full(n_groups, np.iinfo(np.int64).max)
+    np.minimum.at(newest, codes, ages)
+    on_newest = ages == newest[codes]
+    latest_counts = np.bincount(codes[on_newest], minlength=n_groups)
+    latest_sums = np.bincount(codes[on_newest], weights=prices[on_newest], minlength=n_groups)
+    latest = latest_sums / np.maximum(latest_counts, 1)
+    # Share of the group's 90-day prices at or below its latest price
+    at_or_below = np.bincount(codes, weights=prices <= latest[codes], minlength=n_groups)
+    rank = at_or_below / np.maximum(np.bincount(codes, minlength=n_groups), 1) * 100
+
+    windows = {}
+    for days in WINDOWS:
+        in_window = ages < days
+        windows[f"{days}d"] = grouped_stats(codes[in_window], prices[in_window], n_groups)
+
+    summaries = []
+    for group in range(n_groups):
+        summaries.append({
+            "latest_price": round(float(latest[group]), 2),
+            "latest_percentile_90d": round(float(rank[group]), 1),
+            "windows": {
+                name: {stat: values[group] for stat, values in stats.items()}
+                for name, stats in windows.items()
+            },
+        })
+    return summaries
+
+
+def compute_analytics(conn, commodity: str, group_by: str = "state") -> Optional[dict]:
+    """Rolling statistics for a commodity, overall and per state or market"""
+    started = time.perf_counter()
+    commodity_id = market_aliases.resolve_commodity(conn, commodity)
+    if commodity_id is not None:
+        ids = [commodity_id]
+    else:
+        ids = [row[0] for row in conn.execute(COMMODITY_IDS, (commodity.strip(),))]
+    if not ids:
+        return None
+
+    query = ANALYTICS_WINDOW.format(group=GROUP_COLUMNS[group_by], ids=market_queries.placeholders(ids))
+    anchor = conn.execute(
+        f"SELECT MAX(date) FROM daily_prices WHERE commodity_id IN ({market_queries.placeholders(ids)})", ids
+    ).fetchone()[0]
+    if anchor is None:
+        return None
+    rows = conn.execute(query, (*ids, anchor, f"-{max(WINDOWS)} days")).fetchall()
+    if not rows:
+        return None
+
+    prices = np.array([row[1] for row in rows], dtype=np.float64)
+    ages = (
+        np.datetime64(anchor, "D") - np.array([row[0] for row in rows], dtype="datetime64[D]")
+    ).astype(np.int64)
+    names, codes = np.unique(np.array([row[2] or "" for row in rows], dtype=object), return_inverse=True)
+    codes = codes.ravel().astype(np.int64)
+
+    overall = _summaries(np.zeros(len(rows), dtype=np.int64), ages, prices, 1)[0]
+    groups = _summaries(codes, ages, prices, len(names))
+
+    logger.info(
+        f"Computed {group_by} analytics for {commodity} over {len(rows)} prices "
+        f"in {(time.perf_counter() - started) * 1000:.1f} ms"
+    )
+    return {
+        "commodity": commodity,
+        "as_of": anchor,
+        "group_by": group_by,
+        "overall": overall,
+        "groups": [{group_by: str(name), **summary} for name, summary in zip(names, groups)],
+    }
+
+
+def get_analytics(commodity: str, group_by: str = "state") -> Optional[dict]:
+    """compute_analytics on the calling thread's connection"""
+    with market_db.connection() as conn:
+        return compute_analytics(conn, commodity, group_by)
@@ -0,0 +1,246 @@
+"""
+Outlier screening for incoming price batches
+
+Scraped prices occasionally arrive in the wrong unit (per quintal instead
+of per kg) or with a typo, and one such row skews averages for weeks. Before
+a batch is written, every row is scored against its own series' recent
+history: the median and median absolute deviation (MAD) of the last
+ANOMALY_LOOKBACK_DAYS of prices for that (commodity, market), computed for
+the whole batch at once in NumPy. Rows whose robust z-score exceeds
+ANOMALY_Z_THRESHOLD, or whose price isn't positive, go to price_quarantine
+for review instead of daily_prices.
+
+Series with fewer than ANOMALY_MIN_HISTORY past prices are not scored. The
+MAD is floored at ANOMALY_MAD_FLOOR of the median, so a series that has sat
+at one price doesn't flag every ordinary move: with the defaults a row must
+be roughly 50% off its median to be held back, while unit slips (x100) and
+dropped or extra digits (x10) always are.
+
+A genuine level shift looks like an outlier too, and the history only
+catches up once the old level leaves the lookback window. So an outlier is
+auto-released when it and its series' previous ANOMALY_SHIFT_ROWS - 1
+pending quarantined prices (one per day, within the lookback) agree with
+each other to within ANOMALY_MAD_FLOOR of their median: from the Nth
+consecutive day at the new level the prices are accepted. The earlier days
+stay in price_quarantine for review. A source that reports in the wrong
+unit for N days running is accepted the same way; set ANOMALY_SHIFT_ROWS=0
+to always hold outliers back.
+"""
+
+import os
+import time
+import logging
+import threading
+from datetime import date as date_type, timedelta
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+import market_queries
+
+logger = logging.getLogger(__name__)
+
+ANOMALY_LOOKBACK_DAYS = int(os.getenv("ANOMALY_LOOKBACK_DAYS", "30"))
+ANOMALY_MIN_HISTORY = int(os.getenv("ANOMALY_MIN_HISTORY", "5"))
+ANOMALY_Z_THRESHOLD = float(os.getenv("ANOMALY_Z_THRESHOLD", "3.5"))
+ANOMALY_MAD_FLOOR = float(os.getenv("ANOMALY_MAD_FLOOR", "0.1"))
+ANOMALY_SHIFT_ROWS = int(os.getenv("ANOMALY_SHIFT_ROWS", "3"))
+
+# Scales the MAD to a standard deviation for normally distributed prices
+MAD_SCALE = 0.6745
+
+HISTORY = """
+    SELECT commodity_id, market_id, price FROM daily_prices
+    WHERE commodity_id IN ({commodities}) AND market_id IN ({markets})
+      AND date >= ? AND date < ?
+"""
+
+# Latest pending outlier per (commodity, market, day), mapped back to IDs
+PENDING_OUTLIERS = """
+    SELECT c.id, m.id, q.price, q.date
+    FROM price_quarantine q
+    JOIN commodities c ON c.name = q.commodity
+    JOIN markets m ON m.name = q.market_name AND IFNULL(m.city, '') = IFNULL(q.city, '') AND m.state = q.state
+    WHERE q.id IN (
+        SELECT MAX(id) FROM price_quarantine
+        WHERE status = 'pending' AND reason = 'outlier' AND date >= ? AND date < ?
+        GROUP BY commodity, market_name, IFNULL(city, ''), state, date
+    )
+      AND c.id IN ({commodities}) AND m.id IN ({markets})
+"""
+
+INSERT_QUARANTINE = """
+    INSERT INTO price_quarantine
+    (commodity, market_name, city, state, price, min_price, max_price, modal_price,
+     date, median_price, robust_z, reason)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# One scored row: (commodity_id, market_id, price, date)
+ScoredRow = Tuple[int, int, float, str]
+
+
+def history_query(commodity_ids, market_ids, first_day: str, last_day: str):
+    """SQL and params for the touched pairs' prices in [first_day, last_day)"""
+    commodity_ids, market_ids = sorted(set(commodity_ids)), sorted(set(market_ids))
+    query = HISTORY.format(
+        commodities=market_queries.placeholders(commodity_ids),
+        markets=market_queries.placeholders(market_ids),
+    )
+    return query, commodity_ids + market_ids + [first_day, last_day]
+
+
+def _series_key(commodity_ids: np.ndarray, market_ids: np.ndarray) -> np.ndarray:
+    return (commodity_ids.astype(np.int64) << 32) | market_ids.astype(np.int64)
+
+
+def robust_scores(batch: List[ScoredRow], history: List[tuple]) -> Tuple[np.ndarray, np.ndarray]:
+    """Per batch row: its series' median and robust z-score (NaN when unscored)"""
+    batch_keys = _series_key(
+        np.fromiter((row[0] for row in batch), dtype=np.int64, count=len(batch)),
+        np.fromiter((row[1] for row in batch), dtype=np.int64, count=len(batch)),
+    )
+    prices = np.array([row[2] for row in batch], dtype=np.float64)
+    series, batch_series = np.unique(batch_keys, return_inverse=True)
+    medians = np.full(len(series), np.nan)
+    mads = np.full(len(series), np.nan)
+
+    if history:
+        hist_keys = _series_key(
+            np.fromiter((row[0] for row in history), dtype=np.int64, count=len(history)),
+            np.fromiter((row[1] for row in history), dtype=np.int64, count=len(history)),
+        )
+        hist_prices = np.array([row[2] for row in history], dtype=np.float64)
+        hist_series = np.searchsorted(series, hist_keys)
+        # The IN lists match a cross product; keep only the batch's own pairs
+        matched = (hist_series < len(series)) & (series[np.minimum(hist_series, len(series) - 1)] == hist_keys)
+        matched &= ~np.isnan(hist_prices)
+        hist_series, hist_prices = hist_series[matched], hist_prices[matched]
+
+        # NaN-padded matrix, one row per series, for row-wise nanmedian
+        order = np.argsort(hist_series, kind="stable")
+        hist_series, hist_prices = hist_series[order], hist_prices[order]
+        counts = np.bincount(hist_series, minlength=len(series))
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        matrix = np.full((len(series), max(int(counts.max(initial=0)), 1)), np.nan)
+        matrix[hist_series, np.arange(len(hist_series)) - starts[hist_series]] = hist_prices
+
+        scored = counts >= ANOMALY_MIN_HISTORY
+        if scored.any():
+            values = matrix[scored]
+            median = np.nanmedian(values, axis=1)
+            medians[scored] = median
+            mads[scored] = np.nanmedian(np.abs(values - median[:, None]), axis=1)
+
+    row_medians = medians[batch_series]
+    spread = np.maximum(mads[batch_series], ANOMALY_MAD_FLOOR * np.abs(row_medians))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = MAD_SCALE * np.abs(prices - row_medians) / spread
+    return row_medians, z
+
+
+def level_shifts(conn, batch: List[ScoredRow], outliers: np.ndarray, first_day: str) -> np.ndarray:
+    """Mask of outliers that complete ANOMALY_SHIFT_ROWS agreeing days (see module docstring)"""
+    shifted = np.zeros(len(batch), dtype=bool)
+    candidates = np.flatnonzero(outliers)
+    if ANOMALY_SHIFT_ROWS < 2 or not len(candidates):
+        return shifted
+    rows = [batch[i] for i in candidates]
+    commodity_ids, market_ids = sorted({row[0] for row in rows}), sorted({row[1] for row in rows})
+    query = PENDING_OUTLIERS.format(
+        commodities=market_queries.placeholders(commodity_ids),
+        markets=market_queries.placeholders(market_ids),
+    )
+    pending: Dict[Tuple[int, int], List[Tuple[str, float]]] = {}
+    for commodity_id, market_id, price, day in conn.execute(
+        query, [first_day, max(row[3] for row in rows)] + commodity_ids + market_ids
+    ):
+        pending.setdefault((commodity_id, market_id), []).append((day, price))
+
+    for i, (commodity_id, market_id, price, day) in zip(candidates, rows):
+        earlier = sorted(
+            (entry for entry in pending.get((commodity_id, market_id), ()) if entry[0] < day), reverse=True
+        )[:ANOMALY_SHIFT_ROWS - 1]
+        if len(earlier) < ANOMALY_SHIFT_ROWS - 1:
+            continue
+        prices = np.array([price] + [entry[1] for entry in earlier], dtype=np.float64)
+        median = np.median(prices)
+        shifted[i] = bool(np.all(np.abs(prices - median) <= ANOMALY_MAD_FLOOR * median))
+    return shifted
+
+
+class ScreenStats:
+    """Batches screened, rows quarantined and time spent"""
+
+    def __init__(self):
+        self._stats: Dict[str, float] = {
+            "batches": 0, "rows": 0, "quarantined": 0, "shifts": 0, "total_ms": 0.0, "max_ms": 0.0
+        }
+        self._lock = threading.Lock()
+
+    def record(self, rows: int, quarantined: int, shifts: int, elapsed_ms: float):
+        with self._lock:
+            self._stats["batches"] += 1
+            self._stats["rows"] += rows
+            self._stats["quarantined"] += quarantined
+            self._stats["shifts"] += shifts
+            self._stats["total_ms"] += elapsed_ms
+            self._stats["max_ms"] = max(self._stats["max_ms"], elapsed_ms)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            stats = {name: round(value, 1) for name, value in self._stats.items()}
+        stats["avg_ms"] = round(stats["total_ms"] / stats["batches"], 2) if stats["batches"] else None
+        stats["z_threshold"] = ANOMALY_Z_THRESHOLD
+        stats["shift_rows"] = ANOMALY_SHIFT_ROWS
+        return stats
+
+
+stats = ScreenStats()
+
+
+def screen(conn, batch: List[ScoredRow], rows: List[dict]) -> np.ndarray:
+    """Mask of batch rows to keep; the rest are written to price_quarantine.
+
+    batch holds (commodity_id, market_id, price, date) for each of rows, the
+    original row dicts. Runs in the caller's transaction.
+    """
+    started = time.perf_counter()
+    if not batch:
+        return np.ones(0, dtype=bool)
+    dates = [row[3] for row in batch]
+    first_day = (date_type.fromisoformat(min(dates)) - timedelta(days=ANOMALY_LOOKBACK_DAYS)).isoformat()
+    query, params = history_query(
+        [row[0] for row in batch], [row[1] for row in batch], first_day, max(dates)
+    )
+    medians, z = robust_scores(batch, conn.execute(query, params).fetchall())
+
+    prices = np.array([row[2] for row in batch], dtype=np.float64)
+    non_positive = ~(prices > 0)
+    outlier = np.nan_to_num(z, nan=0.0) > ANOMALY_Z_THRESHOLD
+    shifted = level_shifts(conn, batch, outlier & ~non_positive, first_day)
+    if shifted.any():
+        logger.info(
+            f"Accepted {int(shifted.sum())} price rows as level shifts "
+            f"after {ANOMALY_SHIFT_ROWS} agreeing days"
+        )
+    keep = ~(non_positive | (outlier & ~shifted))
+
+    quarantined = []
+    for i in np.flatnonzero(~keep):
+        row = rows[i]
+        median = None if np.isnan(medians[i]) else round(float(medians[i]), 2)
+        score = None if np.isnan(z[i]) or np.isinf(z[i]) else round(float(z[i]), 2)
+        quarantined.append((
+            row["commodity"], row["market_name"], row.get("city"), row["state"], row["price"],
+            row.get("min_price"), row.get("max_price"), row.get("modal_price"), batch[i][3],
+            median, score, "non_positive_price" if non_positive[i] else "outlier"
+        ))
+    if quarantined:
+        conn.executemany(INSERT_QUARANTINE, quarantined)
+        logger.warning(
+            f"Quarantined {len(quarantined)} of {len(batch)} price rows "
+            f"({', '.join(sorted({row[0] for row in quarantined})[:5])})"
+        )
+    stats.record(len(batch), len(quarantined), int(shifted.sum()), (time.perf_counter() - started) * 1000)
+    return keep
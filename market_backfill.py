@@ -0,0 +1,375 @@
+"""
+Bulk loader for historical price dumps (Agmarknet CSV/Excel exports)
+
+Rows are streamed from the file (csv module, or openpyxl's read-only mode
+for .xlsx) and written in chunks of CHUNK_ROWS per transaction: commodity
+and market IDs come from the ingest ID cache, daily_prices is upserted
+with one executemany per chunk and the touched rollups are refreshed in
+the same transaction. Trends, forecasts and the price matrix are rebuilt
+once at the end rather than per chunk, and history older than the daily
+retention horizon is downsampled straight away. Rows for a (commodity,
+state) week or month that retention has already folded are skipped, so
+reloading a dump or an overlapping export never counts a period twice.
+
+    python market_backfill.py dump.csv [more.xlsx ...] [--chunk-rows N] [--unit auto|kg|quintal]
+
+The same loader backs POST /maintenance/backfill, which runs it as a
+background job whose progress is polled from /maintenance/backfill/{id}.
+"""
+
+import os
+import csv
+import sys
+import time
+import uuid
+import logging
+import argparse
+import threading
+from datetime import date as date_type, datetime, timedelta
+from importlib.util import find_spec
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import market_cache
+import market_db
+import market_forecast
+import market_ingest
+import market_matrix
+import market_retention
+import market_rollups
+import market_scraper
+import market_trends
+
+logger = logging.getLogger(__name__)
+
+CHUNK_ROWS = int(os.getenv("BACKFILL_CHUNK_ROWS", "20000"))
+
+# Normalised header -> row field; Agmarknet exports name the price columns
+# "Min Price (Rs./Quintal)" etc., which normalise to "min price"
+COLUMNS = {
+    "commodity": "commodity",
+    "commodity name": "commodity",
+    "market": "market_name",
+    "market name": "market_name",
+    "district": "city",
+    "district name": "city",
+    "city": "city",
+    "state": "state",
+    "state name": "state",
+    "price": "price",
+    "min price": "min_price",
+    "max price": "max_price",
+    "modal price": "modal_price",
+    "date": "date",
+    "price date": "date",
+    "arrival date": "date",
+    "reported date": "date",
+}
+REQUIRED = ("commodity", "market_name", "state", "date")
+
+EXCEL_SUFFIXES = (".xlsx", ".xlsm")
+
+DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%d %b %Y", "%d-%b-%Y", "%d %B %Y")
+
+# The scraper stores per-kg prices; Agmarknet quotes per quintal (100 kg)
+UNIT_DIVISORS = {"kg": 1.0, "quintal": 100.0}
+
+
+def _normalise_header(name: str) -> str:
+    name = (name or "").split("(")[0].replace("_", " ")
+    return " ".join(name.lower().split())
+
+
+def _parse_date(value) -> Optional[str]:
+    if isinstance(value, (datetime, date_type)):
+        return value.strftime("%Y-%m-%d")
+    text = str(value or "").strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    return None
+
+
+def _parse_number(value) -> Optional[float]:
+    if value is None or isinstance(value, (int, float)):
+        return value
+    text = str(value).replace(",", "").strip()
+    try:
+        return float(text) if text and text.upper() != "NR" else None
+    except ValueError:
+        return None
+
+
+def excel_supported() -> bool:
+    """Whether openpyxl is installed, so Excel dumps can be read"""
+    return find_spec("openpyxl") is not None
+
+
+def _raw_rows(path: str) -> Iterator[list]:
+    """Header then data rows, streamed from a CSV or Excel file"""
+    if path.lower().endswith(EXCEL_SUFFIXES):
+        if not excel_supported():
+            raise RuntimeError("Loading Excel dumps needs openpyxl (pip install openpyxl)")
+        import openpyxl
+        workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        try:
+            yield from (list(row) for row in workbook.active.iter_rows(values_only=True))
+        finally:
+            workbook.close()
+    else:
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            yield from csv.reader(f)
+
+
+def read_rows(path: str, unit: str = "auto", stats: Optional[dict] = None) -> Iterator[dict]:
+    """Ingest-ready row dicts from a dump; unparseable rows are counted in stats["skipped"]"""
+    stats = stats if stats is not None else {}
+    stats.setdefault("read", 0)
+    stats.setdefault("skipped", 0)
+    rows = _raw_rows(path)
+    header = next(rows, None)
+    if header is None:
+        return
+    fields = [COLUMNS.get(_normalise_header(str(name or ""))) for name in header]
+    missing = [name for name in REQUIRED if name not in fields]
+    if missing or not {"price", "modal_price"} & set(fields):
+        raise ValueError(f"{path}: no column for {', '.join(missing) or 'price'} in header {header}")
+    if unit == "auto":
+        unit = "quintal" if any("quintal" in str(name).lower() for name in header) else "kg"
+    divisor = UNIT_DIVISORS[unit]
+    states: Dict[str, str] = {}
+
+    for values in rows:
+        stats["read"] += 1
+        raw = {field: value for field, value in zip(fields, values) if field}
+        prices = {}
+        for name in ("price", "min_price", "max_price", "modal_price"):
+            number = _parse_number(raw.get(name))
+            prices[name] = None if number is None else round(number / divisor, 2)
+        price = prices["price"] if prices["price"] is not None else prices["modal_price"]
+        day = _parse_date(raw.get("date"))
+        commodity, market, state = (str(raw.get(name) or "").strip() for name in ("commodity", "market_name", "state"))
+        if price is None or day is None or not commodity or not market or not state:
+            stats["skipped"] += 1
+            continue
+        if state not in states:
+            states[state] = market_scraper.canonical_state(state) or state
+        city = str(raw.get("city") or "").strip() or None
+        yield {
+            "commodity": commodity,
+            "market_name": market,
+            "city": city,
+            "state": states[state],
+            "price": price,
+            "min_price": prices["min_price"],
+            "max_price": prices["max_price"],
+            "modal_price": prices["modal_price"],
+            "date": day,
+        }
+
+
+def _chunks(rows: Iterable[dict], size: int) -> Iterator[List[dict]]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def load_chunk(rows: List[dict], stats: dict) -> Tuple[set, set, set]:
+    """Upsert one chunk in a transaction; returns the commodity IDs, market IDs and dates touched.
+
+    Rows in a week or month retention has already folded are skipped and
+    counted in stats["downsampled"]: loading them again would count the
+    period twice.
+    """
+    ids = market_ingest.ids
+    new_commodities: Dict[str, int] = {}
+    new_markets: Dict[market_ingest.MarketKey, int] = {}
+    with market_db.transaction() as conn:
+        ids.warm(conn)
+        commodity_ids = [ids.commodity_id(conn, row["commodity"], new_commodities) for row in rows]
+        days = [row["date"] for row in rows]
+        folded = market_retention.downsampled_periods(conn, commodity_ids, min(days), max(days))
+        params = []
+        rollup_keys = set()
+        for row, commodity_id in zip(rows, commodity_ids):
+            if folded and market_retention.is_downsampled(
+                folded, commodity_id, row["state"], date_type.fromisoformat(row["date"])
+            ):
+                stats["downsampled"] += 1
+                continue
+            market_id = ids.market_id(conn, (row["market_name"], row["city"], row["state"]), new_markets)
+            params.append((
+                commodity_id, market_id, row["price"], row["min_price"],
+                row["max_price"], row["modal_price"], row["date"]
+            ))
+            rollup_keys.add((commodity_id, row["state"], row["date"]))
+        conn.executemany(market_ingest.UPSERT_DAILY_PRICE, params)
+        market_rollups.refresh_rollups(conn, rollup_keys)
+        market_cache.mark_changed(conn)
+        ids.publish(new_commodities, new_markets)
+    return {key[0] for key in rollup_keys}, {param[1] for param in params}, {key[2] for key in rollup_keys}
+
+
+def refresh_derived(commodity_ids: set, market_ids: set, dates: set) -> dict:
+    """Recompute trends, forecasts and the matrix for what a backfill loaded"""
+    first, last = min(dates), max(dates)
+    # Later days' trends look back at the loaded ones
+    until = (date_type.fromisoformat(last) + timedelta(days=market_trends.TREND_LOOKBACK_DAYS)).isoformat()
+    with market_db.connection() as conn:
+        trend_dates = [
+            row[0] for row in conn.execute(
+                "SELECT DISTINCT date FROM daily_prices WHERE date BETWEEN ? AND ? ORDER BY date", (first, until)
+            )
+        ]
+    for start in range(0, len(trend_dates), market_trends.BACKFILL_CHUNK_DAYS):
+        with market_db.transaction() as conn:
+            market_trends.refresh_trends(
+                conn, trend_dates[start:start + market_trends.BACKFILL_CHUNK_DAYS], commodity_ids, market_ids
+            )
+    with market_db.transaction() as conn:
+        forecasts = market_forecast.refresh_forecasts(conn, commodity_ids, market_ids)
+        market_db.after_commit(market_matrix.pivot.invalidate)
+        market_cache.mark_changed(conn)
+
+    report = {"trend_dates": len(trend_dates), "forecast_series": forecasts}
+    horizon = date_type.today() - timedelta(days=market_retention.RETENTION_DAILY_DAYS)
+    if date_type.fromisoformat(first) < horizon:
+        report["retention"] = market_retention.run_retention()
+    return report
+
+
+def load_files(
+    paths: List[str],
+    unit: str = "auto",
+    chunk_rows: int = CHUNK_ROWS,
+    progress: Optional[Callable[[dict], None]] = None
+) -> dict:
+    """Load every file chunk by chunk, then refresh derived data once.
+
+    progress, if given, is called with the running totals after each chunk.
+    """
+    started = time.perf_counter()
+    stats = {"read": 0, "skipped": 0, "downsampled": 0}
+    report = {"files": paths, "rows_loaded": 0, "chunks": 0, "first_date": None, "last_date": None}
+    commodity_ids, market_ids, dates = set(), set(), set()
+
+    for path in paths:
+        report["file"] = path
+        for chunk in _chunks(read_rows(path, unit, stats), chunk_rows):
+            already_downsampled = stats["downsampled"]
+            chunk_commodities, chunk_markets, chunk_dates = load_chunk(chunk, stats)
+            commodity_ids |= chunk_commodities
+            market_ids |= chunk_markets
+            dates |= chunk_dates
+            loaded = report["rows_loaded"] + len(chunk) - (stats["downsampled"] - already_downsampled)
+            elapsed = time.perf_counter() - started
+            report.update(
+                rows_loaded=loaded,
+                chunks=report["chunks"] + 1,
+                rows_read=stats["read"],
+                rows_skipped=stats["skipped"],
+                rows_already_downsampled=stats["downsampled"],
+                rows_per_s=round(loaded / elapsed, 1),
+            )
+            if progress:
+                progress(dict(report, elapsed_s=round(elapsed, 1)))
+            logger.info(f"Backfill: {report['rows_loaded']} rows in {elapsed:.1f} s ({report['rows_per_s']} rows/s)")
+
+    report.update(
+        rows_read=stats["read"], rows_skipped=stats["skipped"], rows_already_downsampled=stats["downsampled"]
+    )
+    report.pop("file", None)
+    if dates:
+        report.update(
+            first_date=min(dates), last_date=max(dates),
+            commodities=len(commodity_ids), markets=len(market_ids),
+        )
+        if progress:
+            progress(dict(report, phase="derived", elapsed_s=round(time.perf_counter() - started, 1)))
+        report.update(refresh_derived(commodity_ids, market_ids, dates))
+    report["elapsed_s"] = round(time.perf_counter() - started, 1)
+    logger.info(f"Backfill finished: {report}")
+    return report
+
+
+class BackfillJobs:
+    """Backfills running in background threads, with their latest progress"""
+
+    def __init__(self):
+        self.jobs: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def start(self, paths: List[str], unit: str = "auto", cleanup: bool = False) -> str:
+        """Run load_files in a thread; cleanup deletes the files afterwards"""
+        job_id = uuid.uuid4().hex[:12]
+        with self._lock:
+            self.jobs[job_id] = {"id": job_id, "status": "running", "progress": {}, "report": None, "error": None}
+        threading.Thread(
+            target=self._run, args=(job_id, paths, unit, cleanup), name=f"backfill-{job_id}", daemon=True
+        ).start()
+        return job_id
+
+    def _run(self, job_id: str, paths: List[str], unit: str, cleanup: bool):
+        def progress(report):
+            with self._lock:
+                self.jobs[job_id]["progress"] = report
+
+        try:
+            report = load_files(paths, unit, progress=progress)
+            update = {"status": "done", "report": report}
+        except Exception as e:
+            logger.warning(f"Backfill {job_id} failed: {e}")
+            update = {"status": "failed", "error": str(e)}
+        finally:
+            if cleanup:
+                for path in paths:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+        with self._lock:
+            self.jobs[job_id].update(update)
+
+    def status(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+
+jobs = BackfillJobs()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("files", nargs="+", help="CSV or .xlsx dumps")
+    parser.add_argument("--unit", choices=["auto", *UNIT_DIVISORS], default="auto",
+                        help="price unit in the dump (auto: quintal if the headers say so)")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+
+    def progress(report):
+        print(
+            f"\r{report['rows_loaded']:>10} rows  {report.get('rows_skipped', 0):>7} skipped  "
+            f"{report.get('rows_per_s') or '-':>9} rows/s  {report['elapsed_s']:>7} s",
+            end="", file=sys.stderr, flush=True
+        )
+
+    market_db.init_schema()
+    try:
+        report = load_files(args.files, args.unit, args.chunk_rows, progress)
+    finally:
+        market_db.close_connections()
+    print(file=sys.stderr)
+    for name, value in report.items():
+        print(f"{name}: {value}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
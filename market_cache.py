@@ -0,0 +1,160 @@
+"""
+Generation-stamped response cache for the read-only /prices/* endpoints
+
+Price data only changes when an ingest commits, so every commit bumps a
+data-generation counter and cached responses are valid exactly as long as
+their generation is current. ETags are derived from the generation, which
+lets clients revalidate with If-None-Match and get a 304 without SQLite
+being touched at all.
+
+Every transaction that changes price data also increments the stored
+generation in cache_generation (mark_changed). Before serving from the
+cache, sync() asks SQLite for PRAGMA data_version, which moves whenever
+another connection commits, and only then re-reads the stored generation;
+so commits by other workers or by the backfill and retention CLIs
+invalidate this process's cache too.
+
+Entries are keyed by path and the route's declared query params only, so
+cache-busting params can't multiply copies of one body, and the cache is
+bounded in bytes as well as entries.
+"""
+
+import os
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Collection, Dict, Optional, Tuple
+
+import market_db
+
+MAX_ENTRIES = int(os.getenv("PRICE_CACHE_ENTRIES", "2048"))
+MAX_BYTES = int(os.getenv("PRICE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Bodies bigger than this are served but never cached
+MAX_ENTRY_BYTES = MAX_BYTES // 8
+
+BUMP_STORED_GENERATION = "UPDATE cache_generation SET generation = generation + 1 WHERE id = 1"
+
+# Query params whose values are case-sensitive and must not be normalised
+CASE_SENSITIVE_PARAMS = {"cursor"}
+
+CacheKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+class GenerationCache:
+    """LRU of response bodies, each stamped with the generation it was built at"""
+
+    def __init__(self, max_entries: int = MAX_ENTRIES, max_bytes: int = MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.generation = 0
+        self.bytes = 0
+        # Distinguishes ETags issued before and after a restart
+        self._boot_id = format(int(time.time()), "x")
+        self._entries: "OrderedDict[CacheKey, Tuple[int, bytes, Dict[str, str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # Watches the database for commits made outside this process
+        self._watch: Optional[sqlite3.Connection] = None
+        self._data_version: Optional[int] = None
+        self._stored_generation: Optional[int] = None
+        self._watch_lock = threading.Lock()
+
+    def bump_generation(self, stored_generation: Optional[int] = None):
+        """Invalidate every cached response (called after each data commit)"""
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self.bytes = 0
+            if stored_generation is not None:
+                self._stored_generation = stored_generation
+
+    def sync(self):
+        """Invalidate if another connection committed a data change since the last call"""
+        with self._watch_lock:
+            try:
+                if self._watch is None:
+                    self._watch = sqlite3.connect(market_db.DB_PATH, check_same_thread=False)
+                version = self._watch.execute("PRAGMA data_version").fetchone()[0]
+                if version == self._data_version:
+                    return
+                self._data_version = version
+                row = self._watch.execute("SELECT generation FROM cache_generation WHERE id = 1").fetchone()
+            except sqlite3.Error:
+                return
+        if row is not None and row[0] != self._stored_generation:
+            self.bump_generation(row[0])
+
+    def close(self):
+        with self._watch_lock:
+            if self._watch is not None:
+                self._watch.close()
+                self._watch = None
+                self._data_version = None
+
+    def etag(self, generation: Optional[int] = None) -> str:
+        return f'W/"{self._boot_id}-{self.generation if generation is None else generation}"'
+
+    @staticmethod
+    def key(path: str, query_params, declared: Collection[str]) -> CacheKey:
+        """Endpoint path plus the sorted, trimmed, case-folded query params
+        the route declares (others can't change the response)"""
+        params = []
+        for name, value in query_params:
+            value = value.strip()
+            if not value or name not in declared:
+                continue
+            params.append((name, value if name in CASE_SENSITIVE_PARAMS else value.lower()))
+        return path.lower().rstrip("/"), tuple(sorted(params))
+
+    def get(self, key: CacheKey) -> Optional[Tuple[bytes, Dict[str, str]]]:
+        """Cached (body, headers) for the current generation, if any"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != self.generation:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1], entry[2]
+
+    def put(self, key: CacheKey, generation: int, body: bytes, headers: Dict[str, str]):
+        """Store a body computed at generation (dropped if an ingest landed since)"""
+        if len(body) > MAX_ENTRY_BYTES:
+            return
+        with self._lock:
+            if generation != self.generation:
+                return
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= len(previous[1])
+            self._entries[key] = (generation, body, headers)
+            self.bytes += len(body)
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                _, (_, evicted, _) = self._entries.popitem(last=False)
+                self.bytes -= len(evicted)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "generation": self.generation,
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+price_cache = GenerationCache()
+
+
+def mark_changed(conn):
+    """Record a price data change in the caller's transaction.
+
+    Bumps the stored generation (seen by other processes through sync())
+    and this process's cache once the transaction commits.
+    """
+    conn.execute(BUMP_STORED_GENERATION)
+    stored = conn.execute("SELECT generation FROM cache_generation WHERE id = 1").fetchone()
+    market_db.after_commit(lambda: price_cache.bump_generation(stored[0] if stored else None))
@@ -0,0 +1,566 @@
+"""
+Connection layer for the market price database (market_prices.db)
+
+Each thread keeps one long-lived sqlite3 connection that is opened lazily,
+configured once with the pragmas below and then reused for every query, so
+request handlers and scrape bursts no longer pay connect/close per statement.
+The module also owns the schema: base tables plus versioned migrations.
+
+Async endpoints reach the database through run(), which executes blocking
+work on a dedicated pool of DB_WORKERS threads (each with its own
+connection) instead of Starlette's shared threadpool, and records how long
+calls queued for a worker and how long they ran.
+"""
+
+import os
+import time
+import asyncio
+import sqlite3
+import threading
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, TypeVar
+
+import market_aliases
+import market_forecast
+import market_geo
+import market_search
+import market_trends
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = os.getenv("MARKET_DB_PATH", "market_prices.db")
+
+# Threads (and so connections) serving async endpoints
+DB_WORKERS = int(os.getenv("MARKET_DB_WORKERS", "8"))
+# Recent calls kept for the latency percentiles in metrics
+METRICS_WINDOW = 2048
+
+# Number of prepared statements sqlite3 keeps per connection
+STATEMENT_CACHE_SIZE = 256
+
+# Applied to every new connection. journal_mode is persistent in the file,
+# the rest are per-connection settings.
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 134217728",
+    "PRAGMA foreign_keys = ON",
+)
+
+# Base tables, created on every startup if missing
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS commodities (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT UNIQUE NOT NULL,
+        category TEXT,
+        unit TEXT,
+        local_names TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS markets (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        city TEXT,
+        state TEXT NOT NULL,
+        market_type TEXT,
+        is_active BOOLEAN DEFAULT 1
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS daily_prices (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        commodity_id INTEGER,
+        market_id INTEGER,
+        price REAL,
+        min_price REAL,
+        max_price REAL,
+        modal_price REAL,
+        date TEXT,
+        trend_percent REAL,
+        FOREIGN KEY (commodity_id) REFERENCES commodities (id),
+        FOREIGN KEY (market_id) REFERENCES markets (id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS price_alerts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        farmer_id TEXT,
+        commodity TEXT NOT NULL,
+        target_price REAL NOT NULL,
+        alert_type TEXT CHECK(alert_type IN ('below','above')) NOT NULL,
+        status TEXT DEFAULT 'active',
+        created_at TEXT DEFAULT (datetime('now')),
+        triggered_at TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS government_schemes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        description TEXT,
+        eligibility TEXT,
+        income_category TEXT,
+        application_process TEXT,
+        required_documents TEXT,
+        benefits TEXT,
+        target_beneficiaries TEXT,
+        state_applicability TEXT,
+        application_link TEXT,
+        last_updated TEXT,
+        scraped_at TEXT DEFAULT (datetime('now'))
+    )
+    """,
+)
+
+# Markets that repeat another's (name, city, state), with NULL and '' cities
+# counted as equal, and the first copy of the market a row points at
+_DUPLICATE_MARKETS = """
+    SELECT id FROM markets
+    WHERE id NOT IN (SELECT MIN(id) FROM markets GROUP BY name, IFNULL(city, ''), state)
+"""
+_FIRST_MARKET_COPY = """
+    SELECT MIN(m2.id) FROM markets m1
+    JOIN markets m2 ON m2.name = m1.name AND IFNULL(m2.city, '') = IFNULL(m1.city, '')
+        AND m2.state = m1.state
+    WHERE m1.id = {table}.market_id
+"""
+
+# Versioned schema steps for the market price tables. migrate() applies the
+# ones newer than the database's PRAGMA user_version, in order, and records
+# the version it reached, so each step runs exactly once per database file.
+# A step is either SQL text or a callable taking the connection.
+MIGRATIONS = (
+    (1, "unique keys for markets and daily_prices", (
+        # Point prices at the first copy of each duplicated market, drop the
+        # other copies, then keep the newest row per (commodity, market, date)
+        """
+        UPDATE daily_prices SET market_id = (
+            SELECT MIN(m2.id) FROM markets m1
+            JOIN markets m2 ON m2.name = m1.name AND m2.city IS m1.city AND m2.state = m1.state
+            WHERE m1.id = daily_prices.market_id
+        )
+        WHERE market_id IN (
+            SELECT id FROM markets
+            WHERE id NOT IN (SELECT MIN(id) FROM markets GROUP BY name, city, state)
+        )
+        """,
+        """
+        DELETE FROM markets
+        WHERE id NOT IN (SELECT MIN(id) FROM markets GROUP BY name, city, state)
+        """,
+        """
+        DELETE FROM daily_prices
+        WHERE id NOT IN (
+            SELECT MAX(id) FROM daily_prices GROUP BY commodity_id, market_id, date
+        )
+        """,
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_markets_name_city_state
+        ON markets (name, city, state)
+        """,
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_daily_prices_commodity_market_date
+        ON daily_prices (commodity_id, market_id, date)
+        """,
+    )),
+    (2, "indexes for /prices/* joins and alert evaluation", (
+        # State-filtered listings drive the join from markets into daily_prices
+        "CREATE INDEX IF NOT EXISTS idx_daily_prices_market_date ON daily_prices (market_id, date)",
+        # Commodity listings and history windows
+        "CREATE INDEX IF NOT EXISTS idx_daily_prices_commodity_date ON daily_prices (commodity_id, date)",
+        # ORDER BY dp.date DESC on unfiltered listings
+        "CREATE INDEX IF NOT EXISTS idx_daily_prices_date ON daily_prices (date)",
+        "CREATE INDEX IF NOT EXISTS idx_markets_state ON markets (state)",
+        "CREATE INDEX IF NOT EXISTS idx_price_alerts_commodity_status ON price_alerts (commodity, status)",
+    )),
+    (3, "daily price rollups per commodity, state and date", (
+        """
+        CREATE TABLE IF NOT EXISTS price_rollups (
+            commodity_id INTEGER NOT NULL,
+            state TEXT NOT NULL,
+            date TEXT NOT NULL,
+            avg_price REAL,
+            min_price REAL,
+            max_price REAL,
+            modal_price REAL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (commodity_id, state, date)
+        ) WITHOUT ROWID
+        """,
+        # All-state history windows range-scan by commodity and date
+        "CREATE INDEX IF NOT EXISTS idx_price_rollups_commodity_date ON price_rollups (commodity_id, date)",
+        """
+        INSERT OR REPLACE INTO price_rollups
+        (commodity_id, state, date, avg_price, min_price, max_price, modal_price, count)
+        SELECT dp.commodity_id, m.state, dp.date, AVG(dp.price), MIN(dp.min_price),
+               MAX(dp.max_price), AVG(dp.modal_price), COUNT(*)
+        FROM daily_prices dp
+        JOIN markets m ON dp.market_id = m.id
+        GROUP BY dp.commodity_id, m.state, dp.date
+        """,
+    )),
+    (4, "FTS5 trigram search over commodity and market names", (
+        market_search.create_search_index,
+    )),
+    (5, "outbox for triggered alert notifications", (
+        """
+        CREATE TABLE IF NOT EXISTS alert_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            alert_id INTEGER NOT NULL,
+            farmer_id TEXT,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            last_error TEXT,
+            created_at TEXT DEFAULT (datetime('now')),
+            delivered_at TEXT
+        )
+        """,
+        # The delivery worker polls for due pending rows
+        "CREATE INDEX IF NOT EXISTS idx_alert_outbox_status_next ON alert_outbox (status, next_attempt_at)",
+    )),
+    (6, "7-day price trend column, with both trends backfilled", (
+        "ALTER TABLE daily_prices ADD COLUMN trend_7d_percent REAL",
+        market_trends.backfill_trends,
+    )),
+    (7, "stored short-horizon price forecasts", (
+        """
+        CREATE TABLE IF NOT EXISTS price_forecasts (
+            commodity_id INTEGER NOT NULL,
+            market_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            horizon INTEGER NOT NULL,
+            forecast REAL,
+            lower REAL,
+            upper REAL,
+            model TEXT,
+            generated_at TEXT,
+            PRIMARY KEY (commodity_id, market_id, date)
+        ) WITHOUT ROWID
+        """,
+        market_forecast.backfill_forecasts,
+    )),
+    (8, "weekly and monthly aggregates for downsampled history", (
+        """
+        CREATE TABLE IF NOT EXISTS price_weekly (
+            commodity_id INTEGER NOT NULL,
+            state TEXT NOT NULL,
+            period_start TEXT NOT NULL,
+            avg_price REAL,
+            min_price REAL,
+            max_price REAL,
+            modal_price REAL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (commodity_id, state, period_start)
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS price_monthly (
+            commodity_id INTEGER NOT NULL,
+            state TEXT NOT NULL,
+            period_start TEXT NOT NULL,
+            avg_price REAL,
+            min_price REAL,
+            max_price REAL,
+            modal_price REAL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (commodity_id, state, period_start)
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_price_weekly_commodity_period ON price_weekly (commodity_id, period_start)",
+        "CREATE INDEX IF NOT EXISTS idx_price_monthly_commodity_period ON price_monthly (commodity_id, period_start)",
+    )),
+    (9, "bundled local names for commodities", (
+        market_aliases.populate_local_names,
+    )),
+    (10, "market coordinates from the bundled gazetteer", (
+        "ALTER TABLE markets ADD COLUMN latitude REAL",
+        "ALTER TABLE markets ADD COLUMN longitude REAL",
+        market_geo.geocode_markets,
+    )),
+    (11, "quarantine for price rows rejected by the anomaly filter", (
+        """
+        CREATE TABLE IF NOT EXISTS price_quarantine (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            commodity TEXT NOT NULL,
+            market_name TEXT NOT NULL,
+            city TEXT,
+            state TEXT NOT NULL,
+            price REAL,
+            min_price REAL,
+            max_price REAL,
+            modal_price REAL,
+            date TEXT NOT NULL,
+            median_price REAL,
+            robust_z REAL,
+            reason TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            created_at TEXT DEFAULT (datetime('now')),
+            reviewed_at TEXT
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_price_quarantine_status ON price_quarantine (status, id)",
+    )),
+    (12, "unique markets when city is NULL", (
+        # The migration 1 index lets (name, NULL, state) repeat, since SQLite
+        # treats NULLs as distinct. Merge those copies (and any '' twin) into
+        # the first one, keeping its prices where both have the same date
+        f"""
+        UPDATE OR IGNORE daily_prices SET market_id = ({_FIRST_MARKET_COPY.format(table="daily_prices")})
+        WHERE market_id IN ({_DUPLICATE_MARKETS})
+        """,
+        f"DELETE FROM daily_prices WHERE market_id IN ({_DUPLICATE_MARKETS})",
+        f"""
+        UPDATE OR IGNORE price_forecasts SET market_id = ({_FIRST_MARKET_COPY.format(table="price_forecasts")})
+        WHERE market_id IN ({_DUPLICATE_MARKETS})
+        """,
+        f"DELETE FROM price_forecasts WHERE market_id IN ({_DUPLICATE_MARKETS})",
+        f"DELETE FROM markets WHERE id IN ({_DUPLICATE_MARKETS})",
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_markets_name_ifnull_city_state
+        ON markets (name, IFNULL(city, ''), state)
+        """,
+    )),
+    (13, "stored data generation for cross-process cache invalidation", (
+        """
+        CREATE TABLE IF NOT EXISTS cache_generation (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            generation INTEGER NOT NULL
+        )
+        """,
+        "INSERT OR IGNORE INTO cache_generation (id, generation) VALUES (1, 0)",
+    )),
+)
+
+_local = threading.local()
+_open_connections = []
+_open_lock = threading.Lock()
+# Bumped by close_connections() so threads drop their stale handles
+_epoch = 0
+
+
+def _connect() -> sqlite3.Connection:
+    """Open and configure a new connection for the calling thread"""
+    conn = sqlite3.connect(
+        DB_PATH,
+        cached_statements=STATEMENT_CACHE_SIZE,
+        check_same_thread=False,
+    )
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    with _open_lock:
+        _open_connections.append(conn)
+    logger.debug(f"Opened market DB connection for thread {threading.get_ident()}")
+    return conn
+
+
+def get_connection() -> sqlite3.Connection:
+    """Return the calling thread's connection, opening it on first use"""
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "epoch", None) != _epoch:
+        conn = _connect()
+        _local.conn = conn
+        _local.epoch = _epoch
+    return conn
+
+
+@contextmanager
+def connection() -> Iterator[sqlite3.Connection]:
+    """Borrow the thread's connection for read-only work"""
+    yield get_connection()
+
+
+@contextmanager
+def transaction() -> Iterator[sqlite3.Connection]:
+    """Borrow the thread's connection inside a write transaction.
+
+    Commits on success and rolls back on error. Nested calls on the same
+    thread join the outermost transaction, which owns the commit, so helpers
+    like get_or_create_market can be composed into one unit of work.
+    """
+    conn = get_connection()
+    depth = getattr(_local, "depth", 0)
+    _local.depth = depth + 1
+    if depth == 0:
+        _local.callbacks = []
+        _local.rollback_callbacks = []
+    try:
+        if depth == 0 and not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        yield conn
+        if depth == 0:
+            conn.commit()
+    except BaseException:
+        if depth == 0:
+            conn.rollback()
+            _local.callbacks = []
+            rollback_callbacks, _local.rollback_callbacks = _local.rollback_callbacks, []
+            for callback in rollback_callbacks:
+                callback()
+        raise
+    finally:
+        _local.depth = depth
+
+    if depth == 0:
+        callbacks, _local.callbacks = _local.callbacks, []
+        _local.rollback_callbacks = []
+        for callback in callbacks:
+            callback()
+
+
+def after_commit(callback: Callable[[], None]):
+    """Run callback once the current transaction commits.
+
+    Callbacks are dropped if the transaction rolls back, and run right away
+    when no transaction is open on this thread.
+    """
+    if getattr(_local, "depth", 0) == 0:
+        callback()
+    else:
+        _local.callbacks.append(callback)
+
+
+def after_rollback(callback: Callable[[], None]):
+    """Run callback if the current transaction rolls back (undo in-memory state)"""
+    if getattr(_local, "depth", 0) > 0:
+        _local.rollback_callbacks.append(callback)
+
+
+def init_schema():
+    """Create the base tables, then apply pending migrations"""
+    with transaction() as conn:
+        for sql in SCHEMA:
+            conn.execute(sql)
+    migrate()
+
+
+@contextmanager
+def dedicated_connection() -> Iterator[sqlite3.Connection]:
+    """A private connection for long reads such as streamed responses.
+
+    Streaming generators are resumed on arbitrary worker threads, so they
+    must not hold a cursor on a thread's shared connection.
+    """
+    conn = sqlite3.connect(DB_PATH, cached_statements=STATEMENT_CACHE_SIZE, check_same_thread=False)
+    try:
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        yield conn
+    finally:
+        conn.close()
+
+
+def migrate():
+    """Apply pending MIGRATIONS in one transaction"""
+    with transaction() as conn:
+        current = conn.execute("PRAGMA user_version").fetchone()[0]
+        for version, description, statements in MIGRATIONS:
+            if version <= current:
+                continue
+            for step in statements:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(f"PRAGMA user_version = {version}")
+            logger.info(f"Applied market DB migration {version}: {description}")
+
+
+def close_connections():
+    """Close every connection opened by this module (used on shutdown)"""
+    global _epoch
+    with _open_lock:
+        _epoch += 1
+        connections = list(_open_connections)
+        _open_connections.clear()
+    for conn in connections:
+        try:
+            conn.close()
+        except sqlite3.Error as e:
+            logger.warning(f"Error closing market DB connection: {e}")
+
+
+T = TypeVar("T")
+
+
+class ExecutorMetrics:
+    """Queue wait and run time of recent calls through run()"""
+
+    def __init__(self, window: int = METRICS_WINDOW):
+        self.calls = 0
+        self.errors = 0
+        self.running = 0
+        self.queue_wait_ms = deque(maxlen=window)
+        self.query_ms = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def started(self, wait_ms: float):
+        with self._lock:
+            self.running += 1
+            self.queue_wait_ms.append(wait_ms)
+
+    def finished(self, run_ms: float, ok: bool):
+        with self._lock:
+            self.running -= 1
+            self.calls += 1
+            self.errors += not ok
+            self.query_ms.append(run_ms)
+
+    @staticmethod
+    def _summary(samples) -> dict:
+        if not samples:
+            return {"avg": None, "p50": None, "p95": None, "max": None}
+        ordered = sorted(samples)
+        return {
+            "avg": round(sum(ordered) / len(ordered), 2),
+            "p50": round(ordered[len(ordered) // 2], 2),
+            "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 2),
+            "max": round(ordered[-1], 2),
+        }
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            queue_wait, query = list(self.queue_wait_ms), list(self.query_ms)
+            counts = {"calls": self.calls, "errors": self.errors, "running": self.running}
+        return {
+            "workers": DB_WORKERS,
+            **counts,
+            "queue_wait_ms": self._summary(queue_wait),
+            "query_ms": self._summary(query),
+        }
+
+
+metrics = ExecutorMetrics()
+_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="market-db")
+
+
+async def run(fn: Callable[..., T], *args: Any) -> T:
+    """Run blocking DB work fn(*args) on the DB pool and await its result"""
+    submitted = time.perf_counter()
+
+    def call():
+        started = time.perf_counter()
+        metrics.started((started - submitted) * 1000)
+        ok = False
+        try:
+            result = fn(*args)
+            ok = True
+            return result
+        finally:
+            metrics.finished((time.perf_counter() - started) * 1000, ok)
+
+    return await asyncio.get_running_loop().run_in_executor(_executor, call)
+
+
+def fetchall(query: str, params=()) -> list:
+    """Run a read query on the calling thread's connection (use through run())"""
+    return get_connection().execute(query, params).fetchall()
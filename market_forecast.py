@@ -0,0 +1,196 @@
+"""
+Batched short-horizon price forecasts for /prices/forecast/{commodity}
+
+After each ingest the (commodity, market) series it touched are loaded into
+one series x day NumPy matrix covering FORECAST_HISTORY_DAYS. Every series
+is fitted at once, with the time loop running over days and the arithmetic
+vectorised across series:
+
+    ses             simple exponential smoothing; alpha is picked per series
+                    from ALPHAS by one-step-ahead squared error
+    seasonal_naive  the price on the same weekday a week earlier
+
+Whichever model had the lower one-step error for a series provides its
+next FORECAST_HORIZON_DAYS days, stored in price_forecasts so the endpoint
+is a plain lookup.
+"""
+
+import os
+import time
+import logging
+from datetime import date as date_type, timedelta
+from typing import Iterable, List, Optional
+
+import numpy as np
+
+import market_queries
+import market_trends
+
+logger = logging.getLogger(__name__)
+
+FORECAST_HISTORY_DAYS = int(os.getenv("FORECAST_HISTORY_DAYS", "60"))
+FORECAST_HORIZON_DAYS = 7
+SEASON_DAYS = 7
+ALPHAS = np.array([0.1, 0.3, 0.5, 0.7, 0.9])
+# Series with fewer observations in the history window are not forecast
+MIN_OBSERVATIONS = 3
+
+DELETE_FORECASTS = "DELETE FROM price_forecasts"
+
+INSERT_FORECAST = """
+    INSERT INTO price_forecasts
+    (commodity_id, market_id, date, horizon, forecast, lower, upper, model, generated_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, datetime('now'))
+"""
+
+FORECASTS_FOR_COMMODITY = """
+    SELECT c.name, m.name, m.city, m.state, f.date, f.horizon, f.forecast,
+           f.lower, f.upper, f.model, f.generated_at
+    FROM price_forecasts f
+    JOIN commodities c ON f.commodity_id = c.id
+    JOIN markets m ON f.market_id = m.id
+    WHERE f.commodity_id IN (SELECT id FROM commodities WHERE name LIKE ?)
+"""
+
+FORECASTS_FOR_COMMODITY_ID = FORECASTS_FOR_COMMODITY.replace(
+    "f.commodity_id IN (SELECT id FROM commodities WHERE name LIKE ?)", "f.commodity_id = ?"
+)
+
+
+def history_query(first_day: str, last_day: str, commodity_ids=None, market_ids=None):
+    """SQL and params loading the fitting window (optionally for some series)"""
+    query = """
+        SELECT commodity_id, market_id, date, price FROM daily_prices
+        WHERE date BETWEEN ? AND ? AND price IS NOT NULL
+    """
+    params: List = [first_day, last_day]
+    for column, ids in (("commodity_id", commodity_ids), ("market_id", market_ids)):
+        if ids is not None:
+            query += f" AND {column} IN ({market_queries.placeholders(ids)})"
+            params.extend(ids)
+    return query, params
+
+
+def delete_query(commodity_ids=None, market_ids=None):
+    """SQL and params dropping the stored forecasts (optionally of some series)"""
+    conditions, params = [], []
+    for column, ids in (("commodity_id", commodity_ids), ("market_id", market_ids)):
+        if ids is not None:
+            conditions.append(f"{column} IN ({market_queries.placeholders(ids)})")
+            params.extend(ids)
+    return DELETE_FORECASTS + (f" WHERE {' AND '.join(conditions)}" if conditions else ""), params
+
+
+def fit_ses(prices: np.ndarray):
+    """Exponential smoothing for every series and alpha at once.
+
+    Returns the final level and one-step RMSE per series for its best alpha.
+    """
+    n_series, n_days = prices.shape
+    alphas = ALPHAS[:, None]
+    level = np.full((len(ALPHAS), n_series), np.nan)
+    sse = np.zeros((len(ALPHAS), n_series))
+    errors = np.zeros(n_series)
+    for day in range(n_days):
+        observed = prices[:, day]
+        seen = ~np.isnan(observed)
+        predicted = ~np.isnan(level) & seen
+        residual = np.where(predicted, observed - level, 0)
+        sse += residual ** 2
+        errors += predicted[0]
+        updated = np.where(np.isnan(level), observed, level + alphas * (observed - level))
+        level = np.where(seen, updated, level)
+
+    best = np.argmin(sse, axis=0)
+    columns = np.arange(n_series)
+    rmse = np.sqrt(sse[best, columns] / np.maximum(errors, 1))
+    return level[best, columns], rmse
+
+
+def fit_seasonal_naive(prices: np.ndarray):
+    """Weekly seasonal-naive forecasts and one-step RMSE for every series"""
+    filled = market_trends.forward_fill(prices)
+    baseline = np.full_like(prices, np.nan)
+    baseline[:, SEASON_DAYS:] = filled[:, :-SEASON_DAYS]
+    residual = prices - baseline
+    scored = ~np.isnan(residual)
+    rmse = np.sqrt(np.where(scored, residual ** 2, 0).sum(axis=1) / np.maximum(scored.sum(axis=1), 1))
+    rmse[scored.sum(axis=1) == 0] = np.inf
+
+    n_days = prices.shape[1]
+    horizons = np.arange(1, FORECAST_HORIZON_DAYS + 1)
+    # Day anchor + h repeats the weekday of anchor + h - 7
+    source = n_days - 1 + horizons - SEASON_DAYS * np.ceil(horizons / SEASON_DAYS).astype(np.int64)
+    return filled[:, source], rmse
+
+
+def refresh_forecasts(
+    conn,
+    commodity_ids: Optional[Iterable[int]] = None,
+    market_ids: Optional[Iterable[int]] = None,
+    as_of: Optional[str] = None
+) -> int:
+    """Refit and store forecasts for the matching series; returns how many series.
+
+    Runs in the caller's transaction. Forecasts start the day after as_of,
+    by default the newest date in daily_prices. Every matching series' old
+    forecasts are dropped first, so one that no longer has MIN_OBSERVATIONS
+    in the window (a market gone quiet) stops being served.
+    """
+    started = time.perf_counter()
+    as_of = as_of or conn.execute("SELECT MAX(date) FROM daily_prices").fetchone()[0]
+    if as_of is None:
+        return 0
+    anchor = date_type.fromisoformat(as_of)
+    first_day = anchor - timedelta(days=FORECAST_HISTORY_DAYS - 1)
+    commodity_ids = None if commodity_ids is None else sorted(set(commodity_ids))
+    market_ids = None if market_ids is None else sorted(set(market_ids))
+    conn.execute(*delete_query(commodity_ids, market_ids))
+    query, params = history_query(first_day.isoformat(), anchor.isoformat(), commodity_ids, market_ids)
+    rows = conn.execute(query, params).fetchall()
+    if not rows:
+        return 0
+
+    pairs = np.array([(row[0], row[1]) for row in rows], dtype=np.int64)
+    day_col = (
+        np.array([row[2] for row in rows], dtype="datetime64[D]") - np.datetime64(first_day, "D")
+    ).astype(np.int64)
+    series_keys, series_idx = np.unique(pairs, axis=0, return_inverse=True)
+    prices = np.full((len(series_keys), FORECAST_HISTORY_DAYS), np.nan)
+    prices[series_idx.ravel(), day_col] = [row[3] for row in rows]
+
+    fitted = (~np.isnan(prices)).sum(axis=1) >= MIN_OBSERVATIONS
+    prices, series_keys = prices[fitted], series_keys[fitted]
+
+    ses_level, ses_rmse = fit_ses(prices)
+    seasonal, seasonal_rmse = fit_seasonal_naive(prices)
+    use_seasonal = (seasonal_rmse < ses_rmse) & ~np.isnan(seasonal).any(axis=1)
+
+    horizons = np.arange(1, FORECAST_HORIZON_DAYS + 1)
+    forecast = np.where(use_seasonal[:, None], seasonal, ses_level[:, None])
+    rmse = np.where(use_seasonal, seasonal_rmse, ses_rmse)
+    # Rough 95% band widening with the square root of the horizon
+    spread = 1.96 * rmse[:, None] * np.sqrt(horizons)
+    lower = np.maximum(forecast - spread, 0)
+    upper = forecast + spread
+
+    keys = series_keys.tolist()
+    dates = [(anchor + timedelta(days=int(h))).isoformat() for h in horizons]
+    models = np.where(use_seasonal, "seasonal_naive", "ses").tolist()
+    forecast, lower, upper = (np.round(values, 2).tolist() for values in (forecast, lower, upper))
+    conn.executemany(INSERT_FORECAST, [
+        (commodity_id, market_id, dates[h], h + 1, forecast[s][h], lower[s][h], upper[s][h], models[s])
+        for s, (commodity_id, market_id) in enumerate(keys)
+        for h in range(FORECAST_HORIZON_DAYS)
+    ])
+
+    logger.info(
+        f"Forecast {len(keys)} series ({int(use_seasonal.sum())} seasonal-naive) "
+        f"in {(time.perf_counter() - started) * 1000:.1f} ms"
+    )
+    return len(keys)
+
+
+def backfill_forecasts(conn):
+    """Migration step: forecast every series from the stored history"""
+    refresh_forecasts(conn)
@@ -0,0 +1,188 @@
+"""
+Market coordinates and the spatial index behind /prices/nearby
+
+Markets get latitude/longitude from the bundled offline gazetteer below:
+the market's city when it is listed, otherwise its state's main wholesale
+market city (the scraped markets are state-wide, "Multiple Cities").
+
+The in-memory index buckets markets into a GRID_DEGREES lat/lon grid, so
+a radius query only looks at the handful of cells overlapping its bounding
+box before the exact haversine check.
+"""
+
+import math
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0
+# ~55 km cells: a 50 km query touches at most a 3x3 block
+GRID_DEGREES = 0.5
+MAX_RADIUS_KM = 500
+
+LatLon = Tuple[float, float]
+
+# Main wholesale market city per state, used for state-wide markets
+STATE_COORDINATES: Dict[str, LatLon] = {
+    "Andhra Pradesh": (16.5062, 80.6480),      # Vijayawada
+    "Arunachal Pradesh": (27.0844, 93.6053),   # Itanagar
+    "Assam": (26.1445, 91.7362),               # Guwahati
+    "Bihar": (25.5941, 85.1376),               # Patna
+    "Chhattisgarh": (21.2514, 81.6296),        # Raipur
+    "Goa": (15.4909, 73.8278),                 # Panaji
+    "Gujarat": (23.0225, 72.5714),             # Ahmedabad
+    "Haryana": (29.6857, 76.9905),             # Karnal
+    "Himachal Pradesh": (31.1048, 77.1734),    # Shimla
+    "Jharkhand": (23.3441, 85.3096),           # Ranchi
+    "Karnataka": (12.9716, 77.5946),           # Bengaluru
+    "Kerala": (9.9312, 76.2673),               # Kochi
+    "Madhya Pradesh": (23.2599, 77.4126),      # Bhopal
+    "Maharashtra": (19.0771, 72.9986),         # Vashi, Navi Mumbai
+    "Manipur": (24.8170, 93.9368),             # Imphal
+    "Meghalaya": (25.5788, 91.8933),           # Shillong
+    "Mizoram": (23.7271, 92.7176),             # Aizawl
+    "Nagaland": (25.9091, 93.7266),            # Dimapur
+    "Odisha": (20.2961, 85.8245),              # Bhubaneswar
+    "Punjab": (30.9010, 75.8573),              # Ludhiana
+    "Rajasthan": (26.9124, 75.7873),           # Jaipur
+    "Sikkim": (27.3389, 88.6065),              # Gangtok
+    "Tamil Nadu": (13.0827, 80.2707),          # Chennai
+    "Telangana": (17.3850, 78.4867),           # Hyderabad
+    "Tripura": (23.8315, 91.2868),             # Agartala
+    "Uttar Pradesh": (26.8467, 80.9462),       # Lucknow
+    "Uttarakhand": (30.3165, 78.0322),         # Dehradun
+    "West Bengal": (22.5726, 88.3639),         # Kolkata
+    "Delhi": (28.7073, 77.1751),               # Azadpur
+    "Puducherry": (11.9416, 79.8083),
+    "Jammu and Kashmir": (34.0837, 74.7973),   # Srinagar
+    "Ladakh": (34.1526, 77.5771),              # Leh
+}
+
+# Major mandi cities, for markets scraped or imported with a real city
+CITY_COORDINATES: Dict[str, LatLon] = {
+    "agartala": (23.8315, 91.2868), "agra": (27.1767, 78.0081),
+    "ahmedabad": (23.0225, 72.5714), "aizawl": (23.7271, 92.7176),
+    "amritsar": (31.6340, 74.8723), "azadpur": (28.7073, 77.1751),
+    "belagavi": (15.8497, 74.4977), "bengaluru": (12.9716, 77.5946),
+    "bangalore": (12.9716, 77.5946), "bhopal": (23.2599, 77.4126),
+    "bhubaneswar": (20.2961, 85.8245), "bilaspur": (22.0797, 82.1409),
+    "chandigarh": (30.7333, 76.7794), "chennai": (13.0827, 80.2707),
+    "coimbatore": (11.0168, 76.9558), "cuttack": (20.4625, 85.8830),
+    "dehradun": (30.3165, 78.0322), "delhi": (28.6139, 77.2090),
+    "dhanbad": (23.7957, 86.4304), "dimapur": (25.9091, 93.7266),
+    "gangtok": (27.3389, 88.6065), "gaya": (24.7914, 85.0002),
+    "guntur": (16.3067, 80.4365), "gurugram": (28.4595, 77.0266),
+    "guwahati": (26.1445, 91.7362), "gwalior": (26.2183, 78.1828),
+    "haridwar": (29.9457, 78.1642), "hubballi": (15.3647, 75.1240),
+    "hubli": (15.3647, 75.1240), "hyderabad": (17.3850, 78.4867),
+    "imphal": (24.8170, 93.9368), "indore": (22.7196, 75.8577),
+    "itanagar": (27.0844, 93.6053), "jabalpur": (23.1815, 79.9864),
+    "jaipur": (26.9124, 75.7873), "jammu": (32.7266, 74.8570),
+    "jamshedpur": (22.8046, 86.2029), "jodhpur": (26.2389, 73.0243),
+    "kanpur": (26.4499, 80.3319), "karnal": (29.6857, 76.9905),
+    "kochi": (9.9312, 76.2673), "ernakulam": (9.9816, 76.2999),
+    "kohima": (25.6751, 94.1086), "kolkata": (22.5726, 88.3639),
+    "kota": (25.2138, 75.8648), "kozhikode": (11.2588, 75.7804),
+    "leh": (34.1526, 77.5771), "lucknow": (26.8467, 80.9462),
+    "ludhiana": (30.9010, 75.8573), "madurai": (9.9252, 78.1198),
+    "mangaluru": (12.9141, 74.8560), "mumbai": (19.0760, 72.8777),
+    "mysuru": (12.2958, 76.6394), "nagpur": (21.1458, 79.0882),
+    "nashik": (19.9975, 73.7898), "navi mumbai": (19.0330, 73.0297),
+    "panaji": (15.4909, 73.8278), "patna": (25.5941, 85.1376),
+    "puducherry": (11.9416, 79.8083), "pune": (18.5204, 73.8567),
+    "raipur": (21.2514, 81.6296), "rajkot": (22.3039, 70.8022),
+    "ranchi": (23.3441, 85.3096), "salem": (11.6643, 78.1460),
+    "shillong": (25.5788, 91.8933), "shimla": (31.1048, 77.1734),
+    "siliguri": (26.7271, 88.3953), "srinagar": (34.0837, 74.7973),
+    "surat": (21.1702, 72.8311), "thiruvananthapuram": (8.5241, 76.9366),
+    "tiruchirappalli": (10.7905, 78.7047), "vadodara": (22.3072, 73.1812),
+    "varanasi": (25.3176, 82.9739), "vashi": (19.0771, 72.9986),
+    "vijayawada": (16.5062, 80.6480), "visakhapatnam": (17.6868, 83.2185),
+    "warangal": (17.9689, 79.5941),
+}
+
+
+def locate(city: Optional[str], state: Optional[str]) -> Optional[LatLon]:
+    """Gazetteer coordinates for a market's city, else its state"""
+    if city:
+        coords = CITY_COORDINATES.get(" ".join(city.casefold().split()))
+        if coords:
+            return coords
+    return STATE_COORDINATES.get(state) if state else None
+
+
+def geocode_markets(conn):
+    """Migration step: fill markets.latitude/longitude from the gazetteer"""
+    updates = []
+    for market_id, city, state in conn.execute(
+        "SELECT id, city, state FROM markets WHERE latitude IS NULL"
+    ).fetchall():
+        coords = locate(city, state)
+        if coords:
+            updates.append((coords[0], coords[1], market_id))
+    conn.executemany("UPDATE markets SET latitude = ?, longitude = ? WHERE id = ?", updates)
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def _cell(lat: float, lon: float) -> Tuple[int, int]:
+    return math.floor(lat / GRID_DEGREES), math.floor(lon / GRID_DEGREES)
+
+
+class MarketGrid:
+    """Markets bucketed by GRID_DEGREES lat/lon cells"""
+
+    def __init__(self):
+        self.cells: Dict[Tuple[int, int], List[Tuple[int, float, float]]] = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def load(self, conn):
+        """Build the grid from geocoded markets (once per process)"""
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            cells: Dict[Tuple[int, int], List[Tuple[int, float, float]]] = {}
+            rows = conn.execute(
+                "SELECT id, latitude, longitude FROM markets WHERE latitude IS NOT NULL"
+            ).fetchall()
+            for market_id, lat, lon in rows:
+                cells.setdefault(_cell(lat, lon), []).append((market_id, lat, lon))
+            self.cells = cells
+            self._loaded = True
+            logger.info(f"Indexed {len(rows)} markets in {len(cells)} grid cells")
+
+    def add(self, market_id: int, lat: float, lon: float):
+        with self._lock:
+            if self._loaded:
+                self.cells.setdefault(_cell(lat, lon), []).append((market_id, lat, lon))
+
+    def nearby(self, lat: float, lon: float, radius_km: float, limit: int) -> List[Tuple[int, float]]:
+        """(market_id, distance_km) within radius_km, nearest first"""
+        lat_span = radius_km / 111.0
+        lon_span = radius_km / (111.0 * max(math.cos(math.radians(lat)), 0.01))
+        min_cell = _cell(lat - lat_span, lon - lon_span)
+        max_cell = _cell(lat + lat_span, lon + lon_span)
+
+        found = []
+        for cell_lat in range(min_cell[0], max_cell[0] + 1):
+            for cell_lon in range(min_cell[1], max_cell[1] + 1):
+                for market_id, market_lat, market_lon in self.cells.get((cell_lat, cell_lon), ()):
+                    distance = haversine_km(lat, lon, market_lat, market_lon)
+                    if distance <= radius_km:
+                        found.append((market_id, round(distance, 2)))
+        found.sort(key=lambda hit: hit[1])
+        return found[:limit]
+
+
+grid = MarketGrid()
@@ -0,0 +1,269 @@
+"""
+Batched ingestion of scraped mandi prices into market_prices.db
+
+A whole state's scraped rows are written in one transaction: commodity and
+market IDs come from in-memory dictionaries warmed from the tables, rows
+that look like outliers against their series' recent prices are diverted
+to price_quarantine, and the rest are upserted into daily_prices with a
+single executemany. The daily rollups for every series the batch touched
+are refreshed in that same transaction, price alerts crossed by the batch
+are marked triggered, and the response cache generation is bumped once it
+commits. While /prices/stream has listeners, the prices that changed are
+published to them after commit.
+
+Price trends, forecasts and matrix cells are refreshed by refresh_derived.
+A single batch does that in its own transaction; a caller writing many
+batches (a national refresh) collects what each one touched and calls it
+once at the end.
+"""
+
+import time
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import market_alerts
+import market_aliases
+import market_anomaly
+import market_cache
+import market_db
+import market_forecast
+import market_geo
+import market_matrix
+import market_rollups
+import market_stream
+import market_trends
+
+logger = logging.getLogger(__name__)
+
+UPSERT_DAILY_PRICE = """
+    INSERT INTO daily_prices
+    (commodity_id, market_id, price, min_price, max_price, modal_price, date)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (commodity_id, market_id, date) DO UPDATE SET
+        price = excluded.price,
+        min_price = excluded.min_price,
+        max_price = excluded.max_price,
+        modal_price = excluded.modal_price
+"""
+
+MarketKey = Tuple[str, Optional[str], str]
+
+# One written price: (commodity_id, market_id, date)
+SeriesDay = Tuple[int, int, str]
+
+
+class IdCache:
+    """Name -> id dictionaries for commodities and markets.
+
+    Lookups that miss insert the row inside the caller's transaction; the new
+    IDs are only published to the shared dictionaries once that transaction
+    has committed, so a rollback can never leave a dangling ID behind.
+    Callers collect new IDs in a pending dict and hand it to publish().
+    """
+
+    def __init__(self):
+        self.commodities: Dict[str, int] = {}
+        self.markets: Dict[MarketKey, int] = {}
+        self._warm = False
+        self._lock = threading.Lock()
+
+    def warm(self, conn):
+        """Load every known commodity and market ID (once per process)"""
+        if self._warm:
+            return
+        with self._lock:
+            if self._warm:
+                return
+            self.commodities = {
+                name: commodity_id
+                for commodity_id, name in conn.execute("SELECT id, name FROM commodities")
+            }
+            self.markets = {
+                (name, city, state): market_id
+                for market_id, name, city, state in conn.execute(
+                    "SELECT id, name, city, state FROM markets"
+                )
+            }
+            self._warm = True
+            logger.info(
+                f"Warmed ID cache with {len(self.commodities)} commodities "
+                f"and {len(self.markets)} markets"
+            )
+
+    def invalidate(self):
+        """Forget every cached ID; the next ingest re-reads the tables"""
+        with self._lock:
+            self.commodities = {}
+            self.markets = {}
+            self._warm = False
+
+    def commodity_id(self, conn, name: str, pending: Dict[str, int]) -> int:
+        commodity_id = self.commodities.get(name) or pending.get(name)
+        if commodity_id is None:
+            conn.execute(
+                "INSERT OR IGNORE INTO commodities (name, category, unit, local_names) VALUES (?, ?, ?, ?)",
+                (name, "vegetable", "kg", market_aliases.local_names_for(name))
+            )
+            commodity_id = conn.execute(
+                "SELECT id FROM commodities WHERE name = ?", (name,)
+            ).fetchone()[0]
+            pending[name] = commodity_id
+        return commodity_id
+
+    def market_id(self, conn, key: MarketKey, pending: Dict[MarketKey, int]) -> int:
+        market_id = self.markets.get(key) or pending.get(key)
+        if market_id is None:
+            name, city, state = key
+            latitude, longitude = market_geo.locate(city, state) or (None, None)
+            conn.execute(
+                "INSERT OR IGNORE INTO markets (name, city, state, market_type, latitude, longitude) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (name, city, state, "wholesale", latitude, longitude)
+            )
+            # NULL and '' cities are the same market (see migration 12)
+            market_id = conn.execute(
+                "SELECT id FROM markets WHERE name = ? AND IFNULL(city, '') = IFNULL(?, '') AND state = ?", key
+            ).fetchone()[0]
+            pending[key] = market_id
+        return market_id
+
+    def publish(self, commodities: Dict[str, int], markets: Dict[MarketKey, int]):
+        """Make IDs created in the current transaction visible after commit"""
+        if commodities or markets:
+            market_db.after_commit(lambda: self._merge(commodities, markets))
+
+    def _merge(self, commodities: Dict[str, int], markets: Dict[MarketKey, int]):
+        self.commodities.update(commodities)
+        self.markets.update(markets)
+        for name, commodity_id in commodities.items():
+            market_aliases.aliases.add(commodity_id, name, market_aliases.local_names_for(name))
+        for (_, city, state), market_id in markets.items():
+            coords = market_geo.locate(city, state)
+            if coords:
+                market_geo.grid.add(market_id, *coords)
+
+
+ids = IdCache()
+
+
+def _today() -> str:
+    return datetime.now().strftime('%Y-%m-%d')
+
+
+def refresh_derived(conn, touched: Set[SeriesDay]):
+    """Trends, forecasts and matrix cells for the prices written.
+
+    Runs in the caller's transaction.
+    """
+    if not touched:
+        return
+    commodity_ids = {key[0] for key in touched}
+    market_ids = {key[1] for key in touched}
+    market_trends.refresh_trends(conn, {key[2] for key in touched}, commodity_ids, market_ids)
+    market_forecast.refresh_forecasts(conn, commodity_ids, market_ids)
+    market_matrix.refresh_pivot(conn, commodity_ids, market_ids)
+    market_cache.mark_changed(conn)
+
+
+def ingest_prices(
+    rows: Iterable[dict],
+    date: Optional[str] = None,
+    screen: bool = True,
+    touched: Optional[Set[SeriesDay]] = None
+) -> int:
+    """Upsert a batch of scraped price rows in a single transaction.
+
+    Each row is a dict with commodity, market_name, city, state, price,
+    min_price, max_price and modal_price; an optional per-row date overrides
+    the batch date (today by default). Suspect rows are quarantined unless
+    screen is False (rows released after review). Returns the number of
+    rows written.
+
+    With a touched set, the derived data is left to the caller: the written
+    (commodity_id, market_id, date) keys are added to it once the batch
+    commits, for one refresh_derived() over every batch.
+    """
+    started = time.perf_counter()
+    date = date or _today()
+    rows = list(rows)
+    new_commodities: Dict[str, int] = {}
+    new_markets: Dict[MarketKey, int] = {}
+
+    with market_db.transaction() as conn:
+        ids.warm(conn)
+        batch: List[market_anomaly.ScoredRow] = []
+        for row in rows:
+            commodity_id = ids.commodity_id(conn, row["commodity"], new_commodities)
+            market_id = ids.market_id(
+                conn, (row["market_name"], row.get("city"), row["state"]), new_markets
+            )
+            batch.append((commodity_id, market_id, row["price"], row.get("date") or date))
+        if screen and batch:
+            keep = market_anomaly.screen(conn, batch, rows)
+            rows = [row for row, kept in zip(rows, keep) if kept]
+            batch = [scored for scored, kept in zip(batch, keep) if kept]
+
+        params: List[tuple] = []
+        rollup_keys = set()
+        batch_prices: List[Tuple[str, float]] = []
+        streamed: List[dict] = []
+        streaming = market_stream.broker.has_subscribers()
+        for row, (commodity_id, market_id, price, row_date) in zip(rows, batch):
+            params.append((
+                commodity_id, market_id, price, row.get("min_price"),
+                row.get("max_price"), row.get("modal_price"), row_date
+            ))
+            rollup_keys.add((commodity_id, row["state"], row_date))
+            batch_prices.append((row["commodity"], price))
+            if streaming:
+                streamed.append({
+                    "commodity_id": commodity_id, "market_id": market_id,
+                    "commodity": row["commodity"], "market_name": row["market_name"],
+                    "city": row.get("city"), "state": row["state"], "price": price,
+                    "min_price": row.get("min_price"), "max_price": row.get("max_price"),
+                    "modal_price": row.get("modal_price"), "date": row_date,
+                })
+        if params:
+            if streamed:
+                previous = market_stream.previous_prices(
+                    conn, {p["commodity_id"] for p in streamed}, {p["market_id"] for p in streamed}
+                )
+                changes = market_stream.price_changes(previous, streamed)
+                market_db.after_commit(lambda: market_stream.broker.publish(changes))
+            conn.executemany(UPSERT_DAILY_PRICE, params)
+            market_rollups.refresh_rollups(conn, rollup_keys)
+            market_alerts.index.evaluate(conn, market_alerts.batch_price_ranges(batch_prices))
+            market_cache.mark_changed(conn)
+            written = {(param[0], param[1], param[6]) for param in params}
+            if touched is None:
+                refresh_derived(conn, written)
+            else:
+                market_db.after_commit(lambda: touched.update(written))
+        ids.publish(new_commodities, new_markets)
+
+    logger.info(
+        f"Ingested {len(params)} price rows in {(time.perf_counter() - started) * 1000:.1f} ms"
+    )
+    return len(params)
+
+
+def get_commodity_id(name: str) -> int:
+    """Resolve (or create) a single commodity ID"""
+    pending: Dict[str, int] = {}
+    with market_db.transaction() as conn:
+        ids.warm(conn)
+        commodity_id = ids.commodity_id(conn, name, pending)
+        ids.publish(pending, {})
+    return commodity_id
+
+
+def get_market_id(name: str, city: Optional[str], state: str) -> int:
+    """Resolve (or create) a single market ID"""
+    pending: Dict[MarketKey, int] = {}
+    with market_db.transaction() as conn:
+        ids.warm(conn)
+        market_id = ids.market_id(conn, (name, city, state), pending)
+        ids.publish({}, pending)
+    return market_id
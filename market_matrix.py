@@ -0,0 +1,224 @@
+"""
+Commodity x market pivot of latest prices behind /prices/matrix
+
+The pivot holds every (commodity, market) pair's latest modal price in one
+dense NumPy matrix, with row/column dictionaries mapping IDs to positions.
+It is loaded once, then each ingest re-reads only the pairs it touched
+(through the (commodity_id, market_id, date) index) and patches those
+cells after commit, so a request is array slicing plus a vectorised
+min/max per commodity, without re-running the join for every market.
+
+Updates copy the arrays and swap them in, so readers always see one
+consistent snapshot without taking the lock.
+"""
+
+import time
+import logging
+import threading
+from datetime import date as date_type
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+import market_aliases
+import market_db
+import market_queries
+
+logger = logging.getLogger(__name__)
+
+_EPOCH = date_type(1970, 1, 1)
+
+# Latest modal (else wholesale) price per pair; SQLite takes the bare
+# columns from the row holding MAX(date)
+LATEST_PRICES = """
+    SELECT dp.commodity_id, c.name, dp.market_id, m.name, m.city, m.state,
+           COALESCE(dp.modal_price, dp.price), MAX(dp.date)
+    FROM daily_prices dp
+    JOIN commodities c ON dp.commodity_id = c.id
+    JOIN markets m ON dp.market_id = m.id
+    {where}
+    GROUP BY dp.commodity_id, dp.market_id
+"""
+
+
+def latest_prices_query(commodity_ids=None, market_ids=None) -> Tuple[str, List]:
+    """SQL and params for the latest price of every pair (or the given ones)"""
+    clauses, params = [], []
+    for column, ids in (("dp.commodity_id", commodity_ids), ("dp.market_id", market_ids)):
+        if ids is not None:
+            clauses.append(f"{column} IN ({market_queries.placeholders(ids)})")
+            params.extend(ids)
+    where = "WHERE " + " AND ".join(clauses) if clauses else ""
+    return LATEST_PRICES.format(where=where), params
+
+
+class _Snapshot:
+    __slots__ = ("commodity_rows", "commodity_names", "market_cols", "markets", "market_states",
+                 "prices", "days")
+
+    def __init__(self):
+        self.commodity_rows: Dict[int, int] = {}
+        self.commodity_names: List[str] = []
+        self.market_cols: Dict[int, int] = {}
+        self.markets: List[Tuple[str, Optional[str], str]] = []
+        self.market_states = np.empty(0, dtype=object)
+        self.prices = np.empty((0, 0))
+        self.days = np.empty((0, 0), dtype=np.int32)
+
+
+class PricePivot:
+    """Latest price per (commodity, market) as a dense matrix"""
+
+    def __init__(self):
+        self.snapshot = _Snapshot()
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def load(self, conn):
+        """Build the pivot from daily_prices (once, or after invalidate())"""
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            started = time.perf_counter()
+            query, params = latest_prices_query()
+            self.snapshot = self._patched(_Snapshot(), conn.execute(query, params).fetchall())
+            self._loaded = True
+            logger.info(
+                f"Built {self.snapshot.prices.shape[0]}x{self.snapshot.prices.shape[1]} price matrix "
+                f"in {(time.perf_counter() - started) * 1000:.1f} ms"
+            )
+
+    def invalidate(self):
+        """Drop the pivot; the next request rebuilds it (e.g. after retention deletes rows)"""
+        with self._lock:
+            self._loaded = False
+            self.snapshot = _Snapshot()
+
+    def apply(self, rows: List[tuple]):
+        """Patch in freshly read LATEST_PRICES rows (a no-op until loaded)"""
+        with self._lock:
+            if self._loaded and rows:
+                self.snapshot = self._patched(self.snapshot, rows)
+
+    @staticmethod
+    def _patched(old: _Snapshot, rows: List[tuple]) -> _Snapshot:
+        new = _Snapshot()
+        new.commodity_rows = dict(old.commodity_rows)
+        new.commodity_names = list(old.commodity_names)
+        new.market_cols = dict(old.market_cols)
+        new.markets = list(old.markets)
+        for commodity_id, commodity, market_id, market, city, state, _, _ in rows:
+            if commodity_id not in new.commodity_rows:
+                new.commodity_rows[commodity_id] = len(new.commodity_names)
+                new.commodity_names.append(commodity)
+            if market_id not in new.market_cols:
+                new.market_cols[market_id] = len(new.markets)
+                new.markets.append((market, city, state))
+
+        shape = (len(new.commodity_names), len(new.markets))
+        new.prices = np.full(shape, np.nan)
+        new.days = np.full(shape, -1, dtype=np.int32)
+        new.prices[:old.prices.shape[0], :old.prices.shape[1]] = old.prices
+        new.days[:old.days.shape[0], :old.days.shape[1]] = old.days
+        new.market_states = np.array([(state or "").casefold() for _, _, state in new.markets], dtype=object)
+
+        for commodity_id, _, market_id, _, _, _, price, day in rows:
+            r, c = new.commodity_rows[commodity_id], new.market_cols[market_id]
+            ordinal = (date_type.fromisoformat(day) - _EPOCH).days
+            # Backfilled history never overwrites a newer price
+            if ordinal >= new.days[r, c] and price is not None:
+                new.prices[r, c] = price
+                new.days[r, c] = ordinal
+        return new
+
+    def view(self, state: Optional[str] = None, commodity_ids: Optional[List[int]] = None) -> dict:
+        """Pivot for the markets of a state (all markets by default) and the
+        given commodities (every commodity priced there by default)"""
+        snap = self.snapshot
+        cols = np.arange(len(snap.markets))
+        if state:
+            cols = cols[snap.market_states == state.casefold()]
+        if commodity_ids is None:
+            rows = np.arange(len(snap.commodity_names))
+        else:
+            rows = np.array([snap.commodity_rows.get(cid, -1) for cid in commodity_ids], dtype=np.int64)
+
+        known = rows >= 0
+        prices = np.full((len(rows), len(cols)), np.nan)
+        days = np.full((len(rows), len(cols)), -1, dtype=np.int32)
+        prices[known] = snap.prices[np.ix_(rows[known], cols)]
+        days[known] = snap.days[np.ix_(rows[known], cols)]
+
+        priced = ~np.isnan(prices)
+        # Only markets quoting at least one requested commodity, and (unless
+        # asked for by name) only commodities quoted somewhere
+        keep_cols = priced.any(axis=0)
+        cols, prices, days, priced = cols[keep_cols], prices[:, keep_cols], days[:, keep_cols], priced[:, keep_cols]
+        if commodity_ids is None:
+            keep_rows = priced.any(axis=1)
+            rows, prices, days, priced = rows[keep_rows], prices[keep_rows], days[keep_rows], priced[keep_rows]
+
+        has_price = priced.any(axis=1)
+        if len(cols):
+            lowest = np.where(priced, prices, np.inf).argmin(axis=1)
+            highest = np.where(priced, prices, -np.inf).argmax(axis=1)
+        else:
+            lowest = highest = np.zeros(len(rows), dtype=np.int64)
+        low = np.where(has_price, np.where(priced, prices, np.inf).min(axis=1, initial=np.inf), np.nan)
+        high = np.where(has_price, np.where(priced, prices, -np.inf).max(axis=1, initial=-np.inf), np.nan)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            spread_percent = np.where(low > 0, (high - low) / low * 100, np.nan)
+
+        markets = [snap.markets[c] for c in cols]
+        names = [market for market, _, _ in markets]
+        commodities = []
+        for i, row in enumerate(rows):
+            quoted = bool(has_price[i])
+            commodities.append({
+                "commodity": snap.commodity_names[row] if row >= 0 else None,
+                "prices": [None if np.isnan(p) else round(float(p), 2) for p in prices[i]],
+                "dates": [None if d < 0 else date_type.fromordinal(_EPOCH.toordinal() + int(d)).isoformat()
+                          for d in days[i]],
+                "min_price": round(float(low[i]), 2) if quoted else None,
+                "max_price": round(float(high[i]), 2) if quoted else None,
+                "spread": round(float(high[i] - low[i]), 2) if quoted else None,
+                "spread_percent": round(float(spread_percent[i]), 1) if quoted and low[i] > 0 else None,
+                "best_buy_market": names[lowest[i]] if quoted else None,
+                "best_sell_market": names[highest[i]] if quoted else None,
+            })
+        newest = days[priced].max() if priced.any() else -1
+        return {
+            "state": state,
+            "as_of": date_type.fromordinal(_EPOCH.toordinal() + int(newest)).isoformat() if newest >= 0 else None,
+            "markets": [{"market_name": name, "city": city, "state": st} for name, city, st in markets],
+            "commodities": commodities,
+        }
+
+
+pivot = PricePivot()
+
+
+def refresh_pivot(conn, commodity_ids: Iterable[int], market_ids: Iterable[int]):
+    """Re-read the pairs an ingest touched and patch the pivot once it commits.
+
+    Runs in the caller's transaction; the read is cheap, so it happens even
+    when the pivot isn't loaded yet (a load racing this commit then still
+    gets the update).
+    """
+    query, params = latest_prices_query(sorted(set(commodity_ids)), sorted(set(market_ids)))
+    rows = conn.execute(query, params).fetchall()
+    market_db.after_commit(lambda: pivot.apply(rows))
+
+
+def get_matrix(state: Optional[str] = None, commodity_ids: Optional[List[int]] = None) -> dict:
+    """Pivot view, loading the matrix on first use"""
+    with market_db.connection() as conn:
+        pivot.load(conn)
+        matrix = pivot.view(state, commodity_ids)
+        # Requested commodities without any price yet aren't in the pivot
+        for commodity_id, entry in zip(commodity_ids or (), matrix["commodities"]):
+            if entry["commodity"] is None:
+                entry["commodity"] = market_aliases.aliases.names.get(commodity_id)
+    return matrix
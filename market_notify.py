@@ -0,0 +1,286 @@
+"""
+Transactional outbox and batched delivery for triggered price alerts
+
+Alert evaluation writes one alert_outbox row per triggered alert in the same
+transaction that marks price_alerts as triggered, so a notification exists
+exactly when its alert fired. An asyncio worker drains the outbox in
+batches: due rows are leased, coalesced into one message per farmer, sent
+through the configured sink, and then marked delivered or rescheduled with
+exponential backoff.
+
+ALERT_SINK selects the sink: "local" (default, logs and keeps messages in
+memory), "webhook" (ALERT_WEBHOOK_URL) or "sms" (SMS_GATEWAY_URL).
+"""
+
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+from typing import Dict, List, Optional
+
+import requests
+
+import market_db
+
+logger = logging.getLogger(__name__)
+
+# Set ALERT_DELIVERY=0 to leave notifications queued (tests, offline work)
+DELIVERY_ENABLED = os.getenv("ALERT_DELIVERY", "1") != "0"
+BATCH_SIZE = int(os.getenv("ALERT_OUTBOX_BATCH", "500"))
+POLL_SECONDS = float(os.getenv("ALERT_OUTBOX_POLL_SECONDS", "5"))
+# Leased rows are invisible to other workers until the lease runs out
+LEASE_SECONDS = 120
+MAX_ATTEMPTS = int(os.getenv("ALERT_MAX_ATTEMPTS", "8"))
+RETRY_BASE_SECONDS = 10
+RETRY_MAX_SECONDS = 3600
+# Farmers notified in parallel per batch
+DELIVERY_CONCURRENCY = 16
+SINK_TIMEOUT = 10
+
+ENQUEUE_NOTIFICATION = """
+    INSERT INTO alert_outbox (alert_id, farmer_id, payload, next_attempt_at)
+    VALUES (?, ?, ?, ?)
+"""
+
+DUE_NOTIFICATIONS = """
+    SELECT id, farmer_id, payload, attempts
+    FROM alert_outbox
+    WHERE status = 'pending' AND next_attempt_at <= ?
+    ORDER BY next_attempt_at
+    LIMIT ?
+"""
+
+LEASE_NOTIFICATION = "UPDATE alert_outbox SET next_attempt_at = ? WHERE id = ?"
+
+MARK_DELIVERED = """
+    UPDATE alert_outbox
+    SET status = 'delivered', attempts = attempts + 1, delivered_at = datetime('now'), last_error = NULL
+    WHERE id = ?
+"""
+
+MARK_RETRY = """
+    UPDATE alert_outbox
+    SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?
+    WHERE id = ?
+"""
+
+
+def enqueue(conn, triggered: List[dict]):
+    """Queue a notification per triggered alert inside conn's transaction"""
+    if not triggered:
+        return
+    now = time.time()
+    conn.executemany(ENQUEUE_NOTIFICATION, [
+        (alert["id"], alert["farmer_id"], json.dumps(alert, ensure_ascii=False), now)
+        for alert in triggered
+    ])
+    market_db.after_commit(worker.wake)
+
+
+def format_message(alerts: List[dict]) -> str:
+    """One human-readable text covering every alert for a farmer"""
+    lines = [
+        f"{alert['commodity']} price {alert['alert_type']} target ₹{alert['target_price']}, "
+        f"current ₹{alert['current_price']}"
+        for alert in alerts
+    ]
+    return "Price alert: " + "; ".join(lines)
+
+
+class LocalSink:
+    """Logs notifications and keeps the most recent ones in memory"""
+
+    name = "local"
+
+    def __init__(self, keep: int = 1000):
+        self.sent = deque(maxlen=keep)
+
+    async def send(self, farmer_id: Optional[str], alerts: List[dict]):
+        self.sent.append({"farmer_id": farmer_id, "alerts": alerts})
+        logger.info(f"Notification for Farmer {farmer_id}: {format_message(alerts)}")
+
+
+class WebhookSink:
+    """POSTs {farmer_id, alerts} as JSON to a webhook"""
+
+    name = "webhook"
+
+    def __init__(self, url: str):
+        self.url = url
+
+    async def send(self, farmer_id: Optional[str], alerts: List[dict]):
+        response = await asyncio.to_thread(
+            requests.post, self.url, json={"farmer_id": farmer_id, "alerts": alerts}, timeout=SINK_TIMEOUT
+        )
+        response.raise_for_status()
+
+
+class SmsSink:
+    """Sends one text per farmer through an HTTP SMS gateway.
+
+    The recipient is the alert's farmer_id; farmers sign in with their
+    mobile number, which the gateway resolves.
+    """
+
+    name = "sms"
+
+    def __init__(self, url: str, api_key: Optional[str] = None, sender: Optional[str] = None):
+        self.url = url
+        self.api_key = api_key
+        self.sender = sender
+
+    async def send(self, farmer_id: Optional[str], alerts: List[dict]):
+        headers = {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+        payload = {"to": farmer_id, "from": self.sender, "message": format_message(alerts)}
+        response = await asyncio.to_thread(
+            requests.post, self.url, json=payload, headers=headers, timeout=SINK_TIMEOUT
+        )
+        response.raise_for_status()
+
+
+def sink_from_env():
+    """Build the sink named by ALERT_SINK"""
+    kind = os.getenv("ALERT_SINK", "local")
+    if kind == "webhook":
+        return WebhookSink(os.environ["ALERT_WEBHOOK_URL"])
+    if kind == "sms":
+        return SmsSink(
+            os.environ["SMS_GATEWAY_URL"], os.getenv("SMS_GATEWAY_API_KEY"), os.getenv("SMS_SENDER_ID")
+        )
+    return LocalSink()
+
+
+def retry_delay(attempts: int) -> float:
+    """Exponential backoff with jitter after the given number of failed attempts"""
+    delay = min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS)
+    return delay * random.uniform(0.8, 1.2)
+
+
+class OutboxWorker:
+    """Drains alert_outbox in batches on the event loop"""
+
+    def __init__(self, sink=None):
+        self.sink = sink
+        self.stats = {"delivered": 0, "retried": 0, "failed": 0, "messages": 0}
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def start(self):
+        """Start draining on the running event loop"""
+        if self._task is not None:
+            return
+        self.sink = self.sink or sink_from_env()
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run(), name="alert-outbox")
+        logger.info(f"Alert outbox worker started with the {self.sink.name} sink")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._loop = None
+
+    def wake(self):
+        """Thread-safe nudge to drain now instead of at the next poll"""
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _run(self):
+        while True:
+            try:
+                claimed = await self.drain_once()
+            except Exception as e:
+                logger.error(f"Alert outbox drain failed: {e}")
+                claimed = 0
+            # A full batch means more is probably waiting
+            if claimed >= BATCH_SIZE:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def _claim(self) -> List[tuple]:
+        """Lease up to BATCH_SIZE due notifications"""
+        now = time.time()
+        with market_db.transaction() as conn:
+            rows = conn.execute(DUE_NOTIFICATIONS, (now, BATCH_SIZE)).fetchall()
+            conn.executemany(LEASE_NOTIFICATION, [(now + LEASE_SECONDS, row[0]) for row in rows])
+        return rows
+
+    def _record(self, delivered: List[int], retries: List[tuple]):
+        with market_db.transaction() as conn:
+            conn.executemany(MARK_DELIVERED, [(outbox_id,) for outbox_id in delivered])
+            conn.executemany(MARK_RETRY, retries)
+
+    async def drain_once(self) -> int:
+        """Deliver one batch of due notifications; returns how many were claimed"""
+        rows = await market_db.run(self._claim)
+        if not rows:
+            return 0
+
+        # Coalesce: one message per farmer, however many alerts fired
+        by_farmer: Dict[Optional[str], List[tuple]] = {}
+        for row in rows:
+            by_farmer.setdefault(row[1], []).append(row)
+
+        limit = asyncio.Semaphore(DELIVERY_CONCURRENCY)
+
+        async def deliver(farmer_id, farmer_rows):
+            async with limit:
+                try:
+                    await self.sink.send(farmer_id, [json.loads(row[2]) for row in farmer_rows])
+                    return farmer_rows, None
+                except Exception as e:
+                    return farmer_rows, str(e) or type(e).__name__
+
+        delivered: List[int] = []
+        retries: List[tuple] = []
+        now = time.time()
+        for farmer_rows, error in await asyncio.gather(
+            *(deliver(farmer_id, farmer_rows) for farmer_id, farmer_rows in by_farmer.items())
+        ):
+            self.stats["messages"] += error is None
+            for outbox_id, farmer_id, _, attempts in farmer_rows:
+                if error is None:
+                    delivered.append(outbox_id)
+                    continue
+                attempts += 1
+                if attempts >= MAX_ATTEMPTS:
+                    status = "failed"
+                    self.stats["failed"] += 1
+                    logger.error(f"Giving up on notification {outbox_id} for Farmer {farmer_id}: {error}")
+                else:
+                    status = "pending"
+                    self.stats["retried"] += 1
+                retries.append((status, attempts, now + retry_delay(attempts), error[:500], outbox_id))
+
+        self.stats["delivered"] += len(delivered)
+        await market_db.run(self._record, delivered, retries)
+        logger.info(
+            f"Alert outbox batch: {len(rows)} notifications for {len(by_farmer)} farmers, "
+            f"{len(delivered)} delivered, {len(retries)} to retry"
+        )
+        return len(rows)
+
+    def status(self) -> dict:
+        return {
+            "running": self._task is not None,
+            "sink": getattr(self.sink, "name", None),
+            **self.stats,
+        }
+
+
+worker = OutboxWorker()
@@ -0,0 +1,203 @@
+"""
+SQL behind the /prices/* endpoints
+
+Filters on commodity, state and market are applied as IN (...) subqueries
+over the small commodities/markets tables, so daily_prices is always reached
+through one of its composite indexes instead of being walked row by row.
+History is served from the pre-aggregated price_rollups table, stitched
+with the weekly/monthly tiers that retention downsamples old data into.
+
+Listings can be paged with a keyset cursor on (date, id): each page seeks
+past the last row of the previous one through the date index, so deep pages
+cost the same as the first.
+check_query_plans.py verifies this with EXPLAIN QUERY PLAN.
+"""
+
+import base64
+from typing import List, Optional, Tuple
+
+MAX_PAGE_SIZE = 1000
+
+
+def placeholders(values) -> str:
+    """'?,?,?' for an IN (...) list with one parameter per value"""
+    return ",".join("?" * len(values))
+
+
+# Keyset pagination: pages are ordered newest first and seek past the
+# (date, id) of the previous page's last row
+KEYSET_ORDER = "dp.date DESC, dp.id DESC"
+KEYSET_CLAUSE = "(dp.date, dp.id) < (?, ?)"
+
+PRICE_COLUMNS = """
+    SELECT dp.id, c.name, m.name, m.city, m.state, dp.price,
+           dp.min_price, dp.max_price, dp.modal_price, dp.date, dp.trend_percent,
+           dp.trend_7d_percent
+    FROM daily_prices dp
+    JOIN commodities c ON dp.commodity_id = c.id
+    JOIN markets m ON dp.market_id = m.id
+"""
+
+# History reads the per-state daily rollups; the count-weighted mean equals
+# AVG(price) over the raw daily_prices rows of that day. Ranges older than the
+# retention horizon come from the weekly and monthly aggregates instead, and
+# since every price lives in exactly one tier the three are simply stitched.
+HISTORY_TIERS = (
+    ("day", "price_rollups", "date", "date('now', ?)"),
+    ("week", "price_weekly", "period_start", "date('now', ?, '-6 days')"),
+    ("month", "price_monthly", "period_start", "date('now', ?, 'start of month')"),
+)
+
+
+def _history_sql(by_id: bool, state_filter: bool) -> str:
+    commodity_filter = (
+        "r.commodity_id = ?" if by_id
+        else "r.commodity_id IN (SELECT id FROM commodities WHERE name LIKE ?)"
+    )
+    selects = []
+    for granularity, table, column, window_start in HISTORY_TIERS:
+        selects.append(f"""
+            SELECT r.{column} AS date, SUM(r.avg_price * r.count) / SUM(r.count) as avg_price,
+                   SUM(r.count) as count, '{granularity}' AS granularity
+            FROM {table} r
+            WHERE {commodity_filter}
+              {"AND r.state = ?" if state_filter else ""}
+              AND r.{column} >= {window_start}
+            GROUP BY r.{column}
+        """)
+    return " UNION ALL ".join(selects) + " ORDER BY date DESC"
+
+
+# (filter by commodity_id, filter by state) -> history SQL
+PRICE_HISTORY = {
+    (by_id, state_filter): _history_sql(by_id, state_filter)
+    for by_id in (False, True) for state_filter in (False, True)
+}
+
+
+def price_row_to_dict(row) -> dict:
+    """Shape a PRICE_COLUMNS row the way every price endpoint returns it"""
+    return {
+        "id": row[0],
+        "commodity": row[1],
+        "market_name": row[2],
+        "city": row[3],
+        "state": row[4],
+        "price": row[5],
+        "min_price": row[6],
+        "max_price": row[7],
+        "modal_price": row[8],
+        "date": row[9],
+        "trend_percent": row[10],
+        "trend_7d_percent": row[11]
+    }
+
+
+def encode_cursor(row) -> str:
+    """Opaque cursor pointing just past a PRICE_COLUMNS row"""
+    return base64.urlsafe_b64encode(f"{row[9]}|{row[0]}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    """Inverse of encode_cursor; raises ValueError for malformed input"""
+    try:
+        date, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return date, int(row_id)
+    except Exception:
+        raise ValueError("Invalid pagination cursor")
+
+
+def paginate(query: str, params: List, clauses: List[str], after: Optional[Tuple[str, int]], limit: int):
+    """Append keyset filter, order and LIMIT to a listing built from clauses"""
+    if after:
+        clauses.append(KEYSET_CLAUSE)
+        params.extend(after)
+    if clauses:
+        query += " WHERE " + " AND ".join(clauses)
+    query += f" ORDER BY {KEYSET_ORDER} LIMIT ?"
+    params.append(limit)
+    return query, params
+
+
+def price_list_query(
+    commodity: Optional[str] = None,
+    commodity_id: Optional[int] = None,
+    state: Optional[str] = None,
+    market: Optional[str] = None,
+    order_by: str = "dp.date DESC, c.name",
+    after: Optional[Tuple[str, int]] = None,
+    limit: Optional[int] = None
+) -> Tuple[str, List]:
+    """Build the price listing SQL and params for the given substring filters.
+
+    A resolved commodity_id (see market_aliases) is matched exactly and takes
+    precedence over the commodity substring. With a limit the rows come in
+    keyset order, starting after the (date, id) given in after; otherwise
+    every match is returned in order_by order.
+    """
+    clauses = []
+    params: List[str] = []
+
+    if commodity_id is not None:
+        clauses.append("dp.commodity_id = ?")
+        params.append(commodity_id)
+    elif commodity:
+        clauses.append("dp.commodity_id IN (SELECT id FROM commodities WHERE name LIKE ?)")
+        params.append(f"%{commodity}%")
+
+    market_clauses = []
+    if state:
+        market_clauses.append("state LIKE ?")
+        params.append(f"%{state}%")
+    if market:
+        market_clauses.append("name LIKE ?")
+        params.append(f"%{market}%")
+    if market_clauses:
+        clauses.append(
+            f"dp.market_id IN (SELECT id FROM markets WHERE {' AND '.join(market_clauses)})"
+        )
+
+    if limit is not None:
+        return paginate(PRICE_COLUMNS, params, clauses, after, limit)
+
+    query = PRICE_COLUMNS
+    if clauses:
+        query += " WHERE " + " AND ".join(clauses)
+    query += f" ORDER BY {order_by}"
+    return query, params
+
+
+def history_query(
+    commodity: str, days: int, state: Optional[str] = None, commodity_id: Optional[int] = None
+) -> Tuple[str, tuple]:
+    """History SQL and params; the day window is bound, never formatted in"""
+    window = f"-{int(days)} days"
+    by_id = commodity_id is not None
+    params = (commodity_id if by_id else f"%{commodity}%",) + ((state,) if state else ()) + (window,)
+    return PRICE_HISTORY[(by_id, bool(state))], params * len(HISTORY_TIERS)
+
+
+# PRICE_COLUMNS plus the market id, to attach each row to its market's distance
+NEARBY_PRICE_COLUMNS = PRICE_COLUMNS.replace("dp.trend_7d_percent", "dp.trend_7d_percent, dp.market_id", 1)
+
+
+def nearby_prices_query(market_ids: List[int], commodity_id: Optional[int] = None) -> Tuple[str, List]:
+    """Latest day's prices at each market (for one commodity if given)"""
+    commodity_clause = "AND commodity_id = ?" if commodity_id is not None else ""
+    # Each market's newest date first, so its rows are a (market_id, date)
+    # seek; the unary + keeps the commodity filter off the commodity index
+    query = f"""
+        WITH latest (market_id, date) AS (
+            SELECT market_id, MAX(date) FROM daily_prices
+            WHERE market_id IN ({placeholders(market_ids)}) {commodity_clause}
+            GROUP BY market_id
+        )
+    """ + NEARBY_PRICE_COLUMNS + f"""
+        JOIN latest ON dp.market_id = latest.market_id AND dp.date = latest.date
+        {"WHERE +dp.commodity_id = ?" if commodity_id is not None else ""}
+        ORDER BY c.name
+    """
+    params: List = list(market_ids)
+    if commodity_id is not None:
+        params += [commodity_id, commodity_id]
+    return query, params
@@ -0,0 +1,257 @@
+"""
+Retention and downsampling for market_prices.db
+
+Raw daily_prices rows (and their daily rollups) older than
+RETENTION_DAILY_DAYS are folded into weekly aggregates per (commodity,
+state, week) and deleted; weekly aggregates older than RETENTION_WEEKLY_DAYS
+are folded into monthly ones the same way. Every price lives in exactly one
+tier, so /prices/history can stitch daily, weekly and monthly points
+together without double counting.
+
+Reviewed (released or rejected) price_quarantine rows for days before the
+daily cutoff are deleted too; pending ones stay until someone reviews them.
+
+A week that spans two months is split at the month boundary: its days in
+the later month form a short period starting on the 1st. Each weekly
+period therefore lies in one month and folds into that month exactly.
+
+Work is done a few days at a time, each chunk in its own short transaction
+followed by a bounded PRAGMA incremental_vacuum, so ingestion is never
+blocked for long and freed pages go back to the filesystem gradually.
+
+Run from the /maintenance/retention endpoint, at startup, or directly:
+
+    python market_retention.py
+
+Incremental vacuuming needs a one-off full VACUUM to switch the file's
+auto_vacuum mode. That holds the write lock for as long as the file takes
+to rewrite, so only the endpoint and the CLI do it, never startup.
+"""
+
+import os
+import time
+import logging
+from datetime import date as date_type, timedelta
+from typing import List, Optional, Set, Tuple
+
+import market_cache
+import market_db
+import market_matrix
+import market_queries
+
+logger = logging.getLogger(__name__)
+
+# Keep at least 90 days raw: analytics and forecasts read that far back
+RETENTION_DAILY_DAYS = max(int(os.getenv("RETENTION_DAILY_DAYS", "180")), 90)
+RETENTION_WEEKLY_DAYS = max(int(os.getenv("RETENTION_WEEKLY_DAYS", "730")), RETENTION_DAILY_DAYS)
+# Raw dates (or weeks) folded per transaction
+CHUNK_PERIODS = 7
+# Pages returned to the filesystem after each chunk
+VACUUM_STEP_PAGES = 2000
+# Reviewed quarantine rows deleted per transaction
+QUARANTINE_CHUNK_ROWS = 5000
+
+# Merge new aggregates into an existing period; the count-weighted means
+# stay exact because folded rows are deleted in the same transaction
+_MERGE = """
+    ON CONFLICT (commodity_id, state, period_start) DO UPDATE SET
+        avg_price = (avg_price * count + excluded.avg_price * excluded.count) / (count + excluded.count),
+        min_price = MIN(min_price, excluded.min_price),
+        max_price = MAX(max_price, excluded.max_price),
+        modal_price = (modal_price * count + excluded.modal_price * excluded.count) / (count + excluded.count),
+        count = count + excluded.count
+"""
+
+# Monday of the day's week, or the 1st of its month if that is later
+WEEK_PERIOD_START = "MAX(date({day}, 'weekday 0', '-6 days'), date({day}, 'start of month'))"
+
+FOLD_DAILY_INTO_WEEKLY = """
+    INSERT INTO price_weekly
+    (commodity_id, state, period_start, avg_price, min_price, max_price, modal_price, count)
+    SELECT dp.commodity_id, m.state, {week}, AVG(dp.price),
+           MIN(dp.min_price), MAX(dp.max_price), AVG(dp.modal_price), COUNT(*)
+    FROM daily_prices dp
+    JOIN markets m ON dp.market_id = m.id
+    WHERE dp.date >= ? AND dp.date < ?
+    GROUP BY dp.commodity_id, m.state, {week}
+""".format(week=WEEK_PERIOD_START.format(day="dp.date")) + _MERGE
+
+FOLD_WEEKLY_INTO_MONTHLY = """
+    INSERT INTO price_monthly
+    (commodity_id, state, period_start, avg_price, min_price, max_price, modal_price, count)
+    SELECT commodity_id, state, date(period_start, 'start of month'),
+           SUM(avg_price * count) / SUM(count), MIN(min_price), MAX(max_price),
+           SUM(modal_price * count) / SUM(count), SUM(count)
+    FROM price_weekly
+    WHERE period_start >= ? AND period_start < ?
+    GROUP BY commodity_id, state, date(period_start, 'start of month')
+""" + _MERGE
+
+
+def _week_start(day: date_type) -> date_type:
+    return day - timedelta(days=day.weekday())
+
+
+def _month_start(day: date_type) -> date_type:
+    return day.replace(day=1)
+
+
+def week_period_start(day: date_type) -> date_type:
+    """Python twin of WEEK_PERIOD_START"""
+    return max(_week_start(day), _month_start(day))
+
+
+def downsampled_periods(conn, commodity_ids, first_day: str, last_day: str) -> Set[Tuple[str, int, str, str]]:
+    """(tier, commodity_id, state, period_start) already aggregated for days in [first_day, last_day]"""
+    ids = sorted(set(commodity_ids))
+    periods = set()
+    for tier, table, first in (
+        ("week", "price_weekly", _week_start(date_type.fromisoformat(first_day))),
+        ("month", "price_monthly", _month_start(date_type.fromisoformat(first_day))),
+    ):
+        rows = conn.execute(
+            f"SELECT commodity_id, state, period_start FROM {table} "
+            f"WHERE commodity_id IN ({market_queries.placeholders(ids)}) AND period_start BETWEEN ? AND ?",
+            ids + [first.isoformat(), last_day]
+        )
+        periods.update((tier, *row) for row in rows)
+    return periods
+
+
+def is_downsampled(periods: Set[Tuple[str, int, str, str]], commodity_id: int, state: str, day: date_type) -> bool:
+    """Whether a raw price for day falls in a period already folded into a tier.
+
+    Its raw rows are gone, so such a price can't be merged without counting
+    the period twice. Weeks folded before they were split at month
+    boundaries start on the Monday, so both starts are checked.
+    """
+    return (
+        ("week", commodity_id, state, week_period_start(day).isoformat()) in periods
+        or ("week", commodity_id, state, _week_start(day).isoformat()) in periods
+        or ("month", commodity_id, state, _month_start(day).isoformat()) in periods
+    )
+
+
+def enable_incremental_vacuum():
+    """Switch the file to auto_vacuum=INCREMENTAL (a one-off full VACUUM)"""
+    conn = market_db.get_connection()
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return
+    logger.info("Converting market DB to incremental auto-vacuum")
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+
+
+def incremental_vacuum(pages: int = VACUUM_STEP_PAGES) -> int:
+    """Release up to pages free pages; returns how many remain free"""
+    conn = market_db.get_connection()
+    # executescript steps the pragma to completion; execute() frees one page
+    conn.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+    return conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+
+def _fold_daily(cutoff: str) -> int:
+    """Fold raw days older than cutoff into weekly aggregates, a chunk at a time"""
+    folded = 0
+    while True:
+        with market_db.transaction() as conn:
+            dates: List[str] = [
+                row[0] for row in conn.execute(
+                    "SELECT DISTINCT date FROM daily_prices WHERE date < ? ORDER BY date LIMIT ?",
+                    (cutoff, CHUNK_PERIODS)
+                )
+            ]
+            if not dates:
+                return folded
+            # Dates are ISO strings, so the half-open range covers the chunk
+            upper = (date_type.fromisoformat(dates[-1]) + timedelta(days=1)).isoformat()
+            conn.execute(FOLD_DAILY_INTO_WEEKLY, (dates[0], upper))
+            folded += conn.execute(
+                "DELETE FROM daily_prices WHERE date >= ? AND date < ?", (dates[0], upper)
+            ).rowcount
+            conn.execute("DELETE FROM price_rollups WHERE date >= ? AND date < ?", (dates[0], upper))
+            conn.execute("DELETE FROM price_forecasts WHERE date < ?", (upper,))
+            market_cache.mark_changed(conn)
+            # A market silent since before the cutoff loses its latest price
+            market_db.after_commit(market_matrix.pivot.invalidate)
+        incremental_vacuum()
+
+
+def _fold_weekly(cutoff: str) -> int:
+    """Fold weekly aggregates older than cutoff into monthly ones"""
+    folded = 0
+    while True:
+        with market_db.transaction() as conn:
+            weeks: List[str] = [
+                row[0] for row in conn.execute(
+                    "SELECT DISTINCT period_start FROM price_weekly WHERE period_start < ? "
+                    "ORDER BY period_start LIMIT ?",
+                    (cutoff, CHUNK_PERIODS)
+                )
+            ]
+            if not weeks:
+                return folded
+            upper = (date_type.fromisoformat(weeks[-1]) + timedelta(days=1)).isoformat()
+            conn.execute(FOLD_WEEKLY_INTO_MONTHLY, (weeks[0], upper))
+            folded += conn.execute(
+                "DELETE FROM price_weekly WHERE period_start >= ? AND period_start < ?", (weeks[0], upper)
+            ).rowcount
+            market_cache.mark_changed(conn)
+        incremental_vacuum()
+
+
+def _prune_quarantine(cutoff: str) -> int:
+    """Delete reviewed quarantine rows dated before cutoff, a chunk at a time"""
+    pruned = 0
+    while True:
+        with market_db.transaction() as conn:
+            deleted = conn.execute(
+                "DELETE FROM price_quarantine WHERE id IN ("
+                "    SELECT id FROM price_quarantine"
+                "    WHERE status IN ('released', 'rejected') AND date < ? LIMIT ?"
+                ")",
+                (cutoff, QUARANTINE_CHUNK_ROWS)
+            ).rowcount
+        pruned += deleted
+        if deleted < QUARANTINE_CHUNK_ROWS:
+            return pruned
+        incremental_vacuum()
+
+
+def run_retention(today: Optional[date_type] = None, convert_vacuum: bool = False) -> dict:
+    """Apply both retention tiers and report what moved.
+
+    convert_vacuum first switches the file to incremental auto-vacuum (a
+    full VACUUM, once); without it freed pages are only reclaimed on files
+    already converted.
+    """
+    started = time.perf_counter()
+    today = today or date_type.today()
+    # Whole weeks/months only, so a period is never split across tiers
+    daily_cutoff = _week_start(today - timedelta(days=RETENTION_DAILY_DAYS))
+    weekly_cutoff = _month_start(today - timedelta(days=RETENTION_WEEKLY_DAYS))
+
+    if convert_vacuum:
+        enable_incremental_vacuum()
+    daily_rows = _fold_daily(daily_cutoff.isoformat())
+    weekly_rows = _fold_weekly(weekly_cutoff.isoformat())
+    quarantine_rows = _prune_quarantine(daily_cutoff.isoformat())
+    free_pages = incremental_vacuum()
+
+    report = {
+        "daily_cutoff": daily_cutoff.isoformat(),
+        "weekly_cutoff": weekly_cutoff.isoformat(),
+        "daily_rows_downsampled": daily_rows,
+        "weekly_rows_downsampled": weekly_rows,
+        "quarantine_rows_pruned": quarantine_rows,
+        "free_pages": free_pages,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+    logger.info(f"Retention run: {report}")
+    return report
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    market_db.init_schema()
+    print(run_retention(convert_vacuum=True))
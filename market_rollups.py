@@ -0,0 +1,39 @@
+"""
+Daily price rollups per (commodity, state, date)
+
+price_rollups holds avg/min/max/modal/count for every commodity, state and
+day. The ingestion path recomputes just the keys a batch touched, inside the
+same transaction, so /prices/history reads pre-aggregated rows with an
+indexed range scan instead of grouping daily_prices on every call.
+"""
+
+from typing import Iterable, Tuple
+
+# Recompute one (commodity_id, state, date) rollup from daily_prices
+ROLLUP_UPSERT = """
+    INSERT INTO price_rollups
+    (commodity_id, state, date, avg_price, min_price, max_price, modal_price, count)
+    SELECT dp.commodity_id, ?, dp.date, AVG(dp.price), MIN(dp.min_price),
+           MAX(dp.max_price), AVG(dp.modal_price), COUNT(*)
+    FROM daily_prices dp
+    WHERE dp.commodity_id = ?
+      AND dp.market_id IN (SELECT id FROM markets WHERE state = ?)
+      AND dp.date = ?
+    GROUP BY dp.commodity_id, dp.date
+    ON CONFLICT (commodity_id, state, date) DO UPDATE SET
+        avg_price = excluded.avg_price,
+        min_price = excluded.min_price,
+        max_price = excluded.max_price,
+        modal_price = excluded.modal_price,
+        count = excluded.count
+"""
+
+RollupKey = Tuple[int, str, str]
+
+
+def refresh_rollups(conn, keys: Iterable[RollupKey]):
+    """Bring the rollups for (commodity_id, state, date) keys up to date"""
+    conn.executemany(
+        ROLLUP_UPSERT,
+        [(state, commodity_id, state, date) for commodity_id, state, date in keys]
+    )
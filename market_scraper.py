@@ -0,0 +1,401 @@
+"""
+Concurrent scraper engine for vegetablemarketprice.com state pages
+
+All states are fetched and parsed in parallel by a bounded thread pool
+sharing one keep-alive requests.Session, while the calling thread writes
+each state's rows as they arrive: one writer, so states never queue on the
+database lock. Trends, forecasts and the price matrix are refreshed once
+for the whole national batch rather than per state. Each page is revalidated with the ETag /
+Last-Modified of the last fetch whose prices were ingested, so a page the
+site hasn't changed comes back as 304 and is neither parsed nor
+re-ingested. Every run returns
+per-state timings so slow states are easy to spot.
+
+Pages can be recorded to and replayed from a fixtures directory
+(SCRAPE_RECORD_DIR / SCRAPE_REPLAY_DIR), so the parse and ingest path runs
+without network access; scrape_replay.py records fixtures and benchmarks
+that path.
+
+Request handlers never scrape inline: revalidate_in_background() serves as
+the stale-while-revalidate trigger, starting at most one background refresh
+per state once its data is older than PRICE_TTL_SECONDS.
+"""
+
+import os
+import re
+import time
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Set, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+import html_parsing
+import market_db
+import market_ingest
+
+logger = logging.getLogger(__name__)
+
+# Supported states (display names) for convenience in frontend
+SUPPORTED_STATES = [
+    "Andhra Pradesh", "Arunachal Pradesh", "Assam", "Bihar", "Chhattisgarh",
+    "Goa", "Gujarat", "Haryana", "Himachal Pradesh", "Jharkhand",
+    "Karnataka", "Kerala", "Madhya Pradesh", "Maharashtra", "Manipur",
+    "Meghalaya", "Mizoram", "Nagaland", "Odisha", "Punjab",
+    "Rajasthan", "Sikkim", "Tamil Nadu", "Telangana", "Tripura",
+    "Uttar Pradesh", "Uttarakhand", "West Bengal", "Delhi", "Puducherry",
+    "Jammu and Kashmir", "Ladakh"
+]
+
+BASE_URL = "https://vegetablemarketprice.com/market/{slug}/today"
+REQUEST_TIMEOUT = 15
+
+# Enough workers to fetch every state at once, so a national refresh takes
+# about as long as the slowest state plus the (single-threaded) writes
+MAX_WORKERS = int(os.getenv("SCRAPE_WORKERS", str(len(SUPPORTED_STATES))))
+
+# How long a state's prices count as fresh, and how long to wait before
+# retrying a state whose last refresh failed
+PRICE_TTL_SECONDS = int(os.getenv("PRICE_TTL_SECONDS", "1800"))
+RETRY_AFTER_SECONDS = int(os.getenv("SCRAPE_RETRY_AFTER_SECONDS", "60"))
+REVALIDATE_WORKERS = int(os.getenv("REVALIDATE_WORKERS", "4"))
+
+# Save every fetched page here / serve pages from here instead of the site
+RECORD_DIR = os.getenv("SCRAPE_RECORD_DIR")
+REPLAY_DIR = os.getenv("SCRAPE_REPLAY_DIR")
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml',
+    'Accept-Encoding': 'gzip, deflate',
+    'Connection': 'keep-alive',
+}
+
+_PRICE_RE = re.compile(r"\d+(?:\.\d+)?")
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+# url -> {"etag": ..., "last_modified": ...} from the last 200 response whose
+# prices were ingested
+_validators: Dict[str, Dict[str, str]] = {}
+_validators_lock = threading.Lock()
+
+# Freshness bookkeeping, all guarded by _freshness_lock
+_refreshed_at: Dict[str, float] = {}
+_failed_at: Dict[str, float] = {}
+_inflight: Dict[str, Future] = {}
+_freshness_lock = threading.Lock()
+_revalidator = ThreadPoolExecutor(max_workers=REVALIDATE_WORKERS, thread_name_prefix="revalidate")
+
+
+def slugify_state(state_name: str) -> str:
+    """Convert state display name to vegetablemarketprice.com slug"""
+    name = state_name.strip().lower()
+    name = re.sub(r"&", " and ", name)
+    name = re.sub(r"\s+", "-", name)
+    name = re.sub(r"[^a-z\-]", "", name)
+    return name
+
+
+def canonical_state(state_name: Optional[str]) -> Optional[str]:
+    """Map user input like 'tamil nadu' to the supported display name"""
+    if not state_name:
+        return None
+    wanted = slugify_state(state_name)
+    return next((s for s in SUPPORTED_STATES if slugify_state(s) == wanted), None)
+
+
+def state_url(state_name: str) -> str:
+    return BASE_URL.format(slug=slugify_state(state_name))
+
+
+def fixture_path(directory: str, state_name: str) -> str:
+    return os.path.join(directory, f"{slugify_state(state_name)}.html")
+
+
+def record_page(directory: str, state_name: str, html: bytes):
+    """Write a fetched page to the fixtures directory (atomically)"""
+    os.makedirs(directory, exist_ok=True)
+    path = fixture_path(directory, state_name)
+    with open(path + ".tmp", "wb") as f:
+        f.write(html)
+    os.replace(path + ".tmp", path)
+
+
+def get_session() -> requests.Session:
+    """Shared keep-alive session with a connection pool sized to the workers"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=MAX_WORKERS, max_retries=1)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers.update(HEADERS)
+                _session = session
+    return _session
+
+
+def fetch_state_page(state_name: str) -> Tuple[Optional[bytes], Optional[Dict[str, str]]]:
+    """Fetch a state's price page and its validators; the page is None when
+    the site reports it unchanged.
+
+    The validators are not remembered here: scrape_state does that once the
+    page's prices have been ingested, so a failed ingest is retried in full
+    rather than answered with a 304.
+    """
+    if REPLAY_DIR:
+        with open(fixture_path(REPLAY_DIR, state_name), "rb") as f:
+            return f.read(), None
+
+    url = state_url(state_name)
+    headers = {}
+    with _validators_lock:
+        cached = _validators.get(url, {})
+    if cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+    if cached.get("last_modified"):
+        headers["If-Modified-Since"] = cached["last_modified"]
+
+    response = get_session().get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+    if response.status_code == 304:
+        return None, None
+    response.raise_for_status()
+
+    validators = {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+    }
+    if RECORD_DIR:
+        record_page(RECORD_DIR, state_name, response.content)
+    return response.content, validators if any(validators.values()) else None
+
+
+def remember_validators(state_name: str, validators: Optional[Dict[str, str]]):
+    """Revalidate the next fetch of a state's page with these validators"""
+    if validators:
+        with _validators_lock:
+            _validators[state_url(state_name)] = validators
+
+
+def _parse_price(text: str):
+    """'₹25' -> (25, 25, 25); '₹29 - 32' -> (29, 32, 30.5)"""
+    numbers = [float(n) for n in _PRICE_RE.findall(text.replace(",", ""))]
+    if not numbers:
+        return None
+    low, high = min(numbers), max(numbers)
+    return low, high, round((low + high) / 2, 2)
+
+
+def parse_state_prices(html: bytes, state_name: str) -> List[dict]:
+    """Extract one price row per vegetable from a state page.
+
+    The wholesale column is used as the price; a range like '₹29 - 32' gives
+    min/max with the midpoint as modal price. Only the page's tables are
+    parsed.
+    """
+    soup = html_parsing.parse(html, html_parsing.PRICE_TABLES, "price_pages")
+    prices = []
+    seen = set()
+
+    for table in soup.find_all('table'):
+        header = [th.get_text(" ", strip=True).lower() for th in table.find_all('th')]
+        name_col = next((i for i, h in enumerate(header) if 'vegetable' in h or 'name' in h), 1)
+        price_col = next((i for i, h in enumerate(header) if 'wholesale' in h), name_col + 1)
+
+        for tr in table.find_all('tr'):
+            cells = tr.find_all('td')
+            if len(cells) <= max(name_col, price_col):
+                continue
+            commodity = cells[name_col].get_text(" ", strip=True)
+            parsed = _parse_price(cells[price_col].get_text(" ", strip=True))
+            if not commodity or not parsed or commodity in seen:
+                continue
+            seen.add(commodity)
+            low, high, modal = parsed
+            prices.append({
+                "commodity": commodity,
+                "market_name": f"{state_name} Markets",
+                "city": "Multiple Cities",
+                "state": state_name,
+                "price": low,
+                "min_price": low,
+                "max_price": high,
+                "modal_price": modal
+            })
+
+    return prices
+
+
+def fetch_state(state_name: str) -> Tuple[dict, Optional[Dict[str, str]], float]:
+    """Fetch and parse one state without writing anything.
+
+    Returns the report (its prices parsed), the page's validators and the
+    perf_counter start time; status is "not_modified" or "error" when
+    there is nothing to write.
+    """
+    report = {"state": state_name, "status": "updated", "rows": 0, "prices": []}
+    started = time.perf_counter()
+    validators = None
+    try:
+        html, validators = fetch_state_page(state_name)
+        fetched = time.perf_counter()
+        report["fetch_ms"] = round((fetched - started) * 1000, 1)
+        if html is None:
+            report["status"] = "not_modified"
+        else:
+            report["prices"] = parse_state_prices(html, state_name)
+            report["parse_ms"] = round((time.perf_counter() - fetched) * 1000, 1)
+    except Exception as e:
+        report["status"] = "error"
+        report["error"] = str(e)
+        logger.warning(f"Scraping {state_name} failed: {e}")
+    return report, validators, started
+
+
+def write_state(
+    report: dict,
+    validators: Optional[Dict[str, str]],
+    started: float,
+    touched: Optional[Set[market_ingest.SeriesDay]] = None
+) -> dict:
+    """Ingest a fetched state's prices and finish its report.
+
+    touched is handed to ingest_prices (see there).
+    """
+    state_name = report["state"]
+    if report["status"] == "updated":
+        write_started = time.perf_counter()
+        try:
+            report["rows"] = market_ingest.ingest_prices(report["prices"], touched=touched)
+            report["ingest_ms"] = round((time.perf_counter() - write_started) * 1000, 1)
+            # Only a page whose prices are committed may be skipped next time
+            if report["prices"]:
+                remember_validators(state_name, validators)
+        except Exception as e:
+            report["status"] = "error"
+            report["error"] = str(e)
+            logger.warning(f"Ingesting {state_name} failed: {e}")
+    report["total_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    _record_outcome(state_name, report["status"] != "error")
+    return report
+
+
+def scrape_state(state_name: str) -> dict:
+    """Fetch, parse and ingest one state; returns a timing report.
+
+    status is "updated", "not_modified" (304, nothing written) or "error".
+    """
+    return write_state(*fetch_state(state_name))
+
+
+def _record_outcome(state_name: str, ok: bool):
+    with _freshness_lock:
+        if ok:
+            _refreshed_at[state_name] = time.time()
+            _failed_at.pop(state_name, None)
+        else:
+            _failed_at[state_name] = time.time()
+
+
+def is_fresh(state_name: str) -> bool:
+    refreshed = _refreshed_at.get(state_name)
+    return refreshed is not None and time.time() - refreshed < PRICE_TTL_SECONDS
+
+
+def revalidate_in_background(state_name: Optional[str]) -> bool:
+    """Start a background refresh if the state's prices are stale.
+
+    Concurrent callers for the same state share one in-flight refresh, and a
+    state that just failed isn't retried for RETRY_AFTER_SECONDS. Returns
+    True while a refresh for the state is running. Unknown states are ignored
+    so user input can't trigger arbitrary outbound fetches.
+    """
+    state = canonical_state(state_name)
+    if state is None:
+        return False
+    with _freshness_lock:
+        if state in _inflight:
+            return True
+        if is_fresh(state):
+            return False
+        failed = _failed_at.get(state)
+        if failed is not None and time.time() - failed < RETRY_AFTER_SECONDS:
+            return False
+        future = _revalidator.submit(scrape_state, state)
+        _inflight[state] = future
+    future.add_done_callback(lambda _: _finish_revalidation(state))
+    logger.info(f"Prices for {state} are stale, refreshing in the background")
+    return True
+
+
+def _finish_revalidation(state_name: str):
+    with _freshness_lock:
+        _inflight.pop(state_name, None)
+
+
+def freshness() -> List[dict]:
+    """Per-state age of the last successful scrape"""
+    now = time.time()
+    with _freshness_lock:
+        return [
+            {
+                "state": state,
+                "age_seconds": round(now - _refreshed_at[state], 1) if state in _refreshed_at else None,
+                "fresh": is_fresh(state),
+                "refreshing": state in _inflight,
+                "last_failure_seconds_ago": round(now - _failed_at[state], 1) if state in _failed_at else None,
+            }
+            for state in SUPPORTED_STATES
+        ]
+
+
+def refresh_states(states: Optional[List[str]] = None, max_workers: int = MAX_WORKERS) -> dict:
+    """Scrape the given states (all supported states by default).
+
+    The pool fetches and parses; this thread writes each state as soon as
+    it is parsed, then refreshes the derived data once for all of them.
+    """
+    states = states or SUPPORTED_STATES
+    started = time.perf_counter()
+    touched: Set[market_ingest.SeriesDay] = set()
+    by_state: Dict[str, dict] = {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(states)), thread_name_prefix="scrape") as pool:
+        for future in as_completed([pool.submit(fetch_state, state) for state in states]):
+            report = write_state(*future.result(), touched=touched)
+            by_state[report["state"]] = report
+    reports = [by_state[state] for state in states]
+
+    derived_started = time.perf_counter()
+    if touched:
+        try:
+            with market_db.transaction() as conn:
+                market_ingest.refresh_derived(conn, touched)
+        except Exception as e:
+            logger.warning(f"Refreshing trends and forecasts after the scrape failed: {e}")
+    derived_ms = round((time.perf_counter() - derived_started) * 1000, 1)
+    elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+
+    for report in reports:
+        report.pop("prices", None)
+    summary = {
+        "states": len(reports),
+        "updated": sum(r["status"] == "updated" for r in reports),
+        "not_modified": sum(r["status"] == "not_modified" for r in reports),
+        "errors": sum(r["status"] == "error" for r in reports),
+        "rows": sum(r["rows"] for r in reports),
+        "elapsed_ms": elapsed_ms,
+        "slowest_state_ms": max((r["total_ms"] for r in reports), default=0),
+        "sum_state_ms": round(sum(r["total_ms"] for r in reports), 1),
+        "derived_ms": derived_ms,
+        "per_state": reports,
+    }
+    logger.info(
+        f"Refreshed {summary['states']} states in {elapsed_ms} ms "
+        f"({summary['updated']} updated, {summary['not_modified']} unchanged, "
+        f"{summary['errors']} failed, {summary['rows']} rows)"
+    )
+    return summary
@@ -0,0 +1,148 @@
+"""
+FTS5 search over commodity and market names for /prices/search
+
+commodities_fts (name, local_names) and markets_fts (name, city, state) are
+external-content FTS5 tables with the trigram tokenizer, so any substring of
+three or more characters matches through the index. Triggers on the base
+tables keep them in sync with every insert the ingestion path makes.
+Shorter terms, or SQLite builds without FTS5, fall back to LIKE filters.
+"""
+
+import logging
+from typing import List, Optional, Tuple
+
+import market_queries
+
+logger = logging.getLogger(__name__)
+
+# Trigram indexes can only match terms of at least this many characters
+MIN_TERM_LENGTH = 3
+
+FTS_SCHEMA = (
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS commodities_fts USING fts5(
+        name, local_names, content='commodities', content_rowid='id', tokenize='trigram'
+    )
+    """,
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS markets_fts USING fts5(
+        name, city, state, content='markets', content_rowid='id', tokenize='trigram'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS commodities_fts_insert AFTER INSERT ON commodities BEGIN
+        INSERT INTO commodities_fts (rowid, name, local_names) VALUES (new.id, new.name, new.local_names);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS commodities_fts_delete AFTER DELETE ON commodities BEGIN
+        INSERT INTO commodities_fts (commodities_fts, rowid, name, local_names)
+        VALUES ('delete', old.id, old.name, old.local_names);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS commodities_fts_update AFTER UPDATE ON commodities BEGIN
+        INSERT INTO commodities_fts (commodities_fts, rowid, name, local_names)
+        VALUES ('delete', old.id, old.name, old.local_names);
+        INSERT INTO commodities_fts (rowid, name, local_names) VALUES (new.id, new.name, new.local_names);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS markets_fts_insert AFTER INSERT ON markets BEGIN
+        INSERT INTO markets_fts (rowid, name, city, state) VALUES (new.id, new.name, new.city, new.state);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS markets_fts_delete AFTER DELETE ON markets BEGIN
+        INSERT INTO markets_fts (markets_fts, rowid, name, city, state)
+        VALUES ('delete', old.id, old.name, old.city, old.state);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS markets_fts_update AFTER UPDATE ON markets BEGIN
+        INSERT INTO markets_fts (markets_fts, rowid, name, city, state)
+        VALUES ('delete', old.id, old.name, old.city, old.state);
+        INSERT INTO markets_fts (rowid, name, city, state) VALUES (new.id, new.name, new.city, new.state);
+    END
+    """,
+    "INSERT INTO commodities_fts (commodities_fts) VALUES ('rebuild')",
+    "INSERT INTO markets_fts (markets_fts) VALUES ('rebuild')",
+)
+
+_fts_available: Optional[bool] = None
+
+
+def create_search_index(conn):
+    """Migration step: build the FTS tables if this SQLite has FTS5"""
+    try:
+        conn.execute("CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(x, tokenize='trigram')")
+        conn.execute("DROP TABLE temp.fts5_probe")
+    except Exception as e:
+        logger.warning(f"FTS5 trigram tokenizer unavailable, /prices/search will use LIKE: {e}")
+        return
+    for sql in FTS_SCHEMA:
+        conn.execute(sql)
+
+
+def fts_available(conn) -> bool:
+    global _fts_available
+    if _fts_available is None:
+        _fts_available = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name IN ('commodities_fts', 'markets_fts')"
+        ).fetchone() is not None
+    return _fts_available
+
+
+def _phrase(term: str) -> str:
+    """Quote user input as a single FTS5 phrase (a substring match for trigrams)"""
+    return '"' + term.strip().replace('"', '""') + '"'
+
+
+def _indexable(term: Optional[str]) -> bool:
+    return term is None or len(term.strip()) >= MIN_TERM_LENGTH
+
+
+def search_query(
+    conn,
+    commodity: Optional[str] = None,
+    state: Optional[str] = None,
+    market: Optional[str] = None,
+    after: Optional[Tuple[str, int]] = None,
+    limit: Optional[int] = None
+) -> Tuple[str, List]:
+    """SQL and params for /prices/search, best commodity matches first.
+
+    With a limit, results come in keyset (date, id) order instead of rank so
+    they can be paged with a cursor.
+    """
+    if not (fts_available(conn) and all(_indexable(t) for t in (commodity, state, market))):
+        return market_queries.price_list_query(
+            commodity=commodity, state=state, market=market, after=after, limit=limit
+        )
+
+    params: List = []
+    query = market_queries.PRICE_COLUMNS
+    if commodity:
+        query += """
+            JOIN (SELECT rowid AS id, rank FROM commodities_fts WHERE commodities_fts MATCH ?) cm
+              ON cm.id = dp.commodity_id
+        """
+        params.append(_phrase(commodity))
+
+    market_terms = []
+    if state:
+        market_terms.append(f"state : {_phrase(state)}")
+    if market:
+        market_terms.append(f"name : {_phrase(market)}")
+    clauses = []
+    if market_terms:
+        clauses.append("dp.market_id IN (SELECT rowid FROM markets_fts WHERE markets_fts MATCH ?)")
+        params.append(" AND ".join(market_terms))
+
+    if limit is not None:
+        return market_queries.paginate(query, params, clauses, after, limit)
+
+    if clauses:
+        query += " WHERE " + " AND ".join(clauses)
+    query += " ORDER BY " + ("cm.rank, " if commodity else "") + "dp.date DESC, c.name"
+    return query, params
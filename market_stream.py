@@ -0,0 +1,171 @@
+"""
+In-process pub/sub of price changes behind the /prices/stream SSE channel
+
+Ingestion compares each batch with the latest stored price of the pairs it
+touches and, once the transaction commits, publishes only the (commodity,
+market) prices that actually changed. The broker fans each batch out on
+the event loop: subscribers are grouped by their (state, commodities)
+filter, so a batch is filtered and JSON-encoded once per distinct filter,
+then handed to every matching client's queue.
+
+A client whose queue fills up (it stopped reading) has its backlog dropped
+and gets a "resync" event telling it to re-fetch the full list.
+"""
+
+import json
+import asyncio
+import logging
+import threading
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+import market_queries
+
+logger = logging.getLogger(__name__)
+
+# Pending events per client before it is told to resync
+QUEUE_SIZE = 64
+HEARTBEAT_SECONDS = 15
+RECONNECT_MS = 5000
+
+# Latest stored price per touched pair, read before the batch is upserted;
+# SQLite takes the bare price from the row holding MAX(date)
+PREVIOUS_PRICES = """
+    SELECT commodity_id, market_id, price, MAX(date)
+    FROM daily_prices
+    WHERE commodity_id IN ({commodities}) AND market_id IN ({markets})
+    GROUP BY commodity_id, market_id
+"""
+
+FilterKey = Tuple[Optional[str], Optional[FrozenSet[int]]]
+
+
+def previous_prices(conn, commodity_ids, market_ids) -> Dict[Tuple[int, int], Tuple[float, str]]:
+    commodity_ids, market_ids = sorted(commodity_ids), sorted(market_ids)
+    query = PREVIOUS_PRICES.format(
+        commodities=market_queries.placeholders(commodity_ids),
+        markets=market_queries.placeholders(market_ids),
+    )
+    return {
+        (commodity_id, market_id): (price, day)
+        for commodity_id, market_id, price, day in conn.execute(query, commodity_ids + market_ids)
+    }
+
+
+def price_changes(previous: Dict[Tuple[int, int], Tuple[float, str]], batch: List[dict]) -> List[dict]:
+    """Batch rows that are now a pair's latest price and differ from the stored one"""
+    changes = []
+    for row in batch:
+        before = previous.get((row["commodity_id"], row["market_id"]))
+        if before is not None and (row["date"] < before[1] or row["price"] == before[0]):
+            continue
+        change = dict(row)
+        change["previous_price"] = before[0] if before else None
+        change["change_percent"] = (
+            round((row["price"] - before[0]) / before[0] * 100, 2) if before and before[0] else None
+        )
+        changes.append(change)
+    return changes
+
+
+class Subscription:
+    __slots__ = ("key", "queue", "dropped")
+
+    def __init__(self, key: FilterKey):
+        self.key = key
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.dropped = 0
+
+
+class PriceBroker:
+    """Fans price changes out to SSE subscribers on the event loop"""
+
+    def __init__(self):
+        self.groups: Dict[FilterKey, Set[Subscription]] = {}
+        self.stats = {"published": 0, "events": 0, "resyncs": 0}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Bind to the running event loop (called from the app lifespan)"""
+        self._loop = asyncio.get_running_loop()
+
+    def stop(self):
+        self._loop = None
+
+    def has_subscribers(self) -> bool:
+        return self._count > 0
+
+    def subscribe(self, state: Optional[str] = None, commodity_ids: Optional[List[int]] = None) -> Subscription:
+        """Register a client; must be called on the event loop"""
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        key = (state.casefold() if state else None, frozenset(commodity_ids) if commodity_ids else None)
+        subscription = Subscription(key)
+        with self._lock:
+            self.groups.setdefault(key, set()).add(subscription)
+            self._count += 1
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            group = self.groups.get(subscription.key)
+            if group is not None and subscription in group:
+                group.discard(subscription)
+                self._count -= 1
+                if not group:
+                    del self.groups[subscription.key]
+
+    def publish(self, changes: List[dict]):
+        """Thread-safe: fan changes out on the event loop (no-op without a loop)"""
+        loop = self._loop
+        if changes and loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._fan_out, changes)
+
+    def _fan_out(self, changes: List[dict]):
+        self.stats["published"] += 1
+        with self._lock:
+            groups = [(key, list(subscriptions)) for key, subscriptions in self.groups.items()]
+        for (state, commodity_ids), subscriptions in groups:
+            matching = [
+                change for change in changes
+                if (state is None or (change["state"] or "").casefold() == state)
+                and (commodity_ids is None or change["commodity_id"] in commodity_ids)
+            ]
+            if not matching:
+                continue
+            message = f"event: prices\ndata: {json.dumps(matching, ensure_ascii=False)}\n\n"
+            for subscription in subscriptions:
+                self._deliver(subscription, message)
+
+    def _deliver(self, subscription: Subscription, message: str):
+        try:
+            subscription.queue.put_nowait(message)
+            self.stats["events"] += 1
+        except asyncio.QueueFull:
+            # Too far behind for deltas to help: drop the backlog, ask for a reload
+            while not subscription.queue.empty():
+                subscription.queue.get_nowait()
+            subscription.dropped += 1
+            subscription.queue.put_nowait("event: resync\ndata: {}\n\n")
+            self.stats["resyncs"] += 1
+
+    async def events(self, subscription: Subscription, is_disconnected):
+        """SSE text for one client: changes as they arrive, heartbeats in between"""
+        try:
+            yield f"retry: {RECONNECT_MS}\n\n"
+            while True:
+                try:
+                    yield await asyncio.wait_for(subscription.queue.get(), timeout=HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    if await is_disconnected():
+                        break
+                    yield ": ping\n\n"
+        finally:
+            self.unsubscribe(subscription)
+
+    def status(self) -> dict:
+        return {"subscribers": self._count, "filters": len(self.groups), **self.stats}
+
+
+broker = PriceBroker()
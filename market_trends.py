@@ -0,0 +1,159 @@
+"""
+Vectorised day-over-day and 7-day price trends for daily_prices
+
+For the dates an ingest touched, the prices of the (commodity, market)
+series it wrote over the preceding TREND_LOOKBACK_DAYS are loaded into one dense
+series x day NumPy matrix. Missing days are forward-filled so each cell
+sees the latest earlier observation, and both percent changes come out of
+whole-matrix arithmetic before being written back with one executemany:
+
+    trend_percent     change since the series' previous observed day
+    trend_7d_percent  change since the price as of seven days earlier
+"""
+
+import os
+import time
+import logging
+from datetime import date as date_type, timedelta
+from typing import Iterable, List, Optional
+
+import numpy as np
+
+import market_queries
+
+logger = logging.getLogger(__name__)
+
+# Days of history loaded before the earliest target date
+TREND_LOOKBACK_DAYS = int(os.getenv("TREND_LOOKBACK_DAYS", "14"))
+# Target dates per pass when backfilling the whole table
+BACKFILL_CHUNK_DAYS = 30
+
+UPDATE_TRENDS = """
+    UPDATE daily_prices
+    SET trend_percent = ?, trend_7d_percent = ?
+    WHERE commodity_id = ? AND market_id = ? AND date = ?
+"""
+
+
+def forward_fill(matrix: np.ndarray) -> np.ndarray:
+    """Replace NaN cells with the last observed value to their left"""
+    days = np.arange(matrix.shape[1])
+    last_seen = np.where(np.isnan(matrix), 0, days)
+    np.maximum.accumulate(last_seen, axis=1, out=last_seen)
+    # Leading gaps point at column 0 and so stay NaN
+    return matrix[np.arange(matrix.shape[0])[:, None], last_seen]
+
+
+def _shift(matrix: np.ndarray, days: int) -> np.ndarray:
+    """Move every series right by days, padding with NaN"""
+    shifted = np.full_like(matrix, np.nan)
+    shifted[:, days:] = matrix[:, :-days]
+    return shifted
+
+
+def _percent_change(current: np.ndarray, base: np.ndarray) -> np.ndarray:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        change = (current - base) / base * 100
+    change[~(base > 0)] = np.nan
+    return np.round(change, 2)
+
+
+def _sql_floats(values: np.ndarray) -> list:
+    """Plain floats for executemany, with NaN as NULL"""
+    return np.where(np.isnan(values), None, values).tolist()
+
+
+def trend_query(
+    first_day: str,
+    last_day: str,
+    commodity_ids: Optional[List[int]] = None,
+    market_ids: Optional[List[int]] = None
+):
+    """SQL and params loading every price in the window (optionally for some series)"""
+    query = """
+        SELECT commodity_id, market_id, date, price FROM daily_prices
+        WHERE date BETWEEN ? AND ?
+    """
+    params: List = [first_day, last_day]
+    for column, ids in (("commodity_id", commodity_ids), ("market_id", market_ids)):
+        if ids is not None:
+            query += f" AND {column} IN ({market_queries.placeholders(ids)})"
+            params.extend(ids)
+    return query, params
+
+
+def refresh_trends(
+    conn,
+    dates: Iterable[str],
+    commodity_ids: Optional[Iterable[int]] = None,
+    market_ids: Optional[Iterable[int]] = None
+) -> int:
+    """Recompute both trend columns for the given dates (and series).
+
+    Only the touched commodities' prices in the touched markets are read and
+    rewritten, so the cost follows the batch rather than the whole table.
+    Runs in the caller's transaction; returns the number of rows updated.
+    """
+    started = time.perf_counter()
+    targets = sorted({date_type.fromisoformat(d) for d in dates})
+    if not targets:
+        return 0
+    first_day = targets[0] - timedelta(days=TREND_LOOKBACK_DAYS)
+
+    query, params = trend_query(
+        first_day.isoformat(), targets[-1].isoformat(),
+        None if commodity_ids is None else sorted(set(commodity_ids)),
+        None if market_ids is None else sorted(set(market_ids)),
+    )
+    rows = conn.execute(query, params).fetchall()
+    if not rows:
+        return 0
+
+    commodity_col = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    market_col = np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows))
+    day_col = (
+        np.array([row[2] for row in rows], dtype="datetime64[D]") - np.datetime64(first_day, "D")
+    ).astype(np.int64)
+    price_col = np.array([row[3] for row in rows], dtype=np.float64)
+
+    # One matrix row per (commodity, market) series, one column per day
+    series_keys, series_idx = np.unique(
+        np.column_stack((commodity_col, market_col)), axis=0, return_inverse=True
+    )
+    series_idx = series_idx.ravel()
+    n_days = (targets[-1] - first_day).days + 1
+    prices = np.full((len(series_keys), n_days), np.nan)
+    prices[series_idx, day_col] = price_col
+
+    filled = forward_fill(prices)
+    day_over_day = _percent_change(prices, _shift(filled, 1))
+    week_over_week = _percent_change(prices, _shift(filled, 7))
+
+    # Write back only the rows on the target dates
+    is_target = np.isin(day_col, [(d - first_day).days for d in targets])
+    s, d = series_idx[is_target], day_col[is_target]
+    updates = list(zip(
+        _sql_floats(day_over_day[s, d]),
+        _sql_floats(week_over_week[s, d]),
+        commodity_col[is_target].tolist(),
+        market_col[is_target].tolist(),
+        [row[2] for row, hit in zip(rows, is_target) if hit],
+    ))
+    conn.executemany(UPDATE_TRENDS, updates)
+
+    logger.info(
+        f"Computed trends for {len(updates)} rows across {len(series_keys)} series "
+        f"in {(time.perf_counter() - started) * 1000:.1f} ms"
+    )
+    return len(updates)
+
+
+def backfill_trends(conn):
+    """Migration step: compute trends for every date already stored"""
+    dates = [
+        row[0] for row in conn.execute(
+            "SELECT DISTINCT date FROM daily_prices WHERE date IS NOT NULL ORDER BY date"
+        )
+    ]
+    for start in range(0, len(dates), BACKFILL_CHUNK_DAYS):
+        refresh_trends(conn, dates[start:start + BACKFILL_CHUNK_DAYS])
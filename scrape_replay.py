@@ -0,0 +1,175 @@
+"""
+Offline scrape fixtures and an ingestion throughput benchmark
+
+Record every state's page once (needs network access):
+
+    python scrape_replay.py record [--dir fixtures/scrapes] [STATE ...]
+
+Then replay the fixtures through the real fetch -> parse -> ingest path,
+with no network, into a scratch database:
+
+    python scrape_replay.py bench [--dir fixtures/scrapes] [--rounds 5] [--workers N] [--db PATH]
+
+The benchmark reports pages/s parsed, rows/s ingested, the p50/p95
+per-state latency and the time spent refreshing trends, forecasts and the
+matrix once per round, for each round and overall. The first round inserts
+into an empty database; later rounds re-ingest the same day (upserts),
+as repeated refreshes do in production.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import market_db
+import market_scraper
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FIXTURES_DIR = os.path.join("fixtures", "scrapes")
+
+
+def recorded_states(directory: str) -> List[str]:
+    """Supported states that have a fixture page in directory"""
+    return [
+        state for state in market_scraper.SUPPORTED_STATES
+        if os.path.exists(market_scraper.fixture_path(directory, state))
+    ]
+
+
+def record(directory: str, states: List[str]) -> dict:
+    """Fetch each state's page from the live site and save it as a fixture"""
+    def fetch(state):
+        try:
+            html, _ = market_scraper.fetch_state_page(state)
+            market_scraper.record_page(directory, state, html)
+            return state, len(html)
+        except Exception as e:
+            logger.warning(f"Recording {state} failed: {e}")
+            return state, None
+
+    with ThreadPoolExecutor(max_workers=min(market_scraper.MAX_WORKERS, len(states))) as pool:
+        results = dict(pool.map(fetch, states))
+    return {
+        "directory": directory,
+        "recorded": sorted(state for state, size in results.items() if size is not None),
+        "failed": sorted(state for state, size in results.items() if size is None),
+        "bytes": sum(size for size in results.values() if size),
+    }
+
+
+def _percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))]
+
+
+def summarise(reports: List[dict], elapsed_s: float) -> dict:
+    """Throughput and latency over per-state scrape_state reports"""
+    updated = [r for r in reports if r["status"] == "updated"]
+    parse_s = sum(r.get("parse_ms", 0) for r in updated) / 1000
+    ingest_s = sum(r.get("ingest_ms", 0) for r in updated) / 1000
+    rows = sum(r["rows"] for r in updated)
+    latencies = [r["total_ms"] for r in updated]
+    return {
+        "pages": len(updated),
+        "errors": sum(r["status"] == "error" for r in reports),
+        "rows": rows,
+        "wall_s": round(elapsed_s, 3),
+        "pages_per_s": round(len(updated) / parse_s, 1) if parse_s else None,
+        "rows_per_s": round(rows / ingest_s, 1) if ingest_s else None,
+        "state_p50_ms": _percentile(latencies, 50),
+        "state_p95_ms": _percentile(latencies, 95),
+        "state_max_ms": max(latencies, default=0),
+    }
+
+
+def bench(directory: str, rounds: int, workers: int) -> dict:
+    """Replay the fixtures rounds times through refresh_states"""
+    states = recorded_states(directory)
+    if not states:
+        raise SystemExit(f"No fixtures in {directory}; run `python scrape_replay.py record` first")
+    market_scraper.REPLAY_DIR = directory
+    market_db.init_schema()
+
+    all_reports, per_round = [], []
+    started = time.perf_counter()
+    for round_number in range(1, rounds + 1):
+        round_started = time.perf_counter()
+        summary = market_scraper.refresh_states(states, max_workers=workers)
+        stats = summarise(summary["per_state"], time.perf_counter() - round_started)
+        per_round.append({"round": round_number, **stats, "derived_ms": summary["derived_ms"]})
+        all_reports.extend(summary["per_state"])
+        for report in summary["per_state"]:
+            if report["status"] == "error":
+                logger.warning(f"{report['state']}: {report['error']}")
+
+    return {
+        "fixtures": directory,
+        "states": len(states),
+        "rounds": per_round,
+        "overall": summarise(all_reports, time.perf_counter() - started),
+    }
+
+
+def _print_bench(result: dict):
+    print(f"Replayed {result['states']} states from {result['fixtures']}")
+    print(
+        f"{'round':>6} {'pages':>6} {'rows':>7} {'pages/s':>9} {'rows/s':>10} "
+        f"{'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} {'derived ms':>11} {'wall ms':>8}"
+    )
+    for stats in result["rounds"] + [{"round": "all", **result["overall"]}]:
+        print(
+            f"{stats['round']:>6} {stats['pages']:>6} {stats['rows']:>7} "
+            f"{stats['pages_per_s'] or '-':>9} {stats['rows_per_s'] or '-':>10} "
+            f"{stats['state_p50_ms']:>8} {stats['state_p95_ms']:>8} {stats['state_max_ms']:>8} "
+            f"{stats.get('derived_ms', '-'):>11} {stats['wall_s'] * 1000:>8.0f}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    record_cmd = commands.add_parser("record", help="save live state pages as fixtures")
+    record_cmd.add_argument("--dir", default=DEFAULT_FIXTURES_DIR)
+    record_cmd.add_argument("states", nargs="*", help="state names (default: all supported)")
+
+    bench_cmd = commands.add_parser("bench", help="replay fixtures through parse and ingest")
+    bench_cmd.add_argument("--dir", default=DEFAULT_FIXTURES_DIR)
+    bench_cmd.add_argument("--rounds", type=int, default=5)
+    bench_cmd.add_argument("--workers", type=int, default=market_scraper.MAX_WORKERS)
+    bench_cmd.add_argument("--db", help="database to ingest into (default: a temporary file)")
+    bench_cmd.add_argument("--json", action="store_true", help="print the report as JSON")
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.command == "record":
+        states = [market_scraper.canonical_state(s) or s for s in args.states] or market_scraper.SUPPORTED_STATES
+        print(json.dumps(record(args.dir, states), indent=2))
+        return
+
+    with tempfile.TemporaryDirectory() as scratch:
+        # Never benchmark against the live market_prices.db
+        market_db.DB_PATH = args.db or os.path.join(scratch, "bench.db")
+        try:
+            result = bench(args.dir, args.rounds, args.workers)
+        finally:
+            market_db.close_connections()
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        _print_bench(result)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,45 @@
+"""
+Shared fixtures: every test gets its own market_prices.db in a temp dir
+
+The modules live at the repository root, which is put on sys.path here so
+the suite runs from any working directory.
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import market_alerts  # noqa: E402
+import market_db  # noqa: E402
+import market_ingest  # noqa: E402
+import market_matrix  # noqa: E402
+
+
+@pytest.fixture
+def market_db_path(tmp_path, monkeypatch):
+    """A freshly migrated scratch database, with the in-memory indexes reset"""
+    path = str(tmp_path / "market_prices.db")
+    monkeypatch.setattr(market_db, "DB_PATH", path)
+    market_db.close_connections()
+    for index in (market_ingest.ids, market_matrix.pivot, market_alerts.index):
+        index.invalidate()
+    market_db.init_schema()
+    yield path
+    market_db.close_connections()
+
+
+def price_row(commodity: str, price: float, state: str = "Bihar", market: str = None, city: str = "Patna") -> dict:
+    """One scraped price row in the shape ingest_prices takes"""
+    return {
+        "commodity": commodity,
+        "market_name": market or f"{state} Markets",
+        "city": city,
+        "state": state,
+        "price": price,
+        "min_price": price,
+        "max_price": price,
+        "modal_price": price,
+    }
@@ -0,0 +1,61 @@
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+
+import market_anomaly
+import market_db
+import market_ingest
+from conftest import price_row
+
+START = date(2025, 3, 1)
+
+
+def _day(offset: int) -> str:
+    return (START + timedelta(days=offset)).isoformat()
+
+
+def _seed(days: int = 20, price: float = 20.0):
+    for offset in range(days):
+        market_ingest.ingest_prices([price_row("Tomato", price + (offset % 3) * 0.2)], _day(offset))
+
+
+def _statuses(conn):
+    return conn.execute("SELECT date, status FROM price_quarantine ORDER BY date").fetchall()
+
+
+def test_robust_scores_use_median_and_floored_mad():
+    history = [(1, 1, price, "2025-03-01") for price in (10, 10, 10, 11, 9)] + [(2, 1, 50, "2025-03-01")]
+    medians, z = market_anomaly.robust_scores([(1, 1, 15.0, "2025-03-02"), (2, 1, 50.0, "2025-03-02")], history)
+    assert medians[0] == 10
+    # MAD is 0, so the spread is floored at 10% of the median
+    assert z[0] == pytest.approx(market_anomaly.MAD_SCALE * 5 / 1.0)
+    # Too little history to score
+    assert np.isnan(medians[1]) and np.isnan(z[1])
+
+
+def test_unit_slip_is_quarantined_and_ordinary_move_kept(market_db_path):
+    _seed()
+    assert market_ingest.ingest_prices([price_row("Tomato", 2000)], _day(20)) == 0
+    # 30% up is within the floored spread
+    assert market_ingest.ingest_prices([price_row("Tomato", 26)], _day(21)) == 1
+    with market_db.connection() as conn:
+        assert conn.execute("SELECT price, reason FROM price_quarantine").fetchall() == [(2000, "outlier")]
+
+
+def test_level_shift_is_accepted_on_the_third_agreeing_day(market_db_path):
+    _seed()
+    written = [market_ingest.ingest_prices([price_row("Tomato", 32 + offset * 0.1)], _day(20 + offset))
+               for offset in range(4)]
+    assert written == [0, 0, 1, 1]
+    with market_db.connection() as conn:
+        assert _statuses(conn) == [(_day(20), "pending"), (_day(21), "pending")]
+        accepted = conn.execute("SELECT date FROM daily_prices WHERE price >= 32 ORDER BY date").fetchall()
+        assert accepted == [(_day(22),), (_day(23),)]
+
+
+def test_repeated_scrapes_of_one_day_do_not_count_as_agreeing_days(market_db_path):
+    _seed()
+    for _ in range(3):
+        assert market_ingest.ingest_prices([price_row("Tomato", 32)], _day(20)) == 0
+    assert market_ingest.ingest_prices([price_row("Tomato", 32)], _day(21)) == 0
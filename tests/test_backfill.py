@@ -0,0 +1,43 @@
+import csv
+from datetime import date, timedelta
+
+import market_backfill
+import market_db
+import market_retention
+
+HEADER = [
+    "State", "District Name", "Market Name", "Commodity", "Variety", "Grade",
+    "Min Price (Rs./Quintal)", "Max Price (Rs./Quintal)", "Modal Price (Rs./Quintal)", "Price Date",
+]
+
+
+def _write_dump(path, days):
+    # Past the daily horizon, so the backfill downsamples it into price_weekly
+    first = date.today() - timedelta(days=market_retention.RETENTION_DAILY_DAYS + 60)
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(HEADER)
+        for day in range(days):
+            price_date = (first + timedelta(days=day)).strftime("%d %b %Y")
+            writer.writerow(["Bihar", "Patna", "Patna", "Onion", "Local", "FAQ", 1800, 2200, 2000, price_date])
+
+
+def _weekly_total(conn):
+    return conn.execute("SELECT SUM(count), COUNT(*) FROM price_weekly").fetchone()
+
+
+def test_reloading_a_dump_leaves_downsampled_counts_unchanged(market_db_path, tmp_path):
+    dump = str(tmp_path / "dump.csv")
+    _write_dump(dump, 30)
+
+    first = market_backfill.load_files([dump])
+    with market_db.connection() as conn:
+        loaded = _weekly_total(conn)
+    assert first["rows_loaded"] == 30 and loaded[0] == 30
+
+    again = market_backfill.load_files([dump])
+    assert again["rows_loaded"] == 0
+    assert again["rows_already_downsampled"] == 30
+    with market_db.connection() as conn:
+        assert _weekly_total(conn) == loaded
+        assert conn.execute("SELECT COUNT(*) FROM daily_prices").fetchone()[0] == 0
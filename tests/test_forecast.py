@@ -0,0 +1,37 @@
+from datetime import date, timedelta
+
+import market_db
+import market_forecast
+import market_ingest
+from conftest import price_row
+
+
+def _forecast_series(conn):
+    return {
+        row for row in conn.execute(
+            "SELECT DISTINCT c.name, m.state FROM price_forecasts f "
+            "JOIN commodities c ON c.id = f.commodity_id JOIN markets m ON m.id = f.market_id"
+        )
+    }
+
+
+def test_series_gone_quiet_loses_its_forecast(market_db_path):
+    start = date(2025, 3, 1)
+    for day in range(5):
+        market_ingest.ingest_prices(
+            [price_row("Tomato", 20 + day, "Bihar"), price_row("Tomato", 30 + day, "Assam"),
+             price_row("Onion", 15 + day, "Assam")],
+            (start + timedelta(days=day)).isoformat(),
+        )
+    with market_db.connection() as conn:
+        assert ("Tomato", "Assam") in _forecast_series(conn)
+
+    # Assam keeps reporting onions but no longer tomatoes
+    later = start + timedelta(days=market_forecast.FORECAST_HISTORY_DAYS)
+    for day in range(3):
+        market_ingest.ingest_prices(
+            [price_row("Tomato", 25, "Bihar"), price_row("Onion", 18, "Assam")],
+            (later + timedelta(days=day)).isoformat(),
+        )
+    with market_db.connection() as conn:
+        assert _forecast_series(conn) == {("Tomato", "Bihar"), ("Onion", "Assam")}
@@ -0,0 +1,32 @@
+import pytest
+
+import market_db
+import market_ingest
+import market_queries
+from conftest import price_row
+
+
+def test_cursor_round_trip_and_rejects_garbage():
+    row = (42, "Tomato", "Patna", "Patna", "Bihar", 20, 18, 22, 20, "2025-03-01", None, None)
+    assert market_queries.decode_cursor(market_queries.encode_cursor(row)) == ("2025-03-01", 42)
+    with pytest.raises(ValueError):
+        market_queries.decode_cursor("not-a-cursor")
+
+
+def test_keyset_pages_cover_every_row_once_newest_first(market_db_path):
+    for day in range(1, 4):
+        market_ingest.ingest_prices(
+            [price_row(name, 20) for name in ("Tomato", "Onion", "Potato")], f"2025-03-0{day}"
+        )
+    seen, after = [], None
+    with market_db.connection() as conn:
+        while True:
+            query, params = market_queries.price_list_query(state="Bihar", after=after, limit=2)
+            rows = conn.execute(query, params).fetchall()
+            if not rows:
+                break
+            seen.extend(rows)
+            after = market_queries.decode_cursor(market_queries.encode_cursor(rows[-1]))
+        everything = conn.execute("SELECT date, id FROM daily_prices ORDER BY date DESC, id DESC").fetchall()
+    assert [(row[9], row[0]) for row in seen] == everything
+    assert len(everything) == 9
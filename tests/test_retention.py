@@ -0,0 +1,60 @@
+from datetime import date, timedelta
+
+import market_db
+import market_ingest
+import market_retention
+from conftest import price_row
+
+# Far enough on that the test weeks are past the daily horizon but not the weekly one
+TODAY = date(2025, 11, 20)
+
+
+def _weekly(conn):
+    return conn.execute(
+        "SELECT period_start, avg_price, count FROM price_weekly ORDER BY period_start"
+    ).fetchall()
+
+
+def test_week_period_start_splits_at_month_boundary():
+    assert market_retention.week_period_start(date(2025, 4, 30)) == date(2025, 4, 28)
+    assert market_retention.week_period_start(date(2025, 5, 1)) == date(2025, 5, 1)
+    assert market_retention.week_period_start(date(2025, 5, 4)) == date(2025, 5, 1)
+    assert market_retention.week_period_start(date(2025, 5, 5)) == date(2025, 5, 5)
+
+
+def test_week_spanning_two_months_folds_into_two_periods(market_db_path):
+    # Monday 28 April to Sunday 4 May
+    for offset in range(7):
+        day = (date(2025, 4, 28) + timedelta(days=offset)).isoformat()
+        market_ingest.ingest_prices([price_row("Tomato", 20)], day)
+    market_retention.run_retention(today=TODAY)
+    with market_db.connection() as conn:
+        assert _weekly(conn) == [("2025-04-28", 20.0, 3), ("2025-05-01", 20.0, 4)]
+        assert conn.execute("SELECT COUNT(*) FROM daily_prices").fetchone()[0] == 0
+
+
+def test_late_rows_merge_count_weighted(market_db_path):
+    for day, price in ((5, 10), (6, 10)):
+        market_ingest.ingest_prices([price_row("Tomato", price)], f"2025-05-0{day}")
+    market_retention.run_retention(today=TODAY)
+    # A price for the same week arriving after it was folded
+    market_ingest.ingest_prices([price_row("Tomato", 40)], "2025-05-07")
+    market_retention.run_retention(today=TODAY)
+    with market_db.connection() as conn:
+        assert _weekly(conn) == [("2025-05-05", 20.0, 3)]
+
+
+def test_prunes_only_reviewed_quarantine_rows_past_the_horizon(market_db_path):
+    with market_db.transaction() as conn:
+        conn.executemany(
+            "INSERT INTO price_quarantine (commodity, market_name, state, price, date, status, reason) "
+            "VALUES ('Tomato', 'Patna', 'Bihar', 1, ?, ?, 'outlier')",
+            [("2025-01-01", "pending"), ("2025-01-01", "released"), ("2025-01-02", "rejected"),
+             (TODAY.isoformat(), "rejected")],
+        )
+    report = market_retention.run_retention(today=TODAY)
+    assert report["quarantine_rows_pruned"] == 2
+    with market_db.connection() as conn:
+        assert conn.execute("SELECT date, status FROM price_quarantine ORDER BY id").fetchall() == [
+            ("2025-01-01", "pending"), (TODAY.isoformat(), "rejected")
+        ]
@@ -0,0 +1,87 @@
+"""
+Background warm-up for slow startup work
+
+Seed scrapes and cache priming used to run at import time, so every worker
+start, reload and test import waited on the network before the app could
+serve. They now run as warm-up stages in background threads started from
+the app lifespan, and their progress backs the /health and /ready endpoints.
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Set WARMUP_ON_STARTUP=0 to skip warm-up (tests, offline development)
+WARMUP_ENABLED = os.getenv("WARMUP_ON_STARTUP", "1") != "0"
+
+
+class WarmUp:
+    """Runs named stages concurrently and records status and timing for each"""
+
+    def __init__(self):
+        self.stages: Dict[str, dict] = {}
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def _run_stage(self, name: str, fn: Callable[[], object]):
+        with self._lock:
+            self.stages[name]["status"] = "running"
+        started = time.perf_counter()
+        try:
+            fn()
+            status, error = "done", None
+        except Exception as e:
+            status, error = "failed", str(e)
+            logger.warning(f"Warm-up stage {name} failed: {e}")
+        duration_ms = round((time.perf_counter() - started) * 1000, 1)
+        with self._lock:
+            self.stages[name].update(status=status, duration_ms=duration_ms, error=error)
+        logger.info(f"Warm-up stage {name} {status} in {duration_ms} ms")
+
+    def _run(self, stages: List[Tuple[str, Callable[[], object]]]):
+        threads = [
+            threading.Thread(target=self._run_stage, args=stage, name=f"warmup-{stage[0]}", daemon=True)
+            for stage in stages
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.finished_at = time.time()
+        logger.info(f"Warm-up finished in {round(self.finished_at - self.started_at, 2)} s")
+
+    def start(self, stages: List[Tuple[str, Callable[[], object]]]) -> threading.Thread:
+        """Kick off every stage in the background and return immediately"""
+        self.started_at = time.time()
+        self.finished_at = None
+        with self._lock:
+            self.stages = {name: {"status": "pending", "duration_ms": None, "error": None} for name, _ in stages}
+        runner = threading.Thread(target=self._run, args=(stages,), name="warmup", daemon=True)
+        runner.start()
+        return runner
+
+    @property
+    def ready(self) -> bool:
+        """True once every stage has finished (successfully or not)"""
+        return self.finished_at is not None or (self.started_at is None and not WARMUP_ENABLED)
+
+    def status(self) -> dict:
+        with self._lock:
+            stages = {name: dict(info) for name, info in self.stages.items()}
+        elapsed = None
+        if self.started_at is not None:
+            elapsed = round((self.finished_at or time.time()) - self.started_at, 2)
+        return {
+            "ready": self.ready,
+            "enabled": WARMUP_ENABLED,
+            "elapsed_seconds": elapsed,
+            "stages": stages,
+        }
+
+
+warmup = WarmUp()